@@ -0,0 +1,73 @@
+import os
+import threading
+from pathlib import Path
+from typing import Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows (desenvolvimento): um worker só, o lock vale apenas entre threads
+    fcntl = None
+
+
+class FileLock:
+    """
+    Lock exclusivo entre processos (flock em <path>) e entre threads do mesmo processo.
+    Liberado pelo sistema se o processo morrer, então serve também para eleger
+    um único worker responsável por uma tarefa (acquire(blocking=False) periódico).
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._thread_lock = threading.Lock()
+        self._fd: Optional[int] = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if not self._thread_lock.acquire(blocking):
+            return False
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        except BaseException:
+            self._thread_lock.release()
+            raise
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BaseException as e:
+                os.close(fd)
+                self._thread_lock.release()
+                # outro processo tem o lock
+                if isinstance(e, BlockingIOError):
+                    return False
+                raise
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        fd, self._fd = self._fd, None
+        if fd is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+        self._thread_lock.release()
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+def file_signature(path: Path) -> Optional[Tuple[int, int, int]]:
+    """(inode, mtime_ns, tamanho) do arquivo, para saber se outro processo o substituiu (None = não existe)."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
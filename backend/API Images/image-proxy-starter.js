@@ -228,13 +228,22 @@ async function startImageProxy() {
     '--host',
     '127.0.0.1',  // Usar localhost ao invés de 0.0.0.0 para evitar problemas de permissão
     '--port',
-    imageProxyPort
+    imageProxyPort,
+    // o log de acesso vem do próprio proxy (JSON, amostrado, com X-Request-ID)
+    '--no-access-log'
   ];
 
+  // Vários workers (IMAGE_PROXY_WORKERS): índice e cache em disco são compartilhados
+  // (um worker atualiza o índice com o GitHub, os outros leem o snapshot); incompatível com --reload
+  const imageProxyWorkers = parseInt(process.env.IMAGE_PROXY_WORKERS, 10) || 1;
+  if (imageProxyWorkers > 1) {
+    uvicornArgs.push('--workers', String(imageProxyWorkers));
+  }
+
   // Em desenvolvimento, adicionar --reload apenas se não estiver rodando com nodemon
   // O nodemon já faz reload do Node.js, e o --reload do uvicorn cria arquivos temporários
   // que o nodemon detecta, causando loops de reinicialização
-  if (process.env.NODE_ENV !== 'production' && !process.env.NODEMON_RUNNING) {
+  if (process.env.NODE_ENV !== 'production' && !process.env.NODEMON_RUNNING && imageProxyWorkers === 1) {
     uvicornArgs.push('--reload');
     console.log('[IMAGE-PROXY] Modo desenvolvimento: --reload habilitado');
   } else {
@@ -258,10 +267,20 @@ async function startImageProxy() {
   imageProxyProcess._port = imageProxyPort;
 
   // Log de saída
+  // o 'data' pode cortar uma linha no meio: guardar o resto até o próximo bloco
+  let stdoutRest = '';
   imageProxyProcess.stdout.on('data', (data) => {
-    const output = data.toString().trim();
-    if (output) {
-      console.log(`[IMAGE-PROXY] ${output}`);
+    const lines = (stdoutRest + data.toString()).split('\n');
+    stdoutRest = lines.pop();
+    for (const line of lines) {
+      const output = line.trim();
+      if (!output) continue;
+      // linhas JSON (logs estruturados) passam sem prefixo para o Cloud Logging interpretar
+      if (output.startsWith('{')) {
+        process.stdout.write(`${output}\n`);
+      } else {
+        console.log(`[IMAGE-PROXY] ${output}`);
+      }
     }
   });
 
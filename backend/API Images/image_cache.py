@@ -0,0 +1,319 @@
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from file_lock import FileLock
+
+logger = logging.getLogger("image_proxy.disk_cache")
+
+# chaves aceitas: blob SHA do Git (40 hex) e derivados simples (sem "/" nem "..")
+_KEY_REGEX = re.compile(r"^[0-9A-Za-z][0-9A-Za-z._-]*$")
+_TMP_SUFFIX = ".tmp"
+# subdiretório das gravações em partes (a chave só é conhecida no fim)
+_INCOMING_DIR = "incoming"
+# temporários mais velhos que isso são sobras de escrita interrompida
+# (mais novos podem ser de outro worker escrevendo agora)
+_TMP_MAX_AGE = 3600
+_EVICT_LOCK = ".evict.lock"
+
+
+class DiskImageCache:
+    """
+    Cache em disco endereçado por conteúdo: chave = blob SHA do Git.
+    Arquivos ficam em <root>/<sha[:2]>/<sha>, escritos de forma atômica
+    (arquivo temporário + os.replace) e sobrevivem a restarts.
+    Quando o tamanho total passa de max_bytes, remove os menos usados (LRU).
+    Vários workers podem usar o mesmo root: o que um grava os outros encontram
+    (get/contains olham o disco), e rescan() recalcula o total real sob um lock de arquivo.
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # chave -> tamanho em bytes; ordem = do menos para o mais recentemente usado
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._evict_lock = FileLock(self.root / _EVICT_LOCK)
+        self._load()
+
+    def _path_for(self, key: str) -> Path:
+        if not _KEY_REGEX.match(key):
+            raise ValueError(f"Chave de cache invalida: {key!r}")
+        return self.root / key[:2] / key
+
+    def _scan(self) -> List[Tuple[float, str, int]]:
+        """(mtime, chave, tamanho) dos arquivos no disco, do menos para o mais recentemente usado."""
+        found = []
+        now = time.time()
+        for shard in os.scandir(self.root):
+            # shards têm 2 caracteres (sha[:2]); "incoming" só tem temporários
+            if not shard.is_dir() or (len(shard.name) != 2 and shard.name != _INCOMING_DIR):
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.is_file():
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.endswith(_TMP_SUFFIX):
+                    if now - st.st_mtime > _TMP_MAX_AGE:
+                        # sobra de uma escrita interrompida
+                        try:
+                            os.unlink(entry.path)
+                        except OSError:
+                            pass
+                    continue
+                if shard.name != _INCOMING_DIR:
+                    found.append((st.st_mtime, entry.name, st.st_size))
+        found.sort()
+        return found
+
+    def _load(self) -> None:
+        """Reconstrói o índice LRU a partir dos arquivos já existentes (mtime = último uso)."""
+        with self._evict_lock:
+            found = self._scan()
+            with self._lock:
+                for _, key, size in found:
+                    self._entries[key] = size
+                    self._total_bytes += size
+                self._evict()
+        logger.info("%d arquivo(s) em %s (%d bytes)", len(self._entries), self.root, self._total_bytes)
+
+    def rescan(self) -> None:
+        """
+        Recalcula o LRU com o que está no disco (incluindo o gravado por outros workers)
+        e aplica o limite de tamanho sobre o total real. Um worker por vez (lock de arquivo).
+        """
+        with self._evict_lock:
+            found = self._scan()
+            with self._lock:
+                self._entries = OrderedDict((key, size) for _, key, size in found)
+                self._total_bytes = sum(size for _, _, size in found)
+                self._evict()
+
+    def _adopt(self, key: str, path: Path) -> bool:
+        """Arquivo gravado por outro worker: passa a fazer parte do LRU deste."""
+        try:
+            size = path.stat().st_size
+        except OSError:
+            return False
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = size
+                self._total_bytes += size
+        return True
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Retorna os bytes da chave ou None (marca como usado recentemente)."""
+        path = self._path_for(key)
+        with self._lock:
+            known = key in self._entries
+            if known:
+                self._entries.move_to_end(key)
+        if not known and not self._adopt(key, path):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            # arquivo removido por fora do processo
+            with self._lock:
+                size = self._entries.pop(key, None)
+                if size is not None:
+                    self._total_bytes -= size
+                self.misses += 1
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def contains(self, key: str) -> bool:
+        """A chave está no cache? (não lê o arquivo nem conta hit/miss; confere no disco)"""
+        if self._adopt(key, self._path_for(key)):
+            return True
+        # removido por outro worker
+        with self._lock:
+            size = self._entries.pop(key, None)
+            if size is not None:
+                self._total_bytes -= size
+        return False
+
+    def put(self, key: str, data: bytes) -> None:
+        """Grava os bytes de forma atômica e aplica o limite de tamanho."""
+        path = self._path_for(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=_TMP_SUFFIX)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        self._add(key, len(data))
+
+    def writer(self) -> "DiskCacheWriter":
+        """Gravação em partes (streaming); a chave é informada no commit."""
+        incoming = self.root / _INCOMING_DIR
+        incoming.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=incoming, suffix=_TMP_SUFFIX)
+        return DiskCacheWriter(self, fd, tmp_path)
+
+    def _add(self, key: str, size: int) -> None:
+        with self._lock:
+            old_size = self._entries.pop(key, None)
+            if old_size is not None:
+                self._total_bytes -= old_size
+            self._entries[key] = size
+            self._total_bytes += size
+            self._evict()
+
+    def _evict(self) -> None:
+        # chamado com o lock adquirido (ou durante o __init__)
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                os.unlink(self._path_for(key))
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class DiskCacheWriter:
+    """
+    Entrada do DiskImageCache gravada em partes em um arquivo temporário.
+    commit(key) move o arquivo para o lugar definitivo (os.replace, atômico);
+    abort() descarta. Sobras de um processo interrompido são apagadas no _load.
+    """
+
+    def __init__(self, cache: DiskImageCache, fd: int, tmp_path: str):
+        self.cache = cache
+        self.path = tmp_path
+        self.size = 0
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, chunk: bytes) -> None:
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self, key: str) -> None:
+        path = self.cache._path_for(key)
+        try:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(self.path, path)
+        except BaseException:
+            self.abort()
+            raise
+        self.cache._add(key, self.size)
+
+    def abort(self) -> None:
+        self._file.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class MemoryImageCache:
+    """
+    Cache LRU em memória dos bytes servidos recentemente.
+    Limitado por orçamento de bytes (max_bytes) e por tempo de vida (ttl_seconds).
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: float):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # chave -> (bytes, instante em que entrou no cache)
+        self._entries: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        now = time.monotonic()
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            data, stored_at = item
+            if now - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self._total_bytes -= len(data)
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key: str, data: bytes) -> None:
+        # itens maiores que o orçamento inteiro não entram (esvaziariam o cache)
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_bytes -= len(old[0])
+            self._entries[key] = (data, time.monotonic())
+            self._total_bytes += len(data)
+            while self._total_bytes > self.max_bytes and self._entries:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._total_bytes -= len(evicted)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
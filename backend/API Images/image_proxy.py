@@ -1,13 +1,47 @@
 import os
-import re
-from typing import Optional, Dict
-from urllib.parse import quote
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import tempfile
+import time
+import json
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Optional, Dict, List, Tuple
 from pathlib import Path
-import requests
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import Response
+import httpx
+from fastapi import FastAPI, HTTPException, Query, Request
+from starlette.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from pydantic import BaseModel
 from dotenv import load_dotenv
 
+from image_cache import DiskImageCache, MemoryImageCache
+from singleflight import SingleFlight
+from image_variants import FIT_MODES, OUTPUT_FORMATS, normalize_format, resize_image, variant_key
+from reference_index import ReferenceIndex, load_snapshot, save_snapshot
+from image_zpl import DITHER_MODES, format_graphic, graphic_key, render_graphic
+from metrics import MetricsMiddleware, Registry
+from structured_logging import RequestLogMiddleware, setup_logging
+from file_lock import FileLock, file_signature
+from upstream_scheduler import (
+    PREFETCH, PrioritySemaphore, RateLimitScheduler, current_priority, throttled_response, upstream_priority,
+)
+from prefetch_jobs import PrefetchJob, PrefetchJobs
+from image_storage import (
+    GitHubStorage, ImageStorage, LayeredStorage, LocalStorage, git_blob_sha, git_blob_sha_of_file,
+)
+
+logger = logging.getLogger("image_proxy")
+index_logger = logging.getLogger("image_proxy.index")
+disk_logger = logging.getLogger("image_proxy.disk_cache")
+upstream_logger = logging.getLogger("image_proxy.upstream")
+prefetch_logger = logging.getLogger("image_proxy.prefetch")
+
 # =======================
 # CONFIG
 # =======================
@@ -32,129 +66,602 @@ def load_env_safe(env_path):
                     f.write(content)
                 # Tentar carregar novamente
                 load_dotenv(env_path)
-                print(f"[IMAGE-PROXY] Arquivo .env convertido de {encoding} para UTF-8")
+                logger.warning("Arquivo .env convertido de %s para UTF-8", encoding)
                 return
             except Exception:
                 continue
         # Se todos falharem, mostrar erro
-        print(f"[IMAGE-PROXY] [ERRO] Não foi possível ler .env com nenhum encoding")
-        print(f"[IMAGE-PROXY] [ERRO] Caminho: {env_path}")
-        print(f"[IMAGE-PROXY] [ERRO] Erro original: {e}")
+        logger.error("Não foi possível ler .env com nenhum encoding (%s): %s", env_path, e)
         raise
 
 load_env_safe(env_path)
 
+# logs em JSON (uma linha por registro) via fila: quem loga nunca espera o stdout
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").strip().lower()
+# fração das requisições com logs de sucesso registrados (erros e avisos sempre)
+LOG_SUCCESS_SAMPLE_RATE = float(os.getenv("LOG_SUCCESS_SAMPLE_RATE", "0.05"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# requisições mais lentas que isso sempre geram log de acesso (segundos)
+LOG_SLOW_REQUEST_SECONDS = float(os.getenv("LOG_SLOW_REQUEST_SECONDS", "2"))
+LOG_HANDLER = setup_logging("image_proxy", LOG_LEVEL, LOG_FORMAT, LOG_SUCCESS_SAMPLE_RATE, LOG_QUEUE_SIZE)
+
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
 OWNER = "larroude-tech"
 REPO = "Fluxo-barcode"
 BRANCH = "main"
 IMAGES_PREFIX = "images/"
-REF_REGEX = re.compile(r"(\d{3})-(\d{4})")  # 100-0001
 
-if not GITHUB_TOKEN:
-    raise RuntimeError("Defina GITHUB_TOKEN no .env")
+# origem das imagens:
+#   github  → Git Trees API + raw.githubusercontent.com (padrão)
+#   local   → diretório IMAGE_LOCAL_ROOT/images/ (checkout do repo), sem rede nem token
+#   layered → índice do GitHub, bytes do diretório local quando o blob SHA confere
+IMAGE_STORAGE = os.getenv("IMAGE_STORAGE", "github").strip().lower()
+IMAGE_LOCAL_ROOT = Path(os.getenv("IMAGE_LOCAL_ROOT") or Path(__file__).parent.parent.parent)
+
+# cache em disco das imagens (endereçado pelo blob SHA do Git)
+IMAGE_CACHE_DIR = Path(os.getenv("IMAGE_CACHE_DIR") or Path(tempfile.gettempdir()) / "fluxo-image-cache")
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# cache em memória dos bytes mais recentes (orçamento em bytes + TTL)
+IMAGE_MEMORY_CACHE_MAX_BYTES = int(os.getenv("IMAGE_MEMORY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+IMAGE_MEMORY_CACHE_TTL = float(os.getenv("IMAGE_MEMORY_CACHE_TTL", "600"))
+# max-age enviado no Cache-Control (clientes revalidam com If-None-Match depois disso)
+IMAGE_CACHE_MAX_AGE = int(os.getenv("IMAGE_CACHE_MAX_AGE", "300"))
+# espera máxima (segundos) pela cópia em disco de um streaming do mesmo path; depois busca na origem
+IMAGE_STREAM_WAIT_TIMEOUT = float(os.getenv("IMAGE_STREAM_WAIT_TIMEOUT", "30"))
+
+# cliente HTTP assíncrono compartilhado (pool keep-alive + HTTP/2) para o GitHub
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "20"))
+UPSTREAM_PER_HOST_LIMIT = int(os.getenv("UPSTREAM_PER_HOST_LIMIT", "32"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "15"))
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "true").lower() != "false"
+# rate limit do GitHub: requisições reservadas para uso interativo (prefetch para antes disso),
+# espera máxima por vaga no orçamento (interativo / prefetch) e novas tentativas com backoff
+UPSTREAM_RATE_LIMIT_RESERVE = int(os.getenv("UPSTREAM_RATE_LIMIT_RESERVE", "100"))
+UPSTREAM_MAX_WAIT = float(os.getenv("UPSTREAM_MAX_WAIT", "10"))
+UPSTREAM_PREFETCH_MAX_WAIT = float(os.getenv("UPSTREAM_PREFETCH_MAX_WAIT", "900"))
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "3"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.5"))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "30"))
+
+# POST /images/batch: máximo de referências por chamada e downloads simultâneos
+IMAGE_BATCH_MAX_REFERENCES = int(os.getenv("IMAGE_BATCH_MAX_REFERENCES", "2000"))
+IMAGE_BATCH_CONCURRENCY = int(os.getenv("IMAGE_BATCH_CONCURRENCY", "8"))
+# /image/exists: máximo de referências por chamada (só consulta o índice, sem baixar nada)
+IMAGE_EXISTS_MAX_REFERENCES = int(os.getenv("IMAGE_EXISTS_MAX_REFERENCES", "20000"))
+# aquecimento de cache (POST /images/prefetch): referências por job e downloads simultâneos
+IMAGE_PREFETCH_MAX_REFERENCES = int(os.getenv("IMAGE_PREFETCH_MAX_REFERENCES", "20000"))
+IMAGE_PREFETCH_CONCURRENCY = int(os.getenv("IMAGE_PREFETCH_CONCURRENCY", "4"))
 
-# Log para confirmar que o token foi carregado (sem mostrar o valor completo por segurança)
-token_preview = GITHUB_TOKEN[:10] + "..." if len(GITHUB_TOKEN) > 10 else "***"
-print(f"[IMAGE-PROXY] GITHUB_TOKEN carregado do .env: {token_preview}")
+# derivados redimensionados (?w=&h=&fit=&format=): processos de resize e tamanho máximo
+IMAGE_RESIZE_WORKERS = int(os.getenv("IMAGE_RESIZE_WORKERS", str(min(4, os.cpu_count() or 1))))
+IMAGE_VARIANT_MAX_SIZE = int(os.getenv("IMAGE_VARIANT_MAX_SIZE", "4000"))
+# gráfico ZPL (/zpl): tamanho máximo em dots (1 dot = 1 pixel em 203 DPI)
+IMAGE_ZPL_MAX_SIZE = int(os.getenv("IMAGE_ZPL_MAX_SIZE", "1200"))
 
-HEADERS = {
-    "Authorization": f"Bearer {GITHUB_TOKEN}",
-    "Accept": "application/vnd.github.v3+json",
-}
+# atualização do índice em segundo plano (segundos; 0 desliga)
+IMAGE_INDEX_REFRESH_INTERVAL = float(os.getenv("IMAGE_INDEX_REFRESH_INTERVAL", "300"))
+# intervalo menor enquanto não existe índice ou a última atualização falhou
+IMAGE_INDEX_RETRY_INTERVAL = float(os.getenv("IMAGE_INDEX_RETRY_INTERVAL", "30"))
+# snapshot do índice em disco: carregado no boot e revalidado com o GitHub em segundo plano
+IMAGE_INDEX_SNAPSHOT = Path(os.getenv("IMAGE_INDEX_SNAPSHOT") or IMAGE_CACHE_DIR / "reference-index.json.gz")
+# vários workers (uvicorn --workers): só um (o líder) atualiza o índice com a origem;
+# os demais recarregam o snapshot compartilhado quando ele muda (intervalo em segundos)
+IMAGE_INDEX_SHARED_POLL = float(os.getenv("IMAGE_INDEX_SHARED_POLL", "5"))
+
+if IMAGE_STORAGE not in ("github", "local", "layered"):
+    raise RuntimeError(f"IMAGE_STORAGE invalido: {IMAGE_STORAGE}. Use: github, local, layered")
+
+HEADERS = {"Accept": "application/vnd.github.v3+json"}
+if IMAGE_STORAGE != "local":
+    if not GITHUB_TOKEN:
+        raise RuntimeError("Defina GITHUB_TOKEN no .env")
+
+    # Log para confirmar que o token foi carregado (sem mostrar o valor completo por segurança)
+    token_preview = GITHUB_TOKEN[:10] + "..." if len(GITHUB_TOKEN) > 10 else "***"
+    logger.info("GITHUB_TOKEN carregado do .env: %s", token_preview)
+    HEADERS["Authorization"] = f"Bearer {GITHUB_TOKEN}"
 
 app = FastAPI(title="Image proxy GitHub por reference (sem banco)")
 
-# cache em memória: reference -> path
-REF_TO_PATH: Dict[str, str] = {}
+# métricas expostas em /metrics (formato texto do Prometheus)
+METRICS = Registry(prefix="image_proxy_")
+HTTP_REQUESTS = METRICS.counter("http_requests_total", "Requisicoes por rota, metodo e status", ("route", "method", "status"))
+HTTP_LATENCY = METRICS.histogram(
+    "http_request_duration_seconds", "Latencia ate o ultimo byte por rota, metodo e status", ("route", "method", "status"),
+)
+HTTP_SENT_BYTES = METRICS.counter("http_response_bytes_total", "Bytes de corpo enviados por rota", ("route",))
+HTTP_IN_FLIGHT = METRICS.gauge("http_requests_in_flight", "Requisicoes em andamento")
+UPSTREAM_LATENCY = METRICS.histogram(
+    "upstream_request_duration_seconds", "Latencia das requisicoes a origem (ate os headers)", ("host", "method"),
+)
+UPSTREAM_QUEUE = METRICS.histogram(
+    "upstream_queue_seconds", "Espera por vaga no limite de conexoes por host", ("host",),
+)
+UPSTREAM_RESPONSES = METRICS.counter("upstream_responses_total", "Respostas da origem por status", ("host", "method", "status"))
+UPSTREAM_ERRORS = METRICS.counter("upstream_errors_total", "Falhas de rede/timeout na origem", ("host", "method", "error"))
+UPSTREAM_IN_FLIGHT = METRICS.gauge("upstream_requests_in_flight", "Requisicoes a origem em andamento", ("host",))
+INDEX_BUILD_DURATION = METRICS.histogram(
+    "index_build_duration_seconds", "Duracao do build_cache por resultado (changed, unchanged, error)", ("result",),
+)
+UPSTREAM_RETRIES = METRICS.counter("upstream_retries_total", "Novas tentativas por status da origem", ("host", "status"))
+UPSTREAM_THROTTLED = METRICS.counter(
+    "upstream_throttled_total", "Requisicoes nao enviadas porque o rate limit do host estava esgotado", ("host",),
+)
+STALE_SERVED = METRICS.counter("stale_served_total", "Versoes anteriores servidas do cache com a origem indisponivel")
+PREFETCH_ITEMS = METRICS.counter("prefetch_items_total", "Referencias processadas pelo prefetch por resultado", ("result",))
+RENDER_DURATION = METRICS.histogram("render_duration_seconds", "Geracao de derivados no pool de processos", ("kind",))
+
+app.add_middleware(
+    MetricsMiddleware,
+    requests=HTTP_REQUESTS, latency=HTTP_LATENCY, sent_bytes=HTTP_SENT_BYTES, in_flight=HTTP_IN_FLIGHT,
+)
+# X-Request-ID do chamador (Node) em todos os logs da requisição + log de acesso amostrado
+app.add_middleware(
+    RequestLogMiddleware,
+    logger=logging.getLogger("image_proxy.access"),
+    sample_rate=LOG_SUCCESS_SAMPLE_RATE,
+    slow_seconds=LOG_SLOW_REQUEST_SECONDS,
+)
+
+# índice em memória (reference -> path -> blob SHA); trocado inteiro a cada atualização
+INDEX = ReferenceIndex()
+# erro da última tentativa de atualização (None se deu certo)
+INDEX_LAST_ERROR: Optional[str] = None
+# uma única atualização do índice em andamento
+INDEX_REFRESHES = SingleFlight()
+INDEX_REFRESH_TASK: Optional["asyncio.Task"] = None
+INDEX_REVALIDATE_TASK: Optional["asyncio.Task"] = None
+# eleição do worker que atualiza o índice periodicamente (lock mantido enquanto o processo vive)
+INDEX_LEADER_LOCK = FileLock(IMAGE_INDEX_SNAPSHOT.with_name(IMAGE_INDEX_SNAPSHOT.name + ".leader.lock"))
+# uma montagem do índice por vez entre todos os workers
+INDEX_BUILD_LOCK = FileLock(IMAGE_INDEX_SNAPSHOT.with_name(IMAGE_INDEX_SNAPSHOT.name + ".lock"))
+# (inode, mtime, tamanho) do snapshot que este worker carregou ou gravou por último
+INDEX_SNAPSHOT_SIGNATURE: Optional[Tuple[int, int, int]] = None
 
+DISK_CACHE = DiskImageCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES)
+MEMORY_CACHE = MemoryImageCache(IMAGE_MEMORY_CACHE_MAX_BYTES, IMAGE_MEMORY_CACHE_TTL)
 
-def extract_reference_from_name(name: str) -> Optional[str]:
+# uma única busca no GitHub por path, mesmo com muitas requisições simultâneas
+IMAGE_FETCHES = SingleFlight()
+# path -> futuro com o blob SHA da cópia gravada no disco por um streaming em andamento
+IMAGE_STREAMS: Dict[str, "asyncio.Future"] = {}
+# um único resize / gráfico ZPL em andamento por (path, variante)
+VARIANT_JOBS = SingleFlight()
+
+# pool de processos para o resize (decodificar JPEG é CPU pesado, não pode travar o event loop)
+RESIZE_POOL: Optional[ProcessPoolExecutor] = None
+
+HTTP_CLIENT: Optional[httpx.AsyncClient] = None
+# host -> semáforo que limita requisições simultâneas por host (interativas antes do prefetch)
+_HOST_SEMAPHORES: Dict[str, PrioritySemaphore] = {}
+# orçamento de rate limit por host, backoff e prioridades
+UPSTREAM = RateLimitScheduler(
+    reserve=UPSTREAM_RATE_LIMIT_RESERVE,
+    max_wait=UPSTREAM_MAX_WAIT,
+    prefetch_max_wait=UPSTREAM_PREFETCH_MAX_WAIT,
+    max_retries=UPSTREAM_MAX_RETRIES,
+    backoff_base=UPSTREAM_BACKOFF_BASE,
+    backoff_max=UPSTREAM_BACKOFF_MAX,
+)
+# path -> blob SHA da versão anterior (servida do cache se a origem estiver limitada)
+STALE_SHAS: Dict[str, str] = {}
+# status da origem em que uma versão anterior em cache é melhor que erro
+UPSTREAM_UNAVAILABLE = (429, 502, 503, 504)
+# jobs de aquecimento de cache (POST /images/prefetch)
+# (progresso em disco: qualquer worker responde o status de qualquer job)
+PREFETCH_JOBS = PrefetchJobs(state_dir=IMAGE_CACHE_DIR / "prefetch-jobs")
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Retorna o cliente HTTP compartilhado (criado sob demanda)."""
+    global HTTP_CLIENT
+    if HTTP_CLIENT is None or HTTP_CLIENT.is_closed:
+        HTTP_CLIENT = httpx.AsyncClient(
+            http2=UPSTREAM_HTTP2,
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=UPSTREAM_MAX_CONNECTIONS,
+                max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+            ),
+            timeout=httpx.Timeout(UPSTREAM_READ_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT),
+        )
+    return HTTP_CLIENT
+
+
+def get_resize_pool() -> ProcessPoolExecutor:
+    """Retorna o pool de processos de resize (criado sob demanda)."""
+    global RESIZE_POOL
+    if RESIZE_POOL is None:
+        RESIZE_POOL = ProcessPoolExecutor(
+            max_workers=IMAGE_RESIZE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return RESIZE_POOL
+
+
+def reset_resize_pool(broken: ProcessPoolExecutor) -> None:
     """
-    "100-0001 CANDY.jpeg" -> "1000001"
+    Descarta um pool quebrado (um worker morreu: falta de memória, crash do decoder...);
+    o próximo get_resize_pool() cria outro. Não faz nada se o pool já foi trocado.
     """
-    m = REF_REGEX.search(name)
-    if not m:
-        return None
-    return m.group(1) + m.group(2)
+    global RESIZE_POOL
+    if RESIZE_POOL is broken:
+        RESIZE_POOL = None
+    broken.shutdown(wait=False, cancel_futures=True)
 
 
-def build_cache() -> None:
+def host_semaphore(url: str) -> PrioritySemaphore:
+    """Semáforo que limita as requisições simultâneas ao host da URL."""
+    host = httpx.URL(url).host
+    semaphore = _HOST_SEMAPHORES.get(host)
+    if semaphore is None:
+        semaphore = _HOST_SEMAPHORES[host] = PrioritySemaphore(UPSTREAM_PER_HOST_LIMIT)
+    return semaphore
+
+
+@asynccontextmanager
+async def upstream_slot(method: str, url: str, priority: int):
+    """Vaga no limite por host, com as métricas da requisição à origem."""
+    host = httpx.URL(url).host
+    queued_at = time.perf_counter()
+    async with host_semaphore(url).slot(priority):
+        UPSTREAM_QUEUE.observe(time.perf_counter() - queued_at, host=host)
+        with UPSTREAM_IN_FLIGHT.track(host=host):
+            yield host
+
+
+def observe_upstream(host: str, method: str, started: float,
+                     resp: Optional[httpx.Response] = None, error: Optional[Exception] = None) -> None:
+    UPSTREAM_LATENCY.observe(time.perf_counter() - started, host=host, method=method)
+    if resp is not None:
+        UPSTREAM_RESPONSES.inc(host=host, method=method, status=str(resp.status_code))
+    if error is not None:
+        UPSTREAM_ERRORS.inc(host=host, method=method, error=type(error).__name__)
+
+
+async def open_upstream(method: str, url: str, headers: Optional[Dict[str, str]],
+                        stack: AsyncExitStack, stream: bool) -> httpx.Response:
     """
-    Monta o dicionário REF_TO_PATH lendo o repo no GitHub.
-    Usa Git Trees API (sem limite de 1000 arquivos).
+    Envia a requisição à origem pelo RateLimitScheduler:
+    → espera o orçamento do host (prefetch cede a vez às interativas)
+    → 429/403 de rate limit e 502/503/504: nova tentativa após Retry-After ou backoff com jitter
+    → se a espera passaria do máximo, devolve um 429 local sem ir à origem
+    A vaga do host (e o corpo, se stream=True) ficam em `stack` até quem chamou fechar.
     """
-    global REF_TO_PATH
-    REF_TO_PATH = {}
+    host = httpx.URL(url).host
+    priority = current_priority()
+    attempt = 0
+    while True:
+        wait = await UPSTREAM.wait_turn(host, priority)
+        if wait is not None:
+            UPSTREAM_THROTTLED.inc(host=host)
+            upstream_logger.warning(
+                "%s limitado, requisicao nao enviada (libera em %.0fs)", host, wait,
+                extra={"host": host, "method": method, "url": url, "retry_after": round(wait, 1)},
+            )
+            return throttled_response(method, url, wait)
 
-    # 1) pegar SHA do último commit da branch
-    ref_url = f"https://api.github.com/repos/{OWNER}/{REPO}/git/ref/heads/{BRANCH}"
-    ref_resp = requests.get(ref_url, headers=HEADERS)
-    ref_resp.raise_for_status()
-    commit_sha = ref_resp.json()["object"]["sha"]
+        attempt_stack = AsyncExitStack()
+        try:
+            await attempt_stack.enter_async_context(upstream_slot(method, url, priority))
+            started = time.perf_counter()
+            try:
+                if stream:
+                    resp = await attempt_stack.enter_async_context(
+                        get_http_client().stream(method, url, headers=headers or HEADERS)
+                    )
+                else:
+                    resp = await get_http_client().request(method, url, headers=headers or HEADERS)
+            except httpx.HTTPError as e:
+                observe_upstream(host, method, started, error=e)
+                raise
+            observe_upstream(host, method, started, resp=resp)
+            UPSTREAM.observe(host, resp)
 
-    # 2) pegar SHA da tree
-    commit_url = f"https://api.github.com/repos/{OWNER}/{REPO}/git/commits/{commit_sha}"
-    commit_resp = requests.get(commit_url, headers=HEADERS)
-    commit_resp.raise_for_status()
-    tree_sha = commit_resp.json()["tree"]["sha"]
+            delay = UPSTREAM.retry_delay(resp, attempt, priority)
+            if delay is None:
+                stack.push_async_exit(attempt_stack.pop_all())
+                return resp
+        finally:
+            await attempt_stack.aclose()
 
-    # 3) pegar árvore recursiva
-    tree_url = f"https://api.github.com/repos/{OWNER}/{REPO}/git/trees/{tree_sha}?recursive=1"
-    tree_resp = requests.get(tree_url, headers=HEADERS)
-    tree_resp.raise_for_status()
-    tree_data = tree_resp.json()["tree"]
+        attempt += 1
+        UPSTREAM_RETRIES.inc(host=host, status=str(resp.status_code))
+        upstream_logger.warning(
+            "%s retornou %d, tentativa %d em %.1fs", host, resp.status_code, attempt, delay,
+            extra={"host": host, "method": method, "url": url, "status": resp.status_code, "attempt": attempt},
+        )
+        await asyncio.sleep(delay)
 
-    count_total = 0
-    count_com_ref = 0
 
-    for item in tree_data:
-        if item["type"] != "blob":
-            continue
+async def upstream_request(method: str, url: str, headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+    """Faz a requisição ao GitHub respeitando o limite de conexões e o rate limit do host."""
+    async with AsyncExitStack() as stack:
+        return await open_upstream(method, url, headers, stack, stream=False)
 
-        path = item["path"]
-        if not path.startswith(IMAGES_PREFIX):
-            continue
 
-        count_total += 1
-        name = path.split("/")[-1]
-        ref = extract_reference_from_name(name)
+@asynccontextmanager
+async def upstream_stream(method: str, url: str, headers: Optional[Dict[str, str]] = None):
+    """Como upstream_request, sem ler o corpo: a vaga do host fica ocupada até o stream fechar."""
+    async with AsyncExitStack() as stack:
+        yield await open_upstream(method, url, headers, stack, stream=True)
+
+
+def create_storage() -> ImageStorage:
+    """Backend de armazenamento escolhido em IMAGE_STORAGE."""
+    if IMAGE_STORAGE == "local":
+        return LocalStorage(IMAGE_LOCAL_ROOT, IMAGES_PREFIX)
+    github = GitHubStorage(OWNER, REPO, BRANCH, IMAGES_PREFIX, upstream_request, HEADERS, upstream_stream)
+    if IMAGE_STORAGE == "layered":
+        return LayeredStorage(github, LocalStorage(IMAGE_LOCAL_ROOT, IMAGES_PREFIX))
+    return github
+
+
+STORAGE = create_storage()
+logger.info("Origem das imagens: %s (%s)", STORAGE.name, STORAGE.source)
+
+
+def content_type_for(path: str) -> str:
+    """Content-Type pela extensão do arquivo (padrão: image/jpeg)."""
+    guessed, _ = mimetypes.guess_type(path)
+    return guessed or "image/jpeg"
 
-        if not ref:
-            continue
 
-        # se tiver duplicado, mantém o primeiro e ignora o resto
-        if ref not in REF_TO_PATH:
-            REF_TO_PATH[ref] = path
-            count_com_ref += 1
+def cache_headers(blob_sha: Optional[str]) -> Dict[str, str]:
+    """Headers de cache HTTP: ETag forte (blob SHA), Cache-Control e Last-Modified."""
+    headers = {"Cache-Control": f"public, max-age={IMAGE_CACHE_MAX_AGE}"}
+    if blob_sha:
+        headers["ETag"] = f'"{blob_sha}"'
+    if INDEX.last_modified:
+        headers["Last-Modified"] = INDEX.last_modified
+    return headers
 
-    print(f"[CACHE] Imagens totais em {IMAGES_PREFIX}: {count_total}")
-    print(f"[CACHE] Imagens com reference valida: {count_com_ref}")
+
+def etag_matches(if_none_match: Optional[str], blob_sha: Optional[str]) -> bool:
+    """Verifica o header If-None-Match (aceita lista, "*" e ETags fracas W/"...")."""
+    if not if_none_match or not blob_sha:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate.strip('"') == blob_sha:
+            return True
+    return False
+
+
+async def build_cache(full: bool = False) -> Dict:
+    """
+    Monta/atualiza o índice de imagens a partir da origem configurada (STORAGE).
+    O índice novo é montado ao lado e publicado de uma vez em INDEX; se a
+    origem falhar, a exceção sobe e o índice anterior continua valendo.
+    full=True ignora o estado anterior e remonta tudo.
+    """
+    global INDEX
+    previous = INDEX
+    started = time.perf_counter()
+    try:
+        INDEX, result = await STORAGE.build_index(INDEX, full=full)
+    except Exception:
+        INDEX_BUILD_DURATION.observe(time.perf_counter() - started, result="error")
+        raise
+    INDEX_BUILD_DURATION.observe(
+        time.perf_counter() - started, result="changed" if result.get("changed") else "unchanged",
+    )
+    remember_stale_versions(previous, INDEX)
+    return result
+
+
+def remember_stale_versions(previous: ReferenceIndex, current: ReferenceIndex) -> None:
+    """Guarda o blob SHA anterior dos paths que mudaram (ver load_stale_image)."""
+    if current.path_to_sha is previous.path_to_sha:
+        return
+    for path, old_sha in previous.path_to_sha.items():
+        if current.path_to_sha.get(path) != old_sha:
+            STALE_SHAS[path] = old_sha
+    # o que voltou a ser igual (ou tem versão nova sem mudar de novo) não precisa mais
+    for path in [p for p, sha in STALE_SHAS.items() if current.path_to_sha.get(p) == sha]:
+        del STALE_SHAS[path]
+
+
+async def adopt_shared_snapshot() -> bool:
+    """
+    Carrega o snapshot gravado por outro worker, se mudou desde o último que este
+    worker leu ou gravou e é mais novo que o índice atual. Retorna True se trocou o índice.
+    """
+    global INDEX, INDEX_SNAPSHOT_SIGNATURE
+    signature = await run_in_threadpool(file_signature, IMAGE_INDEX_SNAPSHOT)
+    if signature is None or signature == INDEX_SNAPSHOT_SIGNATURE:
+        return False
+    snapshot = await run_in_threadpool(load_snapshot, IMAGE_INDEX_SNAPSHOT, STORAGE.sources)
+    INDEX_SNAPSHOT_SIGNATURE = signature
+    if snapshot is None or (INDEX.loaded and snapshot.built_at <= INDEX.built_at):
+        return False
+    # arquivos locais (backends local/layered) conferidos antes de publicar o índice
+    await run_in_threadpool(STORAGE.adopt_index, snapshot)
+    previous, INDEX = INDEX, snapshot
+    remember_stale_versions(previous, INDEX)
+    index_logger.info(
+        "Indice atualizado pelo snapshot compartilhado: %d referencia(s), commit %s",
+        len(INDEX.ref_to_path), INDEX.commit_sha[:7],
+    )
+    return True
+
+
+async def build_shared_index(full: bool) -> Dict:
+    """
+    Monta o índice com o lock entre workers: antes de ir à origem adota o snapshot
+    que outro worker acabou de gravar (a consulta vira um 304 condicional) e,
+    se o índice mudou, grava o snapshot para os demais.
+    """
+    global INDEX_SNAPSHOT_SIGNATURE
+    await run_in_threadpool(INDEX_BUILD_LOCK.acquire)
+    try:
+        await adopt_shared_snapshot()
+        previous = INDEX
+        result = await build_cache(full=full)
+        current = INDEX
+        if current is not previous and current.loaded:
+            try:
+                await run_in_threadpool(save_snapshot, current, IMAGE_INDEX_SNAPSHOT)
+                INDEX_SNAPSHOT_SIGNATURE = await run_in_threadpool(file_signature, IMAGE_INDEX_SNAPSHOT)
+            except OSError as e:
+                index_logger.warning("Falha ao gravar snapshot do indice: %s", e)
+        return result
+    finally:
+        INDEX_BUILD_LOCK.release()
+
+
+async def refresh_index(full: bool = False) -> Dict:
+    """
+    Atualiza o índice (uma atualização por vez, também entre workers), registra
+    o erro da última tentativa e grava o snapshot em disco quando o índice muda.
+    """
+    global INDEX_LAST_ERROR
+    try:
+        result = await INDEX_REFRESHES.do(f"index|{full}", lambda: build_shared_index(full))
+    except Exception as e:
+        INDEX_LAST_ERROR = str(e) or type(e).__name__
+        raise
+    INDEX_LAST_ERROR = None
+    return result
+
+
+def is_index_leader() -> bool:
+    """Tenta assumir (ou confirma) a atualização periódica do índice por este worker."""
+    if not INDEX_LEADER_LOCK.held and INDEX_LEADER_LOCK.acquire(blocking=False):
+        index_logger.info("Worker %d assumiu a atualizacao do indice", os.getpid())
+    return INDEX_LEADER_LOCK.held
+
+
+async def revalidate_index_in_background() -> None:
+    """Revalida com a origem o índice carregado do snapshot."""
+    try:
+        await refresh_index()
+    except Exception as e:
+        index_logger.error("Falha ao revalidar indice do snapshot, mantendo o snapshot: %s", e)
+
+
+async def ensure_index() -> ReferenceIndex:
+    """
+    Índice atual. Só espera a origem se ainda não existe nenhum índice
+    (ex.: o startup falhou); caso contrário nunca bloqueia.
+    """
+    if not INDEX.loaded:
+        try:
+            await refresh_index()
+        except Exception as e:
+            raise HTTPException(
+                status_code=503,
+                detail=f"Indice de imagens indisponivel (falha ao ler {STORAGE.name}): {e}",
+            )
+    return INDEX
+
+
+async def refresh_index_periodically() -> None:
+    """
+    Tarefa de fundo.
+    Líder: revalida o índice a cada IMAGE_INDEX_REFRESH_INTERVAL segundos e recalcula o cache em disco.
+    Demais workers: recarregam o snapshot compartilhado a cada IMAGE_INDEX_SHARED_POLL segundos
+    (e assumem a liderança se o líder sair).
+    """
+    while True:
+        if IMAGE_INDEX_REFRESH_INTERVAL > 0 and is_index_leader():
+            interval = IMAGE_INDEX_REFRESH_INTERVAL
+            if INDEX_LAST_ERROR or not INDEX.loaded:
+                interval = min(interval, IMAGE_INDEX_RETRY_INTERVAL)
+            await asyncio.sleep(interval)
+            try:
+                await refresh_index()
+            except Exception as e:
+                index_logger.error("Falha ao atualizar indice, mantendo o anterior: %s", e)
+            try:
+                await run_in_threadpool(DISK_CACHE.rescan)
+            except OSError as e:
+                disk_logger.warning("Falha ao recalcular o cache em disco: %s", e)
+        else:
+            await asyncio.sleep(IMAGE_INDEX_SHARED_POLL)
+            try:
+                await adopt_shared_snapshot()
+            except Exception as e:
+                index_logger.error("Falha ao recarregar o snapshot compartilhado: %s", e)
 
 
 @app.on_event("startup")
-def on_startup():
-    # monta cache uma vez ao subir o servidor
-    build_cache()
+async def on_startup():
+    global INDEX_REFRESH_TASK, INDEX_REVALIDATE_TASK
+    get_http_client()
+
+    # cold start: servir na hora a partir do snapshot (compartilhado entre workers);
+    # só o líder revalida com a origem em segundo plano
+    if await adopt_shared_snapshot():
+        if is_index_leader():
+            INDEX_REVALIDATE_TASK = asyncio.create_task(revalidate_index_in_background())
+    else:
+        # sem snapshot: monta cache uma vez ao subir o servidor
+        # (com vários workers o primeiro monta e os outros adotam o snapshot dele)
+        try:
+            await refresh_index()
+        except Exception as e:
+            # sobe mesmo assim: a tarefa de fundo tenta de novo
+            index_logger.error("Falha ao montar indice no startup: %s", e)
+    INDEX_REFRESH_TASK = asyncio.create_task(refresh_index_periodically())
 
 
-@app.get("/image/reference/{reference}")
-@app.head("/image/reference/{reference}")
-def image_by_reference(reference: str, request: Request):
+@app.on_event("shutdown")
+async def on_shutdown():
+    for task in (INDEX_REFRESH_TASK, INDEX_REVALIDATE_TASK):
+        if task is not None:
+            task.cancel()
+    for job in PREFETCH_JOBS.running():
+        job.task.cancel()
+    # outro worker assume a atualização do índice
+    INDEX_LEADER_LOCK.release()
+    if HTTP_CLIENT is not None:
+        await HTTP_CLIENT.aclose()
+    if RESIZE_POOL is not None:
+        RESIZE_POOL.shutdown(wait=False, cancel_futures=True)
+
+
+async def fetch_image_from_storage(path: str, normalized_ref: str, reference: str,
+                                   memory: bool = True) -> Tuple[bytes, str]:
     """
-    Exemplo: /image/reference/1000001 ou /image/reference/100.0001
-    → aceita referência no formato XXXXXXX ou XXX.XXXX ou XXX-XXXX
-    → procura qualquer arquivo em images/ que tenha "XXX-XXXX" no nome
-    →  baixa do GitHub com token
-    → devolve a imagem
-    → Suporta GET (retorna imagem) e HEAD (verifica se existe)
+    Lê a imagem da origem (GitHub ou disco) e grava nos caches (memória e disco).
+    memory=False grava só no disco (prefetch, para não expulsar o que está sendo servido).
+    Retorna (bytes, blob SHA do conteúdo lido).
+    """
+    data = await STORAGE.read(path, normalized_ref, reference)
+    logger.info(
+        "Imagem baixada com sucesso: %d bytes", len(data),
+        extra={"image_path": path, "bytes": len(data), "content_type": content_type_for(path), "sampled": True},
+    )
+    # grava pelo SHA do conteúdo lido (a origem pode ter mudado desde o build_cache)
+    downloaded_sha = git_blob_sha(data)
+    if memory:
+        MEMORY_CACHE.put(downloaded_sha, data)
+    try:
+        await run_in_threadpool(DISK_CACHE.put, downloaded_sha, data)
+    except OSError as e:
+        disk_logger.warning("Falha ao gravar %s: %s", path, e)
+    return data, downloaded_sha
+
+
+def normalize_reference(reference: str, log: bool = True) -> str:
+    """
+    Normaliza a referência (XXX.XXXX ou XXX-XXXX -> XXXXXXX).
+    Levanta HTTPException 400 se não tiver 7 dígitos.
+    log=False não registra a normalização (consultas em lote).
     """
-    # Normalizar referência: converter XXX.XXXX ou XXX-XXXX para XXXXXXX
     normalized_ref = reference.strip().replace('.', '').replace('-', '')
     
-    # Log da normalização (apenas se houve mudança)
-    if normalized_ref != reference.strip():
-        print(f"[IMAGE-PROXY] Referencia normalizada: '{reference}' -> '{normalized_ref}'")
+    # Log da normalização (apenas se houve mudança; nível DEBUG, roda em toda requisição)
+    if log and normalized_ref != reference.strip():
+        logger.debug("Referencia normalizada: '%s' -> '%s'", reference, normalized_ref)
     
     # Verificar se tem formato válido (7 dígitos)
     if not normalized_ref.isdigit() or len(normalized_ref) != 7:
@@ -162,106 +669,912 @@ def image_by_reference(reference: str, request: Request):
             status_code=400, 
             detail=f"Formato de referencia invalido: {reference}. Esperado: XXXXXXX (7 digitos) ou XXX.XXXX ou XXX-XXXX"
         )
-    
+    return normalized_ref
+
+
+async def resolve_reference_path(reference: str, normalized_ref: str, candidate: int = 0) -> str:
+    """
+    Procura o path da referência no cache (404 se não existir).
+    `candidate` escolhe entre os arquivos da referência (0 = preferido, ver /candidates).
+    """
     # garante que o cache existe (se der algum problema no startup)
-    if not REF_TO_PATH:
-        build_cache()
+    index = await ensure_index()
 
-    path = REF_TO_PATH.get(normalized_ref)
-    if not path:
+    paths = index.ref_to_paths.get(normalized_ref)
+    if not paths:
         raise HTTPException(
             status_code=404, 
             detail=f"Reference '{reference}' (normalizada: {normalized_ref}) nao encontrada no cache"
         )
+    if candidate >= len(paths):
+        raise HTTPException(
+            status_code=404,
+            detail=f"Reference '{reference}' tem {len(paths)} arquivo(s); candidate={candidate} nao existe",
+        )
+    return paths[candidate]
 
-    encoded_path = quote(path)
-    raw_url = f"https://raw.githubusercontent.com/{OWNER}/{REPO}/{BRANCH}/{encoded_path}"
 
-    # Verificar se é requisição HEAD
-    is_head = request.method == "HEAD"
-    
-    if is_head:
-        # Para HEAD, apenas verificar se existe sem baixar o conteúdo completo
+def candidate_info(index: ReferenceIndex, path: str, rank: Optional[int] = None) -> Dict:
+    """Atributos de um arquivo do índice (resposta de /candidates e /images/search)."""
+    candidate = index.candidates[path]
+    info = {
+        "reference": candidate.reference,
+        "path": path,
+        "sha": index.path_to_sha.get(path),
+        "style": candidate.style or None,
+        "detail": candidate.detail or None,
+        "cancelled": candidate.cancelled,
+        "extension": candidate.extension,
+    }
+    if rank is not None:
+        info["candidate"] = rank
+    return info
+
+
+async def load_stored_image(path: str, blob_sha: str, memory: bool = True) -> Optional[bytes]:
+    """
+    Bytes do blob sem ir à origem: cache em memória, arquivo local (backends local/layered), cache em disco.
+    memory=False não promove para o cache em memória o que vier do disco.
+    """
+    cached = MEMORY_CACHE.get(blob_sha)
+    if cached is not None:
+        return cached
+    local_file = STORAGE.local_file(path, blob_sha)
+    if local_file is not None:
+        try:
+            return await run_in_threadpool(local_file.read_bytes)
+        except OSError:
+            pass
+    return await load_cached_bytes(blob_sha, memory)
+
+
+async def load_image(path: str, normalized_ref: str, reference: str,
+                     check_cache: bool = True, memory: bool = True) -> Tuple[bytes, str]:
+    """
+    Bytes da imagem: cache em memória, depois arquivo local (backends local/layered),
+    depois cache em disco, depois a origem (uma busca por path).
+    Se o path está sendo transmitido por um streaming, espera a cópia dele no disco.
+    memory=False não grava no cache em memória (lotes, como no prefetch).
+    Retorna (bytes, blob SHA).
+    """
+    blob_sha = INDEX.path_to_sha.get(path)
+    if blob_sha and check_cache:
+        cached = await load_stored_image(path, blob_sha, memory)
+        if cached is not None:
+            return cached, blob_sha
+
+    streamed_sha = await wait_for_stream(path)
+    if streamed_sha:
+        cached = await load_cached_bytes(streamed_sha, memory)
+        if cached is not None:
+            return cached, streamed_sha
+
+    try:
+        return await IMAGE_FETCHES.do(
+            path, lambda: fetch_image_from_storage(path, normalized_ref, reference, memory)
+        )
+    except HTTPException as e:
+        stale = await load_stale_image(path, e)
+        if stale is None:
+            raise
+        return stale
+
+
+async def load_stale_image(path: str, error: HTTPException) -> Optional[Tuple[bytes, str]]:
+    """
+    Origem limitada/indisponível: versão anterior do path, se ainda estiver em cache.
+    Retorna (bytes, blob SHA antigo) ou None.
+    """
+    if error.status_code not in UPSTREAM_UNAVAILABLE:
+        return None
+    stale_sha = STALE_SHAS.get(path)
+    if not stale_sha:
+        return None
+    cached = await load_cached_bytes(stale_sha)
+    if cached is None:
+        return None
+    STALE_SERVED.inc()
+    logger.warning(
+        "Origem indisponivel (%d), servindo versao anterior", error.status_code,
+        extra={"image_path": path, "status": error.status_code, "sha": stale_sha},
+    )
+    return cached, stale_sha
+
+
+async def wait_for_stream(path: str) -> Optional[str]:
+    """
+    Se o path está sendo transmitido por um streaming, espera a cópia dele no disco
+    (até IMAGE_STREAM_WAIT_TIMEOUT segundos). Retorna o blob SHA gravado ou None.
+    """
+    streaming = IMAGE_STREAMS.get(path)
+    if streaming is None:
+        return None
+    try:
+        return await asyncio.wait_for(asyncio.shield(streaming), IMAGE_STREAM_WAIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(
+            "Streaming de %s nao terminou em %.0fs, buscando na origem", path, IMAGE_STREAM_WAIT_TIMEOUT,
+            extra={"image_path": path},
+        )
+        return None
+
+
+async def load_cached_bytes(key: str, memory: bool = True) -> Optional[bytes]:
+    """Procura a chave no cache em memória e depois no disco (promovendo para a memória, se memory=True)."""
+    cached = MEMORY_CACHE.get(key)
+    if cached is None:
+        cached = await run_in_threadpool(DISK_CACHE.get, key)
+        if cached is not None and memory:
+            MEMORY_CACHE.put(key, cached)
+    return cached
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse que sempre chama on_close() ao terminar. O finally do gerador
+    não roda se o cliente desconecta antes de o corpo começar a ser lido; sem isso
+    o stream da origem (e a vaga dele no limite por host) ficaria aberto.
+    """
+
+    def __init__(self, content, on_close: Callable[[], Awaitable[None]], **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.on_close()
+
+
+async def stream_image(path: str, normalized_ref: str, reference: str,
+                       blob_sha: Optional[str]) -> Optional[StreamingResponse]:
+    """
+    Repassa o corpo da origem ao cliente em blocos, gravando uma cópia no cache em disco
+    ao mesmo tempo (memória por requisição limitada ao tamanho do bloco).
+    Content-Length e Content-Type da origem são repassados.
+    None se o backend não faz streaming.
+    """
+    # registrado antes do primeiro await: quem pedir o mesmo path enquanto isso
+    # (mesmo antes de a origem responder) espera a cópia no disco (ver load_image)
+    done = asyncio.get_running_loop().create_future()
+    IMAGE_STREAMS[path] = done
+    stack = AsyncExitStack()
+    writer = None
+
+    async def close() -> None:
+        # roda se a origem falhar, no fim do body() e no fim da resposta (pode rodar mais de uma vez)
+        nonlocal writer
+        if writer is not None:
+            writer.abort()
+            writer = None
+        if not done.done():
+            done.set_result(None)
+        if IMAGE_STREAMS.get(path) is done:
+            del IMAGE_STREAMS[path]
+        await stack.aclose()
+
+    try:
+        opened = await STORAGE.open_stream(path, normalized_ref, reference, stack)
+    except BaseException:
+        await close()
+        raise
+    if opened is None:
+        await close()
+        return None
+    chunks, length, upstream_type = opened
+
+    async def body() -> AsyncIterator[bytes]:
+        nonlocal writer
+        try:
+            writer = await run_in_threadpool(DISK_CACHE.writer)
+        except OSError as e:
+            disk_logger.warning("Falha ao preparar gravacao de %s: %s", path, e)
+        # SHA do blob calculado durante a transmissão quando o tamanho é conhecido
+        hasher = hashlib.sha1(b"blob %d\0" % length) if length is not None else None
+        size = 0
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+                if writer is not None:
+                    try:
+                        await run_in_threadpool(writer.write, chunk)
+                    except OSError as e:
+                        disk_logger.warning("Falha ao gravar %s: %s", path, e)
+                        writer.abort()
+                        writer = None
+                yield chunk
+
+            logger.info(
+                "Imagem transmitida com sucesso: %d bytes", size,
+                extra={"image_path": path, "bytes": size, "content_type": content_type, "sampled": True},
+            )
+            served_sha = None
+            if writer is not None:
+                if hasher is not None and size == length:
+                    served_sha = hasher.hexdigest()
+                else:
+                    served_sha = await run_in_threadpool(git_blob_sha_of_file, writer.path)
+                try:
+                    await run_in_threadpool(writer.commit, served_sha)
+                except OSError as e:
+                    disk_logger.warning("Falha ao gravar %s: %s", path, e)
+                    served_sha = None
+                writer = None
+            if not done.done():
+                done.set_result(served_sha)
+        finally:
+            await close()
+
+    content_type = upstream_type if upstream_type and upstream_type.startswith("image/") else content_type_for(path)
+    headers = cache_headers(blob_sha)
+    if length is not None:
+        headers["Content-Length"] = str(length)
+    return ClosingStreamingResponse(body(), on_close=close, media_type=content_type, headers=headers)
+
+
+async def render_in_pool(render: Callable, *args):
+    """
+    Roda render(*args) no pool de processos. Se o pool quebrou (worker morto),
+    troca por um novo e tenta mais uma vez; a segunda falha sobe como BrokenProcessPool.
+    """
+    loop = asyncio.get_running_loop()
+    pool = get_resize_pool()
+    try:
+        return await loop.run_in_executor(pool, render, *args)
+    except BrokenProcessPool:
+        logger.warning("Pool de processos quebrado, recriando")
+        reset_resize_pool(pool)
+    return await loop.run_in_executor(get_resize_pool(), render, *args)
+
+
+async def load_derivative(path: str, normalized_ref: str, reference: str,
+                          key_for: Callable[[str], str], render: Callable, *render_args) -> Tuple[bytes, str]:
+    """
+    Derivado da imagem (resize, gráfico ZPL...), gerado uma vez no pool de processos
+    e cacheado pela chave key_for(blob SHA). Retorna (bytes, chave).
+    """
+    blob_sha = INDEX.path_to_sha.get(path)
+    if blob_sha:
+        key = key_for(blob_sha)
+        cached = await load_cached_bytes(key)
+        if cached is not None:
+            return cached, key
+
+    async def generate() -> Tuple[bytes, str]:
+        data, served_sha = await load_image(path, normalized_ref, reference)
+        key = key_for(served_sha)
         try:
-            head_resp = requests.head(raw_url, headers=HEADERS, timeout=15)
-            if head_resp.status_code != 200:
-                raise HTTPException(
-                    status_code=502,
-                    detail=f"GitHub retornou {head_resp.status_code} para {path}",
-                )
-            
-            # Retornar apenas headers (FastAPI automaticamente não envia body para HEAD)
-            content_type = head_resp.headers.get("Content-Type", "image/jpeg")
-            return Response(
-                content=b"",  # Vazio para HEAD
-                media_type=content_type,
-                headers={
-                    "Content-Length": head_resp.headers.get("Content-Length", "0"),
-                    "Content-Type": content_type
-                }
+            with RENDER_DURATION.time(kind=render.__name__):
+                derived = await render_in_pool(render, data, *render_args)
+        except BrokenProcessPool as e:
+            logger.error("Pool de processos indisponivel ao processar %s: %s", path, e, extra={"image_path": path})
+            raise HTTPException(
+                status_code=503,
+                detail=f"Processamento de imagens indisponivel no momento, tente novamente: {path}",
             )
-        except requests.exceptions.RequestException as e:
+        except Exception as e:
+            logger.error("Falha ao processar %s: %s", path, e, extra={"image_path": path})
             raise HTTPException(
-                status_code=502,
-                detail=f"Erro ao verificar imagem no GitHub: {str(e)}",
+                status_code=422,
+                detail=f"Nao foi possivel processar a imagem {path}: {e}",
             )
-    else:
-        # Para GET, baixar e retornar a imagem completa
+        logger.info(
+            "Derivado gerado: %s (%d -> %d bytes)", key, len(data), len(derived),
+            extra={"image_path": path, "key": key, "sampled": True},
+        )
+        MEMORY_CACHE.put(key, derived)
         try:
-            resp = requests.get(raw_url, headers=HEADERS, timeout=15)
-            
-            if resp.status_code != 200:
-                # Log detalhado do erro
-                print(f"[IMAGE-PROXY] ERRO: GitHub retornou {resp.status_code}")
-                print(f"[IMAGE-PROXY] URL: {raw_url}")
-                print(f"[IMAGE-PROXY] Path no cache: {path}")
-                print(f"[IMAGE-PROXY] Referencia normalizada: {normalized_ref}")
-                
-                if resp.status_code == 404:
-                    raise HTTPException(
-                        status_code=404,
-                        detail=f"Imagem nao encontrada no GitHub para referencia '{reference}' (normalizada: {normalized_ref}). Path: {path}",
-                    )
-                elif resp.status_code == 403:
-                    raise HTTPException(
-                        status_code=403,
-                        detail=f"Acesso negado pelo GitHub. Verifique se o GITHUB_TOKEN esta valido e tem permissoes para acessar o repositorio.",
-                    )
-                elif resp.status_code == 429:
-                    raise HTTPException(
-                        status_code=429,
-                        detail=f"Rate limit do GitHub atingido. Aguarde alguns minutos e tente novamente. Path: {path}",
-                    )
-                else:
-                    raise HTTPException(
-                        status_code=502,
-                        detail=f"GitHub retornou {resp.status_code} para {path}. Verifique se a imagem existe no repositorio.",
-                    )
+            await run_in_threadpool(DISK_CACHE.put, key, derived)
+        except OSError as e:
+            disk_logger.warning("Falha ao gravar %s: %s", key, e)
+        return derived, key
+
+    # a chave do single-flight usa o path (o SHA pode ainda não ser conhecido)
+    return await VARIANT_JOBS.do(f"{path}|{key_for('')}", generate)
+
 
-            content_type = resp.headers.get("Content-Type", "image/jpeg")
-            print(f"[IMAGE-PROXY] Imagem baixada com sucesso: {len(resp.content)} bytes, tipo: {content_type}")
-            return Response(content=resp.content, media_type=content_type)
-        except requests.exceptions.Timeout:
-            print(f"[IMAGE-PROXY] ERRO: Timeout ao buscar imagem do GitHub")
+async def load_variant(path: str, normalized_ref: str, reference: str,
+                       width: Optional[int], height: Optional[int], fit: str, fmt: str) -> Tuple[bytes, str]:
+    """Derivado redimensionado da imagem, cacheado por (blob SHA, variante)."""
+    return await load_derivative(
+        path, normalized_ref, reference,
+        lambda sha: variant_key(sha, width, height, fit, fmt),
+        resize_image, width, height, fit, fmt,
+    )
+
+
+@app.get("/image/reference/{reference}")
+@app.head("/image/reference/{reference}")
+async def image_by_reference(
+    reference: str,
+    request: Request,
+    w: Optional[int] = Query(None, ge=1, le=IMAGE_VARIANT_MAX_SIZE),
+    h: Optional[int] = Query(None, ge=1, le=IMAGE_VARIANT_MAX_SIZE),
+    fit: str = Query("inside"),
+    fmt: Optional[str] = Query(None, alias="format"),
+    candidate: int = Query(0, ge=0),
+):
+    """
+    Exemplo: /image/reference/1000001 ou /image/reference/100.0001
+    → aceita referência no formato XXXXXXX ou XXX.XXXX ou XXX-XXXX
+    → procura qualquer arquivo em images/ que tenha "XXX-XXXX" no nome
+    → lê da origem configurada (GitHub com token, diretório local ou os dois)
+    → devolve a imagem
+    → Suporta GET (retorna imagem) e HEAD (verifica se existe, respondido pelo índice)
+    → ?w=160&h=160&fit=contain&format=jpeg devolve um derivado redimensionado
+      (fit: inside, contain, cover, fill; format: jpeg, png, webp)
+    → ?candidate=N escolhe outro arquivo da mesma referência (ver /candidates)
+    """
+    normalized_ref = normalize_reference(reference)
+    path = await resolve_reference_path(reference, normalized_ref, candidate)
+
+    if w or h:
+        if fit not in FIT_MODES:
             raise HTTPException(
-                status_code=504,
-                detail=f"Timeout ao buscar imagem do GitHub para {path}",
+                status_code=400,
+                detail=f"fit invalido: {fit}. Use: {', '.join(FIT_MODES)}",
             )
-        except requests.exceptions.RequestException as e:
-            print(f"[IMAGE-PROXY] ERRO: Excecao ao buscar imagem: {str(e)}")
+        output_format = normalize_format(fmt, content_type_for(path))
+        if not output_format:
             raise HTTPException(
-                status_code=502,
-                detail=f"Erro ao buscar imagem do GitHub: {str(e)}",
+                status_code=400,
+                detail=f"format invalido: {fmt}. Use: {', '.join(OUTPUT_FORMATS)}",
             )
 
+        blob_sha = INDEX.path_to_sha.get(path)
+        expected_key = variant_key(blob_sha, w, h, fit, output_format) if blob_sha else None
+        if etag_matches(request.headers.get("If-None-Match"), expected_key):
+            return Response(status_code=304, headers=cache_headers(expected_key))
+
+        data, key = await load_variant(path, normalized_ref, reference, w, h, fit, output_format)
+        return Response(
+            content=data,
+            media_type=OUTPUT_FORMATS[output_format][1],
+            headers=cache_headers(key),
+        )
+
+    # requisição condicional: cliente já tem a versão atual
+    blob_sha = INDEX.path_to_sha.get(path)
+    if etag_matches(request.headers.get("If-None-Match"), blob_sha):
+        return Response(status_code=304, headers=cache_headers(blob_sha))
+
+    if request.method == "HEAD":
+        # Para HEAD, responder pelo índice (tamanho e SHA vêm da tree): sem ir à origem
+        size = INDEX.path_to_size.get(path)
+        content_type = content_type_for(path)
+        if size is None:
+            size, upstream_type = await STORAGE.head(path)
+            content_type = upstream_type or content_type
+        return Response(
+            content=b"",  # Vazio para HEAD
+            media_type=content_type,
+            headers={
+                "Content-Length": str(size),
+                "Content-Type": content_type,
+                **cache_headers(blob_sha),
+            }
+        )
+
+    # arquivo local com o mesmo blob: servido direto do disco
+    local_file = STORAGE.local_file(path, blob_sha)
+    if local_file is not None:
+        return FileResponse(local_file, media_type=content_type_for(path), headers=cache_headers(blob_sha))
+
+    # Para GET, servir do cache se o blob SHA não mudou
+    if blob_sha:
+        cached = await load_stored_image(path, blob_sha)
+        if cached is not None:
+            return Response(content=cached, media_type=content_type_for(path), headers=cache_headers(blob_sha))
+
+    # senão transmitir da origem em blocos; se outra requisição já está buscando
+    # esse path, espera por ela em vez de abrir outra conexão
+    if path not in IMAGE_STREAMS and not IMAGE_FETCHES.pending(path):
+        try:
+            streamed = await stream_image(path, normalized_ref, reference, blob_sha)
+        except HTTPException as e:
+            stale = await load_stale_image(path, e)
+            if stale is None:
+                raise
+            streamed = None
+            data, served_sha = stale
+        else:
+            if streamed is not None:
+                return streamed
+            data, served_sha = await load_image(path, normalized_ref, reference, check_cache=False)
+    else:
+        data, served_sha = await load_image(path, normalized_ref, reference, check_cache=False)
+
+    headers = cache_headers(served_sha)
+    if blob_sha and served_sha != blob_sha:
+        # versão anterior servida porque a origem está limitada
+        headers["Warning"] = '110 - "Response is Stale"'
+    return Response(content=data, media_type=content_type_for(path), headers=headers)
+
+
+@app.get("/image/reference/{reference}/zpl")
+async def image_zpl_by_reference(
+    reference: str,
+    request: Request,
+    w: int = Query(160, ge=1, le=IMAGE_ZPL_MAX_SIZE),
+    h: int = Query(160, ge=1, le=IMAGE_ZPL_MAX_SIZE),
+    dither: str = Query("threshold"),
+    dilate: int = Query(0, ge=0, le=3),
+    compress: bool = Query(False),
+    output: str = Query("gf"),
+    name: str = Query("IMAGE", pattern=r"^[A-Za-z0-9_]{1,8}$"),
+    candidate: int = Query(0, ge=0),
+):
+    """
+    Gráfico 1 bit pronto para embutir na etiqueta.
+    Exemplo: /image/reference/1000001/zpl?w=160&h=160&dither=threshold
+    → dither: threshold (igual ao Node), floyd, ordered, none
+    → dilate: raio da dilatação dos pontos pretos (0 = desligado)
+    → compress=true: dados em Z64 (zlib + base64 + CRC)
+    → output=gf: ^GFA,...^FS (colocar depois de ^FO)
+      output=dg: ~DGR:<name>.GRF,... (download para a memória da impressora, usar com ^XGR)
+    → candidate=N: outro arquivo da mesma referência (ver /candidates)
+    """
+    if dither not in DITHER_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"dither invalido: {dither}. Use: {', '.join(DITHER_MODES)}",
+        )
+    if output not in ("gf", "dg"):
+        raise HTTPException(status_code=400, detail=f"output invalido: {output}. Use: gf, dg")
+
+    normalized_ref = normalize_reference(reference)
+    path = await resolve_reference_path(reference, normalized_ref, candidate)
+
+    def key_for(sha: str) -> str:
+        return graphic_key(sha, w, h, dither, dilate, compress)
+
+    def etag_for(key: str) -> str:
+        return f"{key}.{output}" + (f".{name}" if output == "dg" else "")
+
+    blob_sha = INDEX.path_to_sha.get(path)
+    if blob_sha and etag_matches(request.headers.get("If-None-Match"), etag_for(key_for(blob_sha))):
+        return Response(status_code=304, headers=cache_headers(etag_for(key_for(blob_sha))))
+
+    graphic, key = await load_derivative(
+        path, normalized_ref, reference, key_for,
+        render_graphic, w, h, dither, dilate, compress,
+    )
+    total_bytes, bytes_per_row, _ = graphic.split(b",", 2)
+    return Response(
+        content=format_graphic(graphic, output, name),
+        media_type="text/plain",
+        headers={
+            **cache_headers(etag_for(key)),
+            "X-ZPL-Width": str(w),
+            "X-ZPL-Height": str(h),
+            "X-ZPL-Bytes-Per-Row": bytes_per_row.decode("ascii"),
+            "X-ZPL-Total-Bytes": total_bytes.decode("ascii"),
+        },
+    )
+
+
+@app.get("/image/reference/{reference}/candidates")
+async def image_candidates(reference: str):
+    """
+    Todos os arquivos da referência, na ordem de preferência.
+    O primeiro é o servido por padrão; os outros com ?candidate=N
+    em /image/reference/{reference} e /zpl.
+    """
+    normalized_ref = normalize_reference(reference)
+    index = await ensure_index()
+    paths = index.ref_to_paths.get(normalized_ref)
+    if not paths:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Reference '{reference}' (normalizada: {normalized_ref}) nao encontrada no cache",
+        )
+    return {
+        "reference": reference,
+        "normalized": normalized_ref,
+        "candidates": [candidate_info(index, path, rank) for rank, path in enumerate(paths)],
+    }
+
+
+@app.get("/images/search")
+async def images_search(q: str = Query(..., min_length=1), limit: int = Query(20, ge=1, le=200)):
+    """
+    Busca por prefixo no índice.
+    → /images/search?q=100-00 → referências que começam com 10000
+    → /images/search?q=kate   → arquivos cujo estilo começa com KATE
+    """
+    index = await ensure_index()
+    results = index.search(q, limit)
+    return {
+        "query": q,
+        "results": [
+            candidate_info(index, c.path, index.ref_to_paths[c.reference].index(c.path))
+            for c in results
+        ],
+    }
+
+
+@app.get("/images/duplicates")
+async def images_duplicates():
+    """Referências com mais de um arquivo em images/ (na ordem de preferência)."""
+    index = await ensure_index()
+    duplicates = index.duplicates()
+    return {
+        "count": len(duplicates),
+        "files": sum(len(paths) for paths in duplicates.values()),
+        "references": {ref: list(paths) for ref, paths in sorted(duplicates.items())},
+    }
+
+
+class BatchImagesRequest(BaseModel):
+    references: List[str]
+
+
+class ZipStreamBuffer:
+    """
+    Saída do zipfile sem seek (ZIP com data descriptors): o que foi escrito
+    é retirado com take() e enviado ao cliente logo em seguida.
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+class ExistsRequest(BaseModel):
+    references: List[str]
+
+
+async def lookup_references(references: List[str]) -> Dict:
+    """
+    Verifica no índice quais referências têm imagem (mesmas regras de image_by_reference),
+    sem ir à origem. Resultados na ordem do pedido.
+    """
+    if len(references) > IMAGE_EXISTS_MAX_REFERENCES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Maximo de {IMAGE_EXISTS_MAX_REFERENCES} referencias por chamada (recebidas: {len(references)})",
+        )
+
+    index = await ensure_index()
+    results: List[Dict] = []
+    found = invalid = 0
+    for reference in references:
+        item: Dict = {"reference": reference}
+        try:
+            normalized_ref = normalize_reference(reference, log=False)
+        except HTTPException as e:
+            item.update({"exists": False, "status": e.status_code, "detail": e.detail})
+            invalid += 1
+            results.append(item)
+            continue
+
+        item["normalized"] = normalized_ref
+        paths = index.ref_to_paths.get(normalized_ref)
+        if paths:
+            path = paths[0]
+            item.update({
+                "exists": True,
+                "path": path,
+                "size": index.path_to_size.get(path),
+                "sha": index.path_to_sha.get(path),
+                "candidates": len(paths),
+            })
+            found += 1
+        else:
+            item["exists"] = False
+        results.append(item)
+
+    return {
+        "found": found,
+        "missing": len(references) - found - invalid,
+        "invalid": invalid,
+        "commit": index.commit_sha,
+        "results": results,
+    }
+
+
+@app.post("/image/exists")
+async def image_exists(body: ExistsRequest):
+    """
+    Quais referências têm imagem, em uma única chamada (em vez de um HEAD por referência).
+    Responde pelo índice em memória: path, tamanho e SHA de cada referência encontrada.
+    """
+    return await lookup_references(body.references)
+
+
+@app.get("/image/exists")
+async def image_exists_get(refs: str = Query(..., description="Referencias separadas por virgula")):
+    """Mesmo que POST /image/exists: /image/exists?refs=1000001,100.0015,100-0020"""
+    return await lookup_references([ref for ref in refs.split(",") if ref.strip()])
+
+
+@app.post("/images/batch")
+async def images_batch(body: BatchImagesRequest):
+    """
+    Busca várias referências em uma única chamada.
+    → normaliza e resolve todas no índice de uma vez
+    → baixa as que não estão em cache em paralelo (limite IMAGE_BATCH_CONCURRENCY)
+    → devolve um ZIP transmitido à medida que as imagens chegam (uma por referência
+      encontrada) e, por último, manifest.json com o status de cada item (na ordem do pedido)
+    → X-Batch-Found / X-Batch-Missing contam as referências do índice;
+      falhas ao baixar ficam no manifest.json
+    """
+    if len(body.references) > IMAGE_BATCH_MAX_REFERENCES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Maximo de {IMAGE_BATCH_MAX_REFERENCES} referencias por chamada (recebidas: {len(body.references)})",
+        )
+
+    await ensure_index()
+
+    manifest: List[Dict] = []
+    # normalized_ref -> (reference original, path); cada referência é baixada uma vez só
+    to_load: Dict[str, Tuple[str, str]] = {}
+    for reference in body.references:
+        item = {"reference": reference, "status": 200}
+        try:
+            normalized_ref = normalize_reference(reference, log=False)
+            item["normalized"] = normalized_ref
+            path = await resolve_reference_path(reference, normalized_ref)
+            item["path"] = path
+            to_load.setdefault(normalized_ref, (reference, path))
+        except HTTPException as e:
+            item["status"] = e.status_code
+            item["detail"] = e.detail
+        manifest.append(item)
+
+    found = sum(1 for item in manifest if item["status"] == 200)
+    logger.info(
+        "Batch: %d referencia(s), %d no indice, %d distinta(s)", len(manifest), found, len(to_load),
+        extra={"references": len(manifest), "found": found, "distinct": len(to_load)},
+    )
+
+    async def load_one(normalized_ref: str, reference: str, path: str):
+        try:
+            # memory=False: um lote grande não expulsa do cache em memória as imagens mais pedidas
+            return normalized_ref, await load_image(path, normalized_ref, reference, memory=False)
+        except HTTPException as e:
+            return normalized_ref, e
+
+    async def body() -> AsyncIterator[bytes]:
+        output = ZipStreamBuffer()
+        # ZIP sem compressão (imagens já são comprimidas)
+        zf = zipfile.ZipFile(output, "w", compression=zipfile.ZIP_STORED)
+        loaded: Dict[str, object] = {}
+        pending = iter(to_load.items())
+        running = set()
+        try:
+            while True:
+                # no máximo IMAGE_BATCH_CONCURRENCY imagens em memória: cada uma vai para o ZIP ao terminar
+                while len(running) < IMAGE_BATCH_CONCURRENCY:
+                    next_item = next(pending, None)
+                    if next_item is None:
+                        break
+                    ref, (original, path) = next_item
+                    running.add(asyncio.ensure_future(load_one(ref, original, path)))
+                if not running:
+                    break
+                finished, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    ref, result = task.result()
+                    if isinstance(result, HTTPException):
+                        loaded[ref] = result
+                        continue
+                    data, served_sha = result
+                    file_name = ref + Path(to_load[ref][1]).suffix.lower()
+                    await run_in_threadpool(zf.writestr, file_name, data)
+                    loaded[ref] = (file_name, served_sha, len(data))
+                    yield output.take()
+
+            # manifest.json por último: status final de cada item (na ordem do pedido)
+            for item in manifest:
+                if item["status"] != 200:
+                    continue
+                result = loaded[item["normalized"]]
+                if isinstance(result, HTTPException):
+                    item["status"] = result.status_code
+                    item["detail"] = result.detail
+                    continue
+                file_name, served_sha, size = result
+                item.update({"file": file_name, "sha": served_sha, "size": size})
+            zf.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2))
+            zf.close()
+            yield output.take()
+        finally:
+            for task in running:
+                task.cancel()
+
+    return StreamingResponse(
+        body(),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": 'attachment; filename="images.zip"',
+            "X-Batch-Found": str(found),
+            "X-Batch-Missing": str(len(manifest) - found),
+        },
+    )
+
+
+class PrefetchRequest(BaseModel):
+    references: List[str]
+
+
+def image_is_stored(path: str, blob_sha: Optional[str]) -> bool:
+    """O blob já está no cache em disco ou em arquivo local? (sem ler os bytes)"""
+    if not blob_sha:
+        return False
+    return DISK_CACHE.contains(blob_sha) or STORAGE.local_file(path, blob_sha) is not None
+
+
+async def warm_image(path: str, normalized_ref: str, reference: str) -> int:
+    """
+    Garante a imagem no cache em disco (sem ocupar o cache em memória).
+    Retorna os bytes baixados (0 = já estava em cache).
+    """
+    if image_is_stored(path, INDEX.path_to_sha.get(path)):
+        return 0
+    if await wait_for_stream(path):
+        return 0
+    # busca do prefetch tem chave própria: uma requisição interativa do mesmo path não
+    # fica esperando atrás da prioridade PREFETCH; já o prefetch aproveita uma busca interativa
+    key = path if IMAGE_FETCHES.pending(path) else f"prefetch|{path}"
+    data, _ = await IMAGE_FETCHES.do(
+        key, lambda: fetch_image_from_storage(path, normalized_ref, reference, memory=False)
+    )
+    return len(data)
+
+
+async def run_prefetch(job: PrefetchJob, items: List[Tuple[str, str, str]]) -> None:
+    """
+    Aquece o cache com as imagens de `items` (reference, normalizada, path)
+    usando IMAGE_PREFETCH_CONCURRENCY workers, com prioridade PREFETCH na origem
+    (requisições interativas passam na frente e o prefetch respeita a reserva do rate limit).
+    """
+    pending = iter(items)
+
+    async def worker() -> None:
+        for reference, normalized_ref, path in pending:
+            # DELETE recebido por outro worker
+            if job.cancelled or PREFETCH_JOBS.cancel_requested(job):
+                job.cancelled = True
+                return
+            try:
+                size = await warm_image(path, normalized_ref, reference)
+            except HTTPException as e:
+                job.record("failed", reference, detail=f"{e.status_code}: {e.detail}")
+                PREFETCH_ITEMS.inc(result="failed")
+                continue
+            except Exception as e:
+                job.record("failed", reference, detail=str(e))
+                PREFETCH_ITEMS.inc(result="failed")
+                continue
+            result = "fetched" if size else "cached"
+            job.record(result, reference, size)
+            PREFETCH_ITEMS.inc(result=result)
+            PREFETCH_JOBS.publish(job)
+
+    try:
+        with upstream_priority(PREFETCH):
+            await asyncio.gather(*(worker() for _ in range(min(IMAGE_PREFETCH_CONCURRENCY, len(items)))))
+    finally:
+        job.finished_at = time.time()
+        PREFETCH_JOBS.publish(job, force=True)
+        prefetch_logger.info(
+            "Job %s %s: %d/%d em %.1fs", job.id, job.state, job.done, job.total, job.finished_at - job.created_at,
+            extra={"job_id": job.id, **job.counts, "bytes_fetched": job.bytes_fetched},
+        )
+
+
+@app.post("/images/prefetch", status_code=202)
+async def images_prefetch(body: PrefetchRequest):
+    """
+    Aquece o cache com as imagens das referências (ex.: todas as de um PO antes de imprimir).
+    → responde na hora com o job; o download segue em segundo plano
+    → referências repetidas são baixadas uma vez; as que já estão em cache só são contadas
+    → progresso em GET /images/prefetch/{job_id}
+    """
+    if len(body.references) > IMAGE_PREFETCH_MAX_REFERENCES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Maximo de {IMAGE_PREFETCH_MAX_REFERENCES} referencias por chamada (recebidas: {len(body.references)})",
+        )
+
+    index = await ensure_index()
+    seen = set()
+    rejected: List[Tuple[str, str, str]] = []
+    items: List[Tuple[str, str, str]] = []
+    for reference in body.references:
+        try:
+            normalized_ref = normalize_reference(reference, log=False)
+        except HTTPException as e:
+            rejected.append(("invalid", reference, e.detail))
+            continue
+        if normalized_ref in seen:
+            continue
+        seen.add(normalized_ref)
+        paths = index.ref_to_paths.get(normalized_ref)
+        if not paths:
+            rejected.append(("missing", reference, f"Reference '{reference}' nao encontrada no indice"))
+            continue
+        items.append((reference, normalized_ref, paths[0]))
+
+    job = PREFETCH_JOBS.create(total=len(rejected) + len(items))
+    for result, reference, detail in rejected:
+        job.record(result, reference, detail=detail)
+        PREFETCH_ITEMS.inc(result=result)
+    prefetch_logger.info(
+        "Job %s: %d imagem(ns) para aquecer, %d referencia(s) ignorada(s)", job.id, len(items), len(rejected),
+        extra={"job_id": job.id},
+    )
+    PREFETCH_JOBS.publish(job, force=True)
+    job.task = asyncio.create_task(run_prefetch(job, items))
+    return job.snapshot()
+
+
+@app.get("/images/prefetch")
+async def images_prefetch_jobs():
+    """Jobs de prefetch em andamento e os últimos terminados (de todos os workers)."""
+    return {"jobs": PREFETCH_JOBS.snapshots()}
+
+
+def prefetch_job_not_found(job_id: str) -> HTTPException:
+    return HTTPException(status_code=404, detail=f"Job de prefetch '{job_id}' nao encontrado")
+
+
+@app.get("/images/prefetch/{job_id}")
+async def images_prefetch_status(job_id: str):
+    """Progresso do job: total, processadas e contagem por resultado (fetched, cached, missing, invalid, failed)."""
+    snapshot = PREFETCH_JOBS.snapshot(job_id)
+    if snapshot is None:
+        raise prefetch_job_not_found(job_id)
+    return snapshot
+
+
+@app.delete("/images/prefetch/{job_id}")
+async def images_prefetch_cancel(job_id: str):
+    """
+    Cancela o job (os downloads já iniciados terminam e ficam no cache).
+    Job de outro worker: o cancelamento é pedido e vale na próxima referência.
+    """
+    job = PREFETCH_JOBS.get(job_id)
+    if job is None:
+        if not PREFETCH_JOBS.request_cancel(job_id):
+            raise prefetch_job_not_found(job_id)
+        return {**(PREFETCH_JOBS.snapshot(job_id) or {"id": job_id}), "cancel_requested": True}
+    if job.finished_at is None:
+        job.cancelled = True
+        job.task.cancel()
+        await asyncio.wait([job.task])
+    return job.snapshot()
+
 
 @app.post("/cache/reload")
-def reload_cache():
+async def reload_cache(full: bool = False):
     """
     Endpoint opcional para recarregar o cache manualmente.
+    Incremental por padrão; ?full=true remonta o índice inteiro.
     """
-    build_cache()
-    return {"status": "ok", "refs": len(REF_TO_PATH)}
+    try:
+        result = await refresh_index(full=full)
+    except Exception as e:
+        raise HTTPException(
+            status_code=502,
+            detail=f"Falha ao recarregar o indice (indice anterior mantido): {e}",
+        )
+    return {"status": "ok", "refs": len(INDEX.ref_to_path), **result}
 
 
 @app.get("/")
@@ -273,10 +1586,18 @@ def root():
         "service": "Image Proxy GitHub por Reference",
         "endpoints": {
             "get_image": "/image/reference/{reference}",
+            "zpl_graphic": "/image/reference/{reference}/zpl",
+            "candidates": "/image/reference/{reference}/candidates",
+            "search": "/images/search?q=",
+            "duplicates": "/images/duplicates",
+            "exists": "POST /image/exists ou /image/exists?refs=",
+            "batch_images": "POST /images/batch",
+            "prefetch": "POST /images/prefetch, /images/prefetch/{job_id}",
             "reload_cache": "POST /cache/reload",
-            "status": "/status"
+            "status": "/status",
+            "metrics": "/metrics"
         },
-        "cache_size": len(REF_TO_PATH)
+        "cache_size": len(INDEX.ref_to_path)
     }
 
 
@@ -287,6 +1608,71 @@ def status():
     """
     return {
         "status": "online",
-        "cache_size": len(REF_TO_PATH),
-        "cache_loaded": len(REF_TO_PATH) > 0
+        "cache_size": len(INDEX.ref_to_path),
+        "cache_loaded": INDEX.loaded,
+        "duplicate_references": len(INDEX.duplicates()),
+        "storage": STORAGE.name,
+        "index": {
+            "commit": INDEX.commit_sha,
+            "source": INDEX.source,
+            "built_at": INDEX.built_at,
+            "refresh_interval": IMAGE_INDEX_REFRESH_INTERVAL,
+            "last_error": INDEX_LAST_ERROR,
+        },
+        "memory_cache": MEMORY_CACHE.stats(),
+        "disk_cache": DISK_CACHE.stats(),
+        "upstream_fetches": IMAGE_FETCHES.stats(),
+        "upstream_rate_limit": UPSTREAM.stats(),
+        "worker": {"pid": os.getpid(), "index_leader": INDEX_LEADER_LOCK.held},
+        "prefetch_jobs_running": len(PREFETCH_JOBS.running()),
     }
+
+
+def collect_cache_stats(stat: str):
+    return [({"tier": tier}, cache.stats()[stat]) for tier, cache in (("memory", MEMORY_CACHE), ("disk", DISK_CACHE))]
+
+
+def collect_singleflight_stats(stat: str):
+    groups = (("image_fetch", IMAGE_FETCHES), ("derivative", VARIANT_JOBS), ("index", INDEX_REFRESHES))
+    return [({"group": group}, flight.stats()[stat]) for group, flight in groups]
+
+
+for _stat in ("hits", "misses", "evictions"):
+    METRICS.collected(f"cache_{_stat}_total", f"Cache: {_stat} por camada", "counter",
+                      lambda stat=_stat: collect_cache_stats(stat))
+for _stat in ("bytes", "max_bytes", "entries"):
+    METRICS.collected(f"cache_{_stat}", f"Cache: {_stat} por camada", "gauge",
+                      lambda stat=_stat: collect_cache_stats(stat))
+for _stat in ("calls", "executions", "coalesced", "errors"):
+    METRICS.collected(f"singleflight_{_stat}_total", f"Coalescencia: {_stat} por grupo", "counter",
+                      lambda stat=_stat: collect_singleflight_stats(stat))
+METRICS.collected("singleflight_in_flight", "Execucoes coalescidas em andamento", "gauge",
+                  lambda: collect_singleflight_stats("in_flight"))
+METRICS.collected("upstream_rate_limit_remaining", "X-RateLimit-Remaining conhecido por host", "gauge",
+                  lambda: [({"host": host}, s["remaining"]) for host, s in UPSTREAM.stats().items()
+                           if s["remaining"] is not None])
+METRICS.collected("upstream_queue_waiting", "Requisicoes esperando vaga no limite por host", "gauge",
+                  lambda: [({"host": host}, sem.waiting) for host, sem in _HOST_SEMAPHORES.items()])
+METRICS.collected("log_records_dropped_total", "Registros de log descartados com a fila cheia", "counter",
+                  lambda: [({}, LOG_HANDLER.dropped)])
+METRICS.collected("streams_in_flight", "Imagens sendo transmitidas da origem", "gauge",
+                  lambda: [({}, len(IMAGE_STREAMS))])
+METRICS.collected("index_files", "Arquivos no indice (tamanho da tree de images/)", "gauge",
+                  lambda: [({}, len(INDEX.path_to_sha))])
+METRICS.collected("index_references", "Referencias no indice", "gauge",
+                  lambda: [({}, len(INDEX.ref_to_path))])
+METRICS.collected("index_duplicate_references", "Referencias com mais de um arquivo", "gauge",
+                  lambda: [({}, len(INDEX.duplicates()))])
+METRICS.collected("index_age_seconds", "Idade do indice publicado", "gauge",
+                  lambda: [({}, time.time() - INDEX.built_at if INDEX.loaded else 0)])
+METRICS.collected("index_last_refresh_failed", "1 se a ultima atualizacao do indice falhou", "gauge",
+                  lambda: [({}, 1 if INDEX_LAST_ERROR else 0)])
+
+
+@app.get("/metrics")
+def metrics():
+    """
+    Métricas no formato texto do Prometheus: requisições e latência por rota,
+    caches por camada, origem (latência, status, erros), índice e coalescência.
+    """
+    return Response(content=METRICS.render(), media_type="text/plain; version=0.0.4")
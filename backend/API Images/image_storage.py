@@ -0,0 +1,533 @@
+import hashlib
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+from contextlib import AsyncExitStack
+from dataclasses import replace
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from pathlib import Path
+from typing import AsyncContextManager, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote
+
+import httpx
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from reference_index import ReferenceIndex
+from upstream_scheduler import is_rate_limited
+
+logger = logging.getLogger("image_proxy.storage")
+
+
+def git_blob_sha(data: bytes) -> str:
+    """SHA do blob como o Git calcula: sha1("blob <tamanho>" + NUL + conteúdo)."""
+    h = hashlib.sha1()
+    h.update(b"blob %d\0" % len(data))
+    h.update(data)
+    return h.hexdigest()
+
+
+def git_blob_sha_of_file(file_path: Path, chunk_size: int = 1024 * 1024) -> str:
+    """git_blob_sha de um arquivo, lido em blocos."""
+    h = hashlib.sha1()
+    h.update(b"blob %d\0" % os.path.getsize(file_path))
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def publish_entries(current: ReferenceIndex, entries: Iterable[Tuple[str, str, int]],
+                    incremental: bool, prefix: str, **fields) -> Tuple[ReferenceIndex, Dict]:
+    """
+    Monta o índice novo a partir de (path, blob SHA, tamanho) e calcula a diferença
+    para o índice atual (adicionadas, removidas, alteradas), pelo arquivo preferido
+    de cada referência. `fields` são os demais campos do ReferenceIndex (commit_sha...).
+    """
+    path_to_sha: Dict[str, str] = {}
+    path_to_size: Dict[str, int] = {}
+    for path, sha, size in entries:
+        path_to_sha[path] = sha
+        path_to_size[path] = size
+    index = ReferenceIndex(path_to_sha=path_to_sha, path_to_size=path_to_size, built_at=time.time(), **fields)
+    new_ref_to_path, new_path_to_sha = index.ref_to_path, index.path_to_sha
+
+    old_ref_to_path, old_path_to_sha = current.ref_to_path, current.path_to_sha
+    added = [ref for ref in new_ref_to_path if ref not in old_ref_to_path]
+    removed = [ref for ref in old_ref_to_path if ref not in new_ref_to_path]
+    changed = [
+        ref for ref, path in new_ref_to_path.items()
+        if ref in old_ref_to_path and (
+            old_ref_to_path[ref] != path or old_path_to_sha.get(old_ref_to_path[ref]) != new_path_to_sha[path]
+        )
+    ]
+
+    duplicates = index.duplicates()
+    fields = {
+        "prefix": prefix,
+        "files": len(new_path_to_sha),
+        "references": len(new_ref_to_path),
+        "duplicate_references": len(duplicates),
+        "duplicate_files": sum(len(paths) for paths in duplicates.values()),
+    }
+    if incremental:
+        fields.update({"added": len(added), "removed": len(removed), "changed": len(changed)})
+    logger.info("Indice montado: %d imagem(ns), %d referencia(s) valida(s)",
+                len(new_path_to_sha), len(new_ref_to_path), extra=fields)
+
+    return index, {
+        "changed": True,
+        "commit": index.commit_sha,
+        "added": len(added),
+        "removed": len(removed),
+        "updated": len(changed),
+    }
+
+
+class ImageStorage(ABC):
+    """
+    Origem das imagens do proxy. Cada backend sabe montar o índice
+    (reference -> path -> blob SHA) e ler os bytes de um path do índice.
+    """
+
+    name = "base"
+
+    @property
+    @abstractmethod
+    def source(self) -> str:
+        """Identifica a origem do índice (gravada no ReferenceIndex.source de cada índice montado)."""
+
+    @property
+    def sources(self) -> Tuple[str, ...]:
+        """Origens de índice aceitas por este backend (snapshot de outra origem é ignorado)."""
+        return (self.source,)
+
+    @abstractmethod
+    async def build_index(self, current: ReferenceIndex, full: bool = False) -> Tuple[ReferenceIndex, Dict]:
+        """
+        Índice novo (ou o atual, se nada mudou) e o resumo da atualização.
+        Não altera `current`; se a origem falhar, a exceção sobe.
+        """
+
+    @abstractmethod
+    async def read(self, path: str, normalized_ref: str, reference: str) -> bytes:
+        """Bytes da imagem (HTTPException com o status adequado se falhar)."""
+
+    @abstractmethod
+    async def head(self, path: str) -> Tuple[int, Optional[str]]:
+        """(tamanho em bytes, content type ou None) sem ler o conteúdo."""
+
+    async def open_stream(self, path: str, normalized_ref: str, reference: str,
+                          stack: AsyncExitStack) -> Optional[Tuple[AsyncIterator[bytes], Optional[int], Optional[str]]]:
+        """
+        Abre a leitura em partes: (iterador de blocos, tamanho ou None, content type ou None).
+        Os recursos ficam em `stack` (quem chamou fecha no fim do stream).
+        None se o backend não faz streaming (o proxy lê os bytes inteiros com read).
+        """
+        return None
+
+    def local_file(self, path: str, blob_sha: Optional[str]) -> Optional[Path]:
+        """Arquivo local com exatamente esse blob (para servir direto do disco), se houver."""
+        return None
+
+    def adopt_index(self, index: ReferenceIndex) -> None:
+        """
+        Prepara o backend para servir um índice montado por outro worker (snapshot
+        compartilhado), sem build_index neste processo. Roda fora do event loop.
+        """
+
+
+class GitHubStorage(ImageStorage):
+    """Repo no GitHub: índice pela Git Trees API, bytes por raw.githubusercontent.com."""
+
+    name = "github"
+    # tamanho dos blocos repassados ao cliente no streaming
+    chunk_size = 64 * 1024
+
+    def __init__(self, owner: str, repo: str, branch: str, prefix: str,
+                 request: Callable[..., Awaitable[httpx.Response]], headers: Dict[str, str],
+                 stream: Optional[Callable[..., AsyncContextManager[httpx.Response]]] = None):
+        self.owner = owner
+        self.repo = repo
+        self.branch = branch
+        self.prefix = prefix
+        # upstream_request / upstream_stream do proxy (pool compartilhado + limite por host)
+        self.request = request
+        self.stream = stream
+        self.headers = headers
+
+    @property
+    def source(self) -> str:
+        return f"{self.owner}/{self.repo}@{self.branch}:{self.prefix}"
+
+    def raw_url(self, path: str) -> str:
+        return f"https://raw.githubusercontent.com/{self.owner}/{self.repo}/{self.branch}/{quote(path)}"
+
+    async def build_index(self, current: ReferenceIndex, full: bool = False) -> Tuple[ReferenceIndex, Dict]:
+        """
+        Usa Git Trees API (sem limite de 1000 arquivos).
+        Atualização incremental:
+        → GET condicional (ETag) no ref da branch: se não mudou, nada a fazer (304 não gasta rate limit)
+        → se o commit mudou mas a tree de images/ é a mesma, nada a fazer
+        → senão baixa só a subtree de images/ e calcula a diferença (adicionadas, removidas, alteradas)
+        full=True ignora o estado anterior e remonta tudo.
+        """
+        api = f"https://api.github.com/repos/{self.owner}/{self.repo}/git"
+        incremental = current.loaded and not full
+
+        # 1) pegar SHA do último commit da branch (condicional se já temos índice)
+        ref_headers = dict(self.headers)
+        if incremental and current.ref_etag:
+            ref_headers["If-None-Match"] = current.ref_etag
+        ref_resp = await self.request("GET", f"{api}/ref/heads/{self.branch}", headers=ref_headers)
+        if ref_resp.status_code == 304:
+            logger.info("Branch %s sem alteracoes (304), indice mantido", self.branch)
+            return current, {"changed": False, "commit": current.commit_sha}
+        ref_resp.raise_for_status()
+        ref_etag = ref_resp.headers.get("ETag")
+        commit_sha = ref_resp.json()["object"]["sha"]
+
+        if incremental and commit_sha == current.commit_sha:
+            logger.info("Commit %s ja indexado", commit_sha[:7])
+            return replace(current, ref_etag=ref_etag), {"changed": False, "commit": commit_sha}
+
+        # 2) pegar SHA da tree
+        commit_resp = await self.request("GET", f"{api}/commits/{commit_sha}")
+        commit_resp.raise_for_status()
+        commit_data = commit_resp.json()
+        tree_sha = commit_data["tree"]["sha"]
+        committed_at = commit_data.get("committer", {}).get("date")
+        last_modified = current.last_modified
+        if committed_at:
+            last_modified = format_datetime(
+                datetime.fromisoformat(committed_at.replace("Z", "+00:00")), usegmt=True
+            )
+
+        # 3) achar a subtree de images/ na raiz (não recursiva, resposta pequena)
+        root_resp = await self.request("GET", f"{api}/trees/{tree_sha}")
+        root_resp.raise_for_status()
+        images_dir = self.prefix.rstrip("/")
+        images_tree_sha = next(
+            (item["sha"] for item in root_resp.json()["tree"]
+             if item["type"] == "tree" and item["path"] == images_dir),
+            None,
+        )
+
+        if incremental and images_tree_sha == current.images_tree_sha:
+            logger.info("Commit %s sem mudancas em %s, indice mantido", commit_sha[:7], self.prefix)
+            index = replace(current, commit_sha=commit_sha, ref_etag=ref_etag, last_modified=last_modified)
+            return index, {"changed": False, "commit": commit_sha}
+
+        # 4) pegar só a árvore de images/ (recursiva; os paths vêm sem o prefixo)
+        tree_data: List[Dict] = []
+        if images_tree_sha:
+            tree_resp = await self.request("GET", f"{api}/trees/{images_tree_sha}?recursive=1")
+            tree_resp.raise_for_status()
+            tree_data = tree_resp.json()["tree"]
+
+        entries = (
+            (self.prefix + item["path"], item["sha"], item.get("size", 0))
+            for item in tree_data if item["type"] == "blob"
+        )
+        return publish_entries(
+            current, entries, incremental, self.prefix,
+            commit_sha=commit_sha,
+            images_tree_sha=images_tree_sha,
+            ref_etag=ref_etag,
+            last_modified=last_modified,
+            source=self.source,
+        )
+
+    @staticmethod
+    def _request_failed(e: httpx.HTTPError, path: str) -> HTTPException:
+        if isinstance(e, httpx.TimeoutException):
+            logger.error("Timeout ao buscar imagem do GitHub", extra={"image_path": path})
+            return HTTPException(
+                status_code=504,
+                detail=f"Timeout ao buscar imagem do GitHub para {path}",
+            )
+        logger.error("Excecao ao buscar imagem: %s", e, extra={"image_path": path})
+        return HTTPException(
+            status_code=502,
+            detail=f"Erro ao buscar imagem do GitHub: {str(e)}",
+        )
+
+    @staticmethod
+    def _check_status(resp: httpx.Response, raw_url: str, path: str, normalized_ref: str, reference: str) -> None:
+        if resp.status_code == 200:
+            return
+
+        # Log detalhado do erro
+        logger.error(
+            "GitHub retornou %d", resp.status_code,
+            extra={"status": resp.status_code, "url": raw_url, "image_path": path, "reference": normalized_ref},
+        )
+
+        if resp.status_code == 404:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Imagem nao encontrada no GitHub para referencia '{reference}' (normalizada: {normalized_ref}). Path: {path}",
+            )
+        elif is_rate_limited(resp):
+            retry_after = resp.headers.get("Retry-After")
+            raise HTTPException(
+                status_code=429,
+                detail=f"Rate limit do GitHub atingido. Aguarde alguns minutos e tente novamente. Path: {path}",
+                headers={"Retry-After": retry_after} if retry_after else None,
+            )
+        elif resp.status_code == 403:
+            raise HTTPException(
+                status_code=403,
+                detail=f"Acesso negado pelo GitHub. Verifique se o GITHUB_TOKEN esta valido e tem permissoes para acessar o repositorio.",
+            )
+        else:
+            raise HTTPException(
+                status_code=502,
+                detail=f"GitHub retornou {resp.status_code} para {path}. Verifique se a imagem existe no repositorio.",
+            )
+
+    async def read(self, path: str, normalized_ref: str, reference: str) -> bytes:
+        raw_url = self.raw_url(path)
+        try:
+            resp = await self.request("GET", raw_url)
+        except httpx.HTTPError as e:
+            raise self._request_failed(e, path)
+        self._check_status(resp, raw_url, path, normalized_ref, reference)
+        return resp.content
+
+    async def open_stream(self, path: str, normalized_ref: str, reference: str,
+                          stack: AsyncExitStack) -> Optional[Tuple[AsyncIterator[bytes], Optional[int], Optional[str]]]:
+        if self.stream is None:
+            return None
+        raw_url = self.raw_url(path)
+        try:
+            resp = await stack.enter_async_context(self.stream("GET", raw_url))
+        except httpx.HTTPError as e:
+            raise self._request_failed(e, path)
+        self._check_status(resp, raw_url, path, normalized_ref, reference)
+
+        # com Content-Encoding o tamanho do header não é o do corpo decodificado
+        length = resp.headers.get("Content-Length")
+        if "Content-Encoding" in resp.headers or not (length and length.isdigit()):
+            length = None
+        return resp.aiter_bytes(self.chunk_size), int(length) if length else None, resp.headers.get("Content-Type")
+
+    async def head(self, path: str) -> Tuple[int, Optional[str]]:
+        try:
+            head_resp = await self.request("HEAD", self.raw_url(path))
+        except httpx.HTTPError as e:
+            raise HTTPException(
+                status_code=502,
+                detail=f"Erro ao verificar imagem no GitHub: {str(e)}",
+            )
+        if head_resp.status_code != 200:
+            raise HTTPException(
+                status_code=502,
+                detail=f"GitHub retornou {head_resp.status_code} para {path}",
+            )
+        return int(head_resp.headers.get("Content-Length", "0")), head_resp.headers.get("Content-Type")
+
+
+class LocalStorage(ImageStorage):
+    """
+    Diretório local com as imagens (checkout do repo ou cópia dentro da imagem Docker).
+    Indexa com os.scandir e calcula o blob SHA como o Git, então ETags e chaves de
+    cache são as mesmas do backend GitHub. O hash de cada arquivo é guardado por
+    (tamanho, mtime) e só é recalculado quando o arquivo muda.
+    """
+
+    name = "local"
+
+    def __init__(self, root: Path, prefix: str):
+        self.root = Path(root)
+        self.prefix = prefix
+        # path -> (tamanho, mtime_ns, blob SHA) da última varredura
+        self._hashes: Dict[str, Tuple[int, int, str]] = {}
+
+    @property
+    def source(self) -> str:
+        return f"local:{self.root.resolve()}:{self.prefix}"
+
+    def _file_path(self, path: str) -> Path:
+        return self.root / path
+
+    def scan(self) -> Tuple[List[Tuple[str, str, int]], float]:
+        """
+        Varre o diretório de imagens. Retorna (path, blob SHA, tamanho) ordenados
+        por path e o mtime mais recente. Roda fora do event loop (I/O e hash).
+        """
+        base = self.root / self.prefix
+        if not base.is_dir():
+            raise FileNotFoundError(f"Diretorio de imagens nao encontrado: {base}")
+
+        previous = self._hashes
+        hashes: Dict[str, Tuple[int, int, str]] = {}
+        newest = 0.0
+        pending = [(base, self.prefix)]
+        while pending:
+            directory, rel = pending.pop()
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append((Path(entry.path), f"{rel}{entry.name}/"))
+                        continue
+                    if not entry.is_file():
+                        continue
+                    st = entry.stat()
+                    path = rel + entry.name
+                    known = previous.get(path)
+                    if known and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+                        sha = known[2]
+                    else:
+                        sha = git_blob_sha_of_file(Path(entry.path))
+                    hashes[path] = (st.st_size, st.st_mtime_ns, sha)
+                    newest = max(newest, st.st_mtime)
+
+        self._hashes = hashes
+        return sorted((path, info[2], info[0]) for path, info in hashes.items()), newest
+
+    async def build_index(self, current: ReferenceIndex, full: bool = False) -> Tuple[ReferenceIndex, Dict]:
+        entries, newest = await run_in_threadpool(self.scan)
+
+        # "commit" do diretório: hash da listagem (path + blob SHA)
+        listing = hashlib.sha1()
+        for path, sha, _ in entries:
+            listing.update(f"{path}\0{sha}\n".encode("utf-8"))
+        digest = listing.hexdigest()
+
+        incremental = current.loaded and not full
+        if incremental and digest == current.images_tree_sha:
+            logger.info("%s sem alteracoes, indice mantido", self.root / self.prefix)
+            return current, {"changed": False, "commit": current.commit_sha}
+
+        last_modified = None
+        if newest:
+            last_modified = format_datetime(datetime.fromtimestamp(newest, timezone.utc), usegmt=True)
+        return publish_entries(
+            current, entries, incremental, self.prefix,
+            commit_sha=digest,
+            images_tree_sha=digest,
+            last_modified=last_modified,
+            source=self.source,
+        )
+
+    def local_file(self, path: str, blob_sha: Optional[str]) -> Optional[Path]:
+        known = self._hashes.get(path)
+        if not known or not blob_sha or known[2] != blob_sha:
+            return None
+        file_path = self._file_path(path)
+        try:
+            st = file_path.stat()
+        except OSError:
+            return None
+        # arquivo alterado depois da varredura: o hash guardado não vale mais
+        if st.st_size != known[0] or st.st_mtime_ns != known[1]:
+            return None
+        return file_path
+
+    def adopt_index(self, index: ReferenceIndex) -> None:
+        """
+        Usa os hashes de um índice montado deste diretório por outro worker: vale o blob SHA
+        do índice para o arquivo com o mesmo tamanho e não modificado depois do build
+        (só stat, sem reler os arquivos). Índice de outra origem é ignorado.
+        """
+        if index.source != self.source:
+            return
+        previous = self._hashes
+        hashes: Dict[str, Tuple[int, int, str]] = {}
+        for path, sha in index.path_to_sha.items():
+            try:
+                st = self._file_path(path).stat()
+            except OSError:
+                continue
+            known = previous.get(path)
+            if known and known[:2] == (st.st_size, st.st_mtime_ns):
+                if known[2] == sha:
+                    hashes[path] = known
+                continue
+            if st.st_size == index.path_to_size.get(path) and st.st_mtime <= index.built_at:
+                hashes[path] = (st.st_size, st.st_mtime_ns, sha)
+        self._hashes = hashes
+
+    async def read(self, path: str, normalized_ref: str, reference: str) -> bytes:
+        file_path = self._file_path(path)
+        try:
+            return await run_in_threadpool(file_path.read_bytes)
+        except FileNotFoundError:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Imagem nao encontrada em {self.root} para referencia '{reference}' (normalizada: {normalized_ref}). Path: {path}",
+            )
+        except OSError as e:
+            raise HTTPException(status_code=500, detail=f"Erro ao ler {file_path}: {e}")
+
+    async def head(self, path: str) -> Tuple[int, Optional[str]]:
+        try:
+            st = await run_in_threadpool(self._file_path(path).stat)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail=f"Imagem nao encontrada: {path}")
+        return st.st_size, None
+
+
+class LayeredStorage(ImageStorage):
+    """
+    Índice do GitHub (fonte da verdade) com leitura pelo diretório local:
+    → path com o mesmo blob SHA no diretório local: servido do disco
+    → senão (arquivo novo/alterado depois do build da imagem): busca no GitHub
+      e o proxy grava nos caches como de costume (read-through)
+    Se o GitHub estiver fora e ainda não houver índice, usa o índice do diretório local
+    (marcado com a origem local em ReferenceIndex.source; a próxima atualização volta ao GitHub).
+    """
+
+    name = "layered"
+
+    def __init__(self, remote: GitHubStorage, local: LocalStorage):
+        self.remote = remote
+        self.local = local
+
+    @property
+    def source(self) -> str:
+        return self.remote.source
+
+    @property
+    def sources(self) -> Tuple[str, ...]:
+        # snapshot montado pelo fallback local também vale
+        return (self.remote.source, self.local.source)
+
+    async def build_index(self, current: ReferenceIndex, full: bool = False) -> Tuple[ReferenceIndex, Dict]:
+        try:
+            await run_in_threadpool(self.local.scan)
+        except OSError as e:
+            logger.warning("Diretorio local indisponivel, usando so o GitHub: %s", e)
+
+        try:
+            return await self.remote.build_index(current, full)
+        except Exception as e:
+            if current.loaded:
+                raise
+            logger.warning("GitHub indisponivel (%s), usando o indice do diretorio local", e)
+            return await self.local.build_index(current, full)
+
+    def local_file(self, path: str, blob_sha: Optional[str]) -> Optional[Path]:
+        return self.local.local_file(path, blob_sha)
+
+    def adopt_index(self, index: ReferenceIndex) -> None:
+        # o índice é do GitHub: os hashes locais vêm da varredura (incremental por tamanho/mtime)
+        try:
+            self.local.scan()
+        except OSError as e:
+            logger.warning("Diretorio local indisponivel, usando so o GitHub: %s", e)
+
+    async def read(self, path: str, normalized_ref: str, reference: str) -> bytes:
+        return await self.remote.read(path, normalized_ref, reference)
+
+    async def head(self, path: str) -> Tuple[int, Optional[str]]:
+        return await self.remote.head(path)
+
+    async def open_stream(self, path: str, normalized_ref: str, reference: str,
+                          stack: AsyncExitStack) -> Optional[Tuple[AsyncIterator[bytes], Optional[int], Optional[str]]]:
+        return await self.remote.open_stream(path, normalized_ref, reference, stack)
@@ -0,0 +1,105 @@
+import io
+import os
+from typing import Optional
+
+from PIL import Image, ImageOps
+
+# limite de pixels de uma imagem decodificada: um arquivo pequeno com dimensões enormes
+# (decompression bomb) esgotaria a memória dos processos do pool de resize
+MAX_IMAGE_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", "50000000"))
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# fit igual ao sharp (usado no backend Node):
+#   inside  → cabe dentro de w x h, mantém proporção, sem borda (padrão)
+#   contain → cabe dentro de w x h e completa com fundo branco até w x h
+#   cover   → preenche w x h e corta o excesso (centralizado)
+#   fill    → estica para exatamente w x h
+FIT_MODES = ("inside", "contain", "cover", "fill")
+
+# formato -> (nome no Pillow, content type)
+OUTPUT_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+    "webp": ("WEBP", "image/webp"),
+}
+
+_FORMAT_ALIASES = {"jpg": "jpeg"}
+
+
+def normalize_format(fmt: Optional[str], original_content_type: str) -> Optional[str]:
+    """Formato de saída normalizado; sem formato explícito, PNG continua PNG e o resto vira JPEG."""
+    if not fmt:
+        return "png" if original_content_type == "image/png" else "jpeg"
+    fmt = _FORMAT_ALIASES.get(fmt.lower(), fmt.lower())
+    return fmt if fmt in OUTPUT_FORMATS else None
+
+
+def variant_key(blob_sha: str, width: Optional[int], height: Optional[int], fit: str, fmt: str) -> str:
+    """Chave do derivado no cache: <sha>.<w>x<h>.<fit>.<formato>."""
+    return f"{blob_sha}.{width or 0}x{height or 0}.{fit}.{fmt}"
+
+
+def open_image(data: bytes) -> Image.Image:
+    """
+    Abre a imagem recusando as maiores que MAX_IMAGE_PIXELS
+    (sozinho, o Pillow só recusa acima do dobro do limite; antes disso apenas avisa).
+    """
+    img = Image.open(io.BytesIO(data))
+    if img.width * img.height > MAX_IMAGE_PIXELS:
+        img.close()
+        raise Image.DecompressionBombError(
+            f"Imagem de {img.width}x{img.height} pixels excede o limite de {MAX_IMAGE_PIXELS}"
+        )
+    return img
+
+
+def _flatten(img: Image.Image) -> Image.Image:
+    """Remove transparência sobre fundo branco (JPEG não tem canal alfa)."""
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    return img.convert("RGB") if img.mode not in ("RGB", "L") else img
+
+
+def resize_image(data: bytes, width: Optional[int], height: Optional[int],
+                 fit: str, fmt: str, quality: int = 85) -> bytes:
+    """
+    Redimensiona a imagem e devolve os bytes no formato pedido.
+    Função de módulo (sem estado) para poder rodar em ProcessPoolExecutor.
+    """
+    with open_image(data) as src:
+        # fotos de celular: aplicar a rotação do EXIF antes de redimensionar
+        img = ImageOps.exif_transpose(src)
+        if fmt != "png":
+            img = _flatten(img)
+
+        if width and height:
+            size = (width, height)
+            if fit == "fill":
+                img = img.resize(size, Image.LANCZOS)
+            elif fit == "cover":
+                img = ImageOps.fit(img, size, Image.LANCZOS)
+            elif fit == "contain":
+                fitted = ImageOps.contain(img, size, Image.LANCZOS)
+                background = Image.new(fitted.mode, size, "white")
+                background.paste(fitted, ((width - fitted.width) // 2, (height - fitted.height) // 2))
+                img = background
+            else:
+                img = ImageOps.contain(img, size, Image.LANCZOS)
+        elif width or height:
+            # só uma dimensão: a outra segue a proporção original
+            ratio = (width / img.width) if width else (height / img.height)
+            img = img.resize(
+                (max(1, round(img.width * ratio)), max(1, round(img.height * ratio))),
+                Image.LANCZOS,
+            )
+
+        out = io.BytesIO()
+        pil_format = OUTPUT_FORMATS[fmt][0]
+        if pil_format == "PNG":
+            img.save(out, pil_format, optimize=True)
+        else:
+            img.save(out, pil_format, quality=quality)
+        return out.getvalue()
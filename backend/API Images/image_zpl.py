@@ -0,0 +1,136 @@
+import base64
+import binascii
+import zlib
+
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
+
+# open_image aplica o limite de pixels (IMAGE_MAX_PIXELS) também aos gráficos ZPL
+from image_variants import open_image
+
+# modos de conversão para 1 bit:
+#   threshold → mesmo pipeline do backend Node (normalise + sharpen + contraste + threshold adaptativo)
+#   floyd     → dithering Floyd-Steinberg (implementação em C do Pillow)
+#   ordered   → dithering ordenado (matriz de Bayer 8x8), totalmente vetorizado
+#   none      → threshold fixo em 128
+DITHER_MODES = ("threshold", "floyd", "ordered", "none")
+
+_BAYER_2 = np.array([[0, 2], [3, 1]])
+
+
+def _bayer_matrix(n: int) -> np.ndarray:
+    m = _BAYER_2
+    while m.shape[0] < n:
+        m = np.block([[4 * m, 4 * m + 2], [4 * m + 3, 4 * m + 1]])
+    return m
+
+
+_BAYER_8 = (_bayer_matrix(8) + 0.5) * (256 / 64)
+
+
+def graphic_key(blob_sha: str, width: int, height: int, dither: str, dilate: int, z64: bool) -> str:
+    """Chave do gráfico no cache: <sha>.<w>x<h>.zpl-<dither>-r<dilate>.<hex|z64>."""
+    return f"{blob_sha}.{width}x{height}.zpl-{dither}-r{dilate}.{'z64' if z64 else 'hex'}"
+
+
+def _load_grayscale(data: bytes, width: int, height: int) -> Image.Image:
+    """Reduz para w x h (fit contain, fundo branco) em escala de cinza, como o sharp no Node."""
+    with open_image(data) as src:
+        img = ImageOps.exif_transpose(src)
+        if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        img = img.convert("L")
+        fitted = ImageOps.contain(img, (width, height), Image.LANCZOS)
+        canvas = Image.new("L", (width, height), 255)
+        canvas.paste(fitted, ((width - fitted.width) // 2, (height - fitted.height) // 2))
+        return canvas
+
+
+def _adaptive_threshold(img: Image.Image) -> np.ndarray:
+    """Equivalente vetorizado do threshold adaptativo de convertImageToZPL (server.js)."""
+    img = ImageOps.autocontrast(img, cutoff=1)
+    img = img.filter(ImageFilter.UnsharpMask(radius=1, percent=60, threshold=1))
+    pixels = np.asarray(img, dtype=np.float32)
+    pixels = np.clip(pixels * 1.15 - 128 * 0.15, 0, 255)
+
+    mean = float(pixels.mean())
+    if mean > 200:
+        threshold = max(120.0, mean * 0.6)
+    elif mean < 80:
+        threshold = min(140.0, mean * 1.2)
+    else:
+        threshold = max(110.0, min(150.0, mean * 0.9))
+
+    black = pixels < threshold
+    if not black.any():
+        # nenhum pixel preto: a imagem sumiria na etiqueta, tentar threshold mais baixo
+        black = pixels < max(80.0, threshold * 0.7)
+    return black
+
+
+def _dilate(black: np.ndarray, radius: int) -> np.ndarray:
+    """Dilatação morfológica dos pixels pretos com disco de raio `radius`."""
+    height, width = black.shape
+    padded = np.pad(black, radius, mode="constant", constant_values=False)
+    out = np.zeros_like(black)
+    for dy in range(-radius, radius + 1):
+        for dx in range(-radius, radius + 1):
+            if dx * dx + dy * dy > radius * radius:
+                continue
+            out |= padded[radius + dy:radius + dy + height, radius + dx:radius + dx + width]
+    return out
+
+
+def to_monochrome(data: bytes, width: int, height: int, dither: str, dilate: int = 0) -> np.ndarray:
+    """Matriz booleana height x width (True = ponto preto)."""
+    img = _load_grayscale(data, width, height)
+
+    if dither == "threshold":
+        black = _adaptive_threshold(img)
+    elif dither == "floyd":
+        black = ~np.asarray(img.convert("1", dither=Image.Dither.FLOYDSTEINBERG), dtype=bool)
+    elif dither == "ordered":
+        pixels = np.asarray(img, dtype=np.float32)
+        tiled = np.tile(_BAYER_8, (height // 8 + 1, width // 8 + 1))[:height, :width]
+        black = pixels < tiled
+    else:
+        black = np.asarray(img, dtype=np.uint8) < 128
+
+    if dilate > 0:
+        black = _dilate(black, dilate)
+    return black
+
+
+def z64_encode(raw: bytes) -> str:
+    """Compressão Z64 do ZPL: :Z64:<base64(zlib)>:<CRC-16-CCITT do base64>."""
+    encoded = base64.b64encode(zlib.compress(raw, 9))
+    return f":Z64:{encoded.decode('ascii')}:{binascii.crc_hqx(encoded, 0):04X}"
+
+
+def render_graphic(data: bytes, width: int, height: int, dither: str,
+                   dilate: int = 0, z64: bool = False) -> bytes:
+    """
+    Converte a imagem no gráfico 1 bit do ZPL.
+    Retorna b"<total bytes>,<bytes por linha>,<dados>" (dados em hex ou Z64),
+    que vira ^GFA,... ou ~DG,... em format_graphic.
+    Função de módulo (sem estado) para poder rodar em ProcessPoolExecutor.
+    """
+    black = to_monochrome(data, width, height, dither, dilate)
+    # cada linha é completada com zeros (branco) até múltiplo de 8
+    packed = np.packbits(black, axis=1)
+    bytes_per_row = packed.shape[1]
+    total_bytes = packed.size
+    raw = packed.tobytes()
+    payload = z64_encode(raw) if z64 else raw.hex().upper()
+    return f"{total_bytes},{bytes_per_row},{payload}".encode("ascii")
+
+
+def format_graphic(graphic: bytes, output: str, name: str = "IMAGE") -> str:
+    """Monta o comando final: "gf" → ^GFA,...^FS (campo inline); "dg" → ~DGR:<name>.GRF,... (download)."""
+    total_bytes, bytes_per_row, payload = graphic.decode("ascii").split(",", 2)
+    if output == "dg":
+        return f"~DGR:{name}.GRF,{total_bytes},{bytes_per_row},{payload}"
+    return f"^GFA,{total_bytes},{total_bytes},{bytes_per_row},{payload}^FS"
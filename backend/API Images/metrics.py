@@ -0,0 +1,250 @@
+import bisect
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# buckets padrão de latência (segundos): de cache em memória até download lento do GitHub
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# (labels, valor) de uma amostra
+Sample = Tuple[Dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric(ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: labels esperados {self.labelnames}, recebidos {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+    @abstractmethod
+    def samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        """(sufixo do nome, labels, valor) de cada série."""
+
+
+class Counter(_Metric):
+    """Contador monotônico por combinação de labels."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [("", self._labels(key), value) for key, value in items]
+
+
+class Gauge(_Metric):
+    """Valor que sobe e desce (requisições em andamento, tamanho do índice...)."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels: str) -> Iterator[None]:
+        """Incrementa durante o bloco."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [("", self._labels(key), value) for key, value in items]
+
+
+class Histogram(_Metric):
+    """Histograma com buckets cumulativos (_bucket, _sum, _count)."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> (contagem por bucket (não cumulativa, último = +Inf), soma)
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Mede a duração do bloco (também quando ele levanta exceção)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        out = []
+        for key, (counts, total) in items:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                out.append(("_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+            out.append(("_sum", labels, total))
+            out.append(("_count", labels, cumulative))
+        return out
+
+
+class _Collected(_Metric):
+    """Métrica lida na hora do scrape a partir de uma função (ex.: stats() dos caches)."""
+
+    def __init__(self, name: str, documentation: str, kind: str, collect: Callable[[], Iterable[Sample]]):
+        super().__init__(name, documentation)
+        self.kind = kind
+        self._collect = collect
+
+    def samples(self):
+        return [("", labels, value) for labels, value in self._collect()]
+
+
+class Registry:
+    """Conjunto de métricas expostas em /metrics (formato texto do Prometheus)."""
+
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+        self._metrics: List[_Metric] = []
+
+    def _add(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(self.prefix + name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(self.prefix + name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Optional[Sequence[float]] = None) -> Histogram:
+        return self._add(Histogram(self.prefix + name, documentation, labelnames, buckets or DEFAULT_BUCKETS))
+
+    def collected(self, name: str, documentation: str, kind: str, collect: Callable[[], Iterable[Sample]]) -> None:
+        """Registra uma métrica calculada no scrape (`kind`: counter ou gauge)."""
+        self._add(_Collected(self.prefix + name, documentation, kind, collect))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI: contagem, latência (até o último byte) e bytes servidos
+    por rota e status, e requisições em andamento.
+    A rota é o template do FastAPI ("/image/reference/{reference}"), não o path,
+    para não criar uma série por referência.
+    """
+
+    def __init__(self, app, requests: Counter, latency: Histogram, sent_bytes: Counter, in_flight: Gauge):
+        self.app = app
+        self.requests = requests
+        self.latency = latency
+        self.sent_bytes = sent_bytes
+        self.in_flight = in_flight
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = {"code": 500}
+        sent = {"bytes": 0}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            elif message["type"] == "http.response.body":
+                sent["bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        self.in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.in_flight.dec()
+            route = scope.get("route")
+            labels = {
+                "route": getattr(route, "path", "unmatched"),
+                "method": scope["method"],
+                "status": str(status["code"]),
+            }
+            self.requests.inc(**labels)
+            self.latency.observe(time.perf_counter() - start, **labels)
+            self.sent_bytes.inc(sent["bytes"], route=labels["route"])
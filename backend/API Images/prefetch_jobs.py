@@ -0,0 +1,170 @@
+import asyncio
+import itertools
+import json
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# resultados possíveis de cada referência de um prefetch
+PREFETCH_RESULTS = ("fetched", "cached", "missing", "invalid", "failed")
+# erros guardados por job (o resto só entra na contagem)
+_MAX_ERRORS = 50
+# intervalo mínimo entre gravações do progresso no state_dir (segundos)
+_PUBLISH_INTERVAL = 1.0
+# estado de jobs no state_dir é apagado depois disso (segundos)
+_STATE_MAX_AGE = 24 * 3600
+
+
+@dataclass
+class PrefetchJob:
+    """Progresso de um aquecimento de cache (referências já processadas por resultado)."""
+
+    id: str
+    total: int
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    counts: Dict[str, int] = field(default_factory=lambda: dict.fromkeys(PREFETCH_RESULTS, 0))
+    bytes_fetched: int = 0
+    errors: List[Dict] = field(default_factory=list)
+    task: Optional["asyncio.Task"] = None
+    cancelled: bool = False
+    published_at: float = 0.0
+
+    @property
+    def done(self) -> int:
+        return sum(self.counts.values())
+
+    @property
+    def state(self) -> str:
+        if self.finished_at is None:
+            return "running"
+        if self.cancelled:
+            return "cancelled"
+        return "done"
+
+    def record(self, result: str, reference: str, size: int = 0, detail: Optional[str] = None) -> None:
+        self.counts[result] += 1
+        self.bytes_fetched += size
+        if detail is not None and len(self.errors) < _MAX_ERRORS:
+            self.errors.append({"reference": reference, "result": result, "detail": detail})
+
+    def snapshot(self) -> Dict:
+        end = self.finished_at or time.time()
+        return {
+            "id": self.id,
+            "state": self.state,
+            "total": self.total,
+            "done": self.done,
+            "progress": round(self.done / self.total, 4) if self.total else 1.0,
+            **self.counts,
+            "bytes_fetched": self.bytes_fetched,
+            "elapsed": round(end - self.created_at, 3),
+            "errors": list(self.errors),
+        }
+
+
+class PrefetchJobs:
+    """
+    Jobs de prefetch do processo; guarda os `keep` mais recentes já terminados.
+    Com state_dir (vários workers) o progresso é gravado em <state_dir>/<id>.json,
+    então qualquer worker responde o status, e o cancelamento vira o arquivo
+    <id>.cancel, visto pelo worker que roda o job.
+    """
+
+    def __init__(self, keep: int = 20, state_dir: Optional[Path] = None):
+        self.keep = keep
+        self.state_dir = Path(state_dir) if state_dir is not None else None
+        self._jobs: "OrderedDict[str, PrefetchJob]" = OrderedDict()
+        self._ids = itertools.count(1)
+        if self.state_dir is not None:
+            self.state_dir.mkdir(parents=True, exist_ok=True)
+
+    def create(self, total: int) -> PrefetchJob:
+        job = PrefetchJob(id=f"{int(time.time())}-{os.getpid()}-{next(self._ids)}", total=total)
+        self._jobs[job.id] = job
+        self._trim()
+        return job
+
+    def get(self, job_id: str) -> Optional[PrefetchJob]:
+        return self._jobs.get(job_id)
+
+    def snapshot(self, job_id: str) -> Optional[Dict]:
+        """Progresso do job, deste worker ou (com state_dir) de qualquer outro."""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.snapshot()
+        path = self._state_path(job_id, ".json")
+        if path is None:
+            return None
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def snapshots(self) -> List[Dict]:
+        """Jobs deste worker e, com state_dir, os gravados pelos outros."""
+        found = {job.id: job.snapshot() for job in self._jobs.values()}
+        if self.state_dir is not None:
+            for path in sorted(self.state_dir.glob("*.json")):
+                if path.stem not in found:
+                    snapshot = self.snapshot(path.stem)
+                    if snapshot is not None:
+                        found[path.stem] = snapshot
+        return sorted(found.values(), key=lambda snapshot: snapshot["id"])
+
+    def publish(self, job: PrefetchJob, force: bool = False) -> None:
+        """Grava o progresso no state_dir (no máximo a cada _PUBLISH_INTERVAL, ou sempre com force)."""
+        if self.state_dir is None:
+            return
+        now = time.time()
+        if not force and now - job.published_at < _PUBLISH_INTERVAL:
+            return
+        job.published_at = now
+        data = json.dumps(job.snapshot(), ensure_ascii=False)
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.state_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, self._state_path(job.id, ".json"))
+        except OSError:
+            # progresso em disco é só para os outros workers; o job continua
+            pass
+
+    def request_cancel(self, job_id: str) -> bool:
+        """Pede o cancelamento de um job de outro worker. False se o job não existe."""
+        path = self._state_path(job_id, ".cancel")
+        if path is None or not self._state_path(job_id, ".json").exists():
+            return False
+        path.touch()
+        return True
+
+    def cancel_requested(self, job: PrefetchJob) -> bool:
+        path = self._state_path(job.id, ".cancel")
+        return path is not None and path.exists()
+
+    def _state_path(self, job_id: str, suffix: str) -> Optional[Path]:
+        # ids vêm da URL: só o formato gerado em create()
+        if self.state_dir is None or not job_id.replace("-", "").isdigit():
+            return None
+        return self.state_dir / (job_id + suffix)
+
+    def running(self) -> List[PrefetchJob]:
+        return [job for job in self._jobs.values() if job.finished_at is None]
+
+    def _trim(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished_at is not None]
+        for job_id in finished[:max(0, len(finished) - self.keep)]:
+            del self._jobs[job_id]
+        if self.state_dir is None:
+            return
+        cutoff = time.time() - _STATE_MAX_AGE
+        for path in self.state_dir.iterdir():
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except OSError:
+                pass
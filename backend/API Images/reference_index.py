@@ -0,0 +1,244 @@
+import gzip
+import json
+import logging
+import os
+import re
+import tempfile
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger("image_proxy.index")
+
+# versão do formato do snapshot em disco (mudar ao alterar a estrutura)
+SNAPSHOT_VERSION = 3
+
+REF_REGEX = re.compile(r"(\d{3})-(\d{4})")  # 100-0001
+_PARENTHESES = re.compile(r"\(([^)]*)\)")
+
+# ordem de preferência das extensões entre arquivos da mesma referência
+_EXTENSION_RANK = {"jpg": 0, "jpeg": 0, "png": 1}
+
+
+def extract_reference_from_name(name: str) -> Optional[str]:
+    """
+    "100-0001 CANDY.jpeg" -> "1000001"
+    """
+    m = REF_REGEX.search(name)
+    if not m:
+        return None
+    return m.group(1) + m.group(2)
+
+
+@dataclass(frozen=True)
+class ImageCandidate:
+    """
+    Atributos tirados do nome do arquivo.
+    "images/119-0046 SKYE POLKA DOTS (lado) CANCELADO.jpeg" ->
+    reference="1190046", style="SKYE POLKA DOTS", detail="lado", cancelled=True, extension="jpeg"
+    """
+
+    path: str
+    reference: str
+    style: str
+    detail: str
+    cancelled: bool
+    extension: str
+
+    def rank_key(self) -> Tuple:
+        """
+        Ordem entre arquivos da mesma referência (o primeiro é o servido por padrão):
+        não cancelado → JPEG antes de PNG antes do resto → menos qualificadores
+        no nome ("SKYE" antes de "SKYE FUR") → path.
+        """
+        qualifiers = max(0, len(self.style.split()) - 1) + (1 if self.detail else 0)
+        return (self.cancelled, _EXTENSION_RANK.get(self.extension, 2), qualifiers, self.path)
+
+
+def parse_image_name(path: str) -> Optional[ImageCandidate]:
+    """Interpreta o nome do arquivo (None se não tiver referência XXX-XXXX)."""
+    name = path.split("/")[-1]
+    stem, dot, extension = name.rpartition(".")
+    if not dot:
+        stem, extension = name, ""
+    m = REF_REGEX.search(stem)
+    if not m:
+        return None
+
+    rest = stem[m.end():]
+    detail = "; ".join(part.strip() for part in _PARENTHESES.findall(rest) if part.strip())
+    words = _PARENTHESES.sub(" ", rest).strip(" -_.").split()
+    cancelled = any(word.upper() == "CANCELADO" for word in words)
+    style = " ".join(word for word in words if word.upper() != "CANCELADO").upper()
+    return ImageCandidate(
+        path=path,
+        reference=m.group(1) + m.group(2),
+        style=style,
+        detail=detail,
+        cancelled=cancelled,
+        extension=extension.lower(),
+    )
+
+
+@dataclass(frozen=True)
+class ReferenceIndex:
+    """
+    Fotografia imutável do índice de imagens (reference -> paths -> blob SHA).
+    Nunca é alterada depois de publicada: uma atualização monta um índice novo
+    ao lado e troca a referência global de uma vez, então quem está lendo
+    nunca vê um mapa vazio ou pela metade.
+    Os mapas por referência e os arrays de busca são derivados de path_to_sha
+    no __post_init__ (também em dataclasses.replace).
+    """
+
+    path_to_sha: Dict[str, str] = field(default_factory=dict)
+    # path -> tamanho do blob em bytes (HEAD respondido sem ir à origem)
+    path_to_size: Dict[str, int] = field(default_factory=dict)
+    # commit e tree de images/ indexados (para atualização incremental)
+    commit_sha: Optional[str] = None
+    images_tree_sha: Optional[str] = None
+    # ETag do ref da branch (GET condicional)
+    ref_etag: Optional[str] = None
+    # data do commit indexado, em formato HTTP (usado no Last-Modified)
+    last_modified: Optional[str] = None
+    # time.time() de quando o índice foi montado
+    built_at: float = 0.0
+    # origem de onde o índice foi de fato montado (ImageStorage.source)
+    source: Optional[str] = None
+
+    # derivados: path -> atributos do nome
+    candidates: Dict[str, ImageCandidate] = field(init=False, repr=False, compare=False)
+    # reference -> paths ordenados por ImageCandidate.rank_key (todos os arquivos da referência)
+    ref_to_paths: Dict[str, Tuple[str, ...]] = field(init=False, repr=False, compare=False)
+    # reference -> path preferido (primeiro de ref_to_paths)
+    ref_to_path: Dict[str, str] = field(init=False, repr=False, compare=False)
+    # arrays ordenados para busca por prefixo com bisect
+    sorted_refs: Tuple[str, ...] = field(init=False, repr=False, compare=False)
+    sorted_styles: Tuple[Tuple[str, str], ...] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        candidates: Dict[str, ImageCandidate] = {}
+        grouped: Dict[str, List[ImageCandidate]] = {}
+        for path in self.path_to_sha:
+            candidate = parse_image_name(path)
+            if candidate is None:
+                continue
+            candidates[path] = candidate
+            grouped.setdefault(candidate.reference, []).append(candidate)
+
+        ref_to_paths = {
+            ref: tuple(c.path for c in sorted(group, key=ImageCandidate.rank_key))
+            for ref, group in grouped.items()
+        }
+        object.__setattr__(self, "candidates", candidates)
+        object.__setattr__(self, "ref_to_paths", ref_to_paths)
+        object.__setattr__(self, "ref_to_path", {ref: paths[0] for ref, paths in ref_to_paths.items()})
+        object.__setattr__(self, "sorted_refs", tuple(sorted(ref_to_paths)))
+        object.__setattr__(self, "sorted_styles", tuple(sorted(
+            (c.style, c.path) for c in candidates.values() if c.style
+        )))
+
+    @property
+    def loaded(self) -> bool:
+        return self.commit_sha is not None
+
+    def duplicates(self) -> Dict[str, Tuple[str, ...]]:
+        """Referências com mais de um arquivo."""
+        return {ref: paths for ref, paths in self.ref_to_paths.items() if len(paths) > 1}
+
+    def search(self, query: str, limit: int = 20) -> List[ImageCandidate]:
+        """
+        Busca por prefixo em O(log n + limit):
+        → só dígitos (aceita "100-00", "100.00"): prefixo da referência, arquivo preferido de cada uma
+        → texto: prefixo do nome do estilo ("KATE", "SKYE PO"), todos os arquivos que casam
+        """
+        query = query.strip()
+        digits = query.replace(".", "").replace("-", "")
+        results: List[ImageCandidate] = []
+        if digits.isdigit():
+            i = bisect_left(self.sorted_refs, digits)
+            while i < len(self.sorted_refs) and len(results) < limit:
+                ref = self.sorted_refs[i]
+                if not ref.startswith(digits):
+                    break
+                results.append(self.candidates[self.ref_to_path[ref]])
+                i += 1
+            return results
+
+        prefix = " ".join(query.upper().split())
+        if not prefix:
+            return results
+        i = bisect_left(self.sorted_styles, (prefix, ""))
+        while i < len(self.sorted_styles) and len(results) < limit:
+            style, path = self.sorted_styles[i]
+            if not style.startswith(prefix):
+                break
+            results.append(self.candidates[path])
+            i += 1
+        return results
+
+
+def save_snapshot(index: ReferenceIndex, snapshot_path: Path) -> None:
+    """
+    Grava o índice em disco (JSON gzip, escrita atômica).
+    Só (path, blob SHA, tamanho): as referências são derivadas de novo ao carregar.
+    index.source identifica a origem para não carregar snapshot de outro repo/branch.
+    """
+    payload = {
+        "version": SNAPSHOT_VERSION,
+        "source": index.source,
+        "commit_sha": index.commit_sha,
+        "images_tree_sha": index.images_tree_sha,
+        "ref_etag": index.ref_etag,
+        "last_modified": index.last_modified,
+        "built_at": index.built_at,
+        "files": [[path, sha, index.path_to_size.get(path)] for path, sha in index.path_to_sha.items()],
+    }
+    data = gzip.compress(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+
+    snapshot_path = Path(snapshot_path)
+    snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=snapshot_path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, snapshot_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def load_snapshot(snapshot_path: Path, sources: Iterable[str]) -> Optional[ReferenceIndex]:
+    """
+    Lê o snapshot gravado por save_snapshot
+    (None se não existir, for inválido ou de uma origem fora de `sources`).
+    """
+    try:
+        with open(snapshot_path, "rb") as f:
+            payload = json.loads(gzip.decompress(f.read()).decode("utf-8"))
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning("Snapshot do indice ilegivel (%s): %s", snapshot_path, e)
+        return None
+
+    if payload.get("version") != SNAPSHOT_VERSION or payload.get("source") not in sources:
+        logger.info("Snapshot do indice ignorado (versao/origem diferente): %s", snapshot_path)
+        return None
+
+    return ReferenceIndex(
+        path_to_sha={path: sha for path, sha, _ in payload["files"]},
+        path_to_size={path: size for path, _, size in payload["files"] if size is not None},
+        commit_sha=payload["commit_sha"],
+        images_tree_sha=payload["images_tree_sha"],
+        ref_etag=payload["ref_etag"],
+        last_modified=payload["last_modified"],
+        built_at=payload["built_at"],
+        source=payload["source"],
+    )
@@ -0,0 +1,53 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Coalescência de requisições: para cada chave existe no máximo uma
+    execução em andamento; quem chega depois aguarda o mesmo resultado
+    (ou o mesmo erro) em vez de repetir o trabalho.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, "asyncio.Task"] = {}
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        self.calls += 1
+        task = self._inflight.get(key)
+        if task is None:
+            self.executions += 1
+            # roda em uma task própria: se o primeiro cliente desconectar,
+            # os demais continuam recebendo o resultado
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, key=key: self._finish(key, t))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def pending(self, key: str) -> bool:
+        """Existe execução em andamento para a chave?"""
+        return key in self._inflight
+
+    def _finish(self, key: str, task: "asyncio.Task") -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # consome a exceção para não gerar "exception was never retrieved"
+        if not task.cancelled() and task.exception() is not None:
+            self.errors += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "calls": self.calls,
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "in_flight": len(self._inflight),
+        }
@@ -0,0 +1,200 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Optional
+
+REQUEST_ID_HEADER = "X-Request-ID"
+# Cloud Run: "TRACE_ID/SPAN_ID;o=1" (usado quando o chamador não manda X-Request-ID)
+_TRACE_HEADER = "x-cloud-trace-context"
+
+_REQUEST_ID: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+# a requisição atual foi sorteada para registrar os logs de sucesso? (None = fora de requisição)
+_SAMPLED: ContextVar[Optional[bool]] = ContextVar("log_sampled", default=None)
+
+# atributos padrão do LogRecord (o resto veio de extra= e vira campo do JSON)
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def current_request_id() -> Optional[str]:
+    return _REQUEST_ID.get()
+
+
+class JsonFormatter(logging.Formatter):
+    """Uma linha JSON por registro, com os campos que o Cloud Logging entende (severity, message)."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "severity": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key != "sampled":
+                payload[key] = value
+        if record.exc_info:
+            payload["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload["exception"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Formato legível para desenvolvimento local (LOG_FORMAT=text)."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s [%(name)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        request_id = getattr(record, "request_id", None)
+        return f"{line} (request_id={request_id})" if request_id else line
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    Roda na thread de quem loga (antes da fila):
+    → anexa o request_id da requisição atual
+    → descarta logs de sucesso (extra={"sampled": True}) fora da amostra
+    """
+
+    def __init__(self, sample_rate: float):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "sampled", False) and record.levelno < logging.WARNING:
+            sampled = _SAMPLED.get()
+            if sampled is None:
+                sampled = random.random() < self.sample_rate
+            if not sampled:
+                return False
+        request_id = _REQUEST_ID.get()
+        if request_id is not None and not hasattr(record, "request_id"):
+            record.request_id = request_id
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler com fila limitada: quem loga nunca espera o stdout;
+    com a fila cheia o registro é descartado (e contado) em vez de bloquear.
+    """
+
+    def __init__(self, log_queue: "queue.Queue"):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # mensagem e traceback resolvidos aqui; a formatação (JSON) fica com a thread do listener
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(name: str, level: str = "INFO", fmt: str = "json",
+                  sample_rate: float = 1.0, queue_size: int = 10000) -> DroppingQueueHandler:
+    """
+    Configura o logger `name` (e os filhos, ex.: name + ".cache"):
+    fila limitada -> thread do QueueListener -> stdout em JSON (ou texto).
+    Retorna o handler da fila (contagem de descartados).
+    """
+    log_queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+    handler = DroppingQueueHandler(log_queue)
+    handler.addFilter(RequestContextFilter(sample_rate))
+
+    # stdout: o starter repassa o stdout do uvicorn e o Cloud Run coleta as linhas JSON
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(TextFormatter() if fmt == "text" else JsonFormatter())
+    listener = logging.handlers.QueueListener(log_queue, stream)
+    listener.start()
+    atexit.register(listener.stop)
+
+    logger = logging.getLogger(name)
+    logger.setLevel(level.upper())
+    logger.handlers = [handler]
+    logger.propagate = False
+    return handler
+
+
+def _request_id_from(scope) -> str:
+    headers = dict(scope.get("headers") or ())
+    request_id = headers.get(REQUEST_ID_HEADER.lower().encode())
+    if request_id:
+        return request_id.decode("latin-1")[:128]
+    trace = headers.get(_TRACE_HEADER.encode())
+    if trace:
+        return trace.decode("latin-1").split("/", 1)[0][:128]
+    return uuid.uuid4().hex
+
+
+class RequestLogMiddleware:
+    """
+    Middleware ASGI:
+    → request_id do chamador (X-Request-ID, ou o trace do Cloud Run) ou gerado; devolvido no header
+    → sorteia a requisição para os logs de sucesso (sample_rate)
+    → uma linha de acesso por requisição: 5xx e lentas sempre, o resto só na amostra
+    """
+
+    def __init__(self, app, logger: logging.Logger, sample_rate: float, slow_seconds: float):
+        self.app = app
+        self.logger = logger
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = _request_id_from(scope)
+        id_token = _REQUEST_ID.set(request_id)
+        sampled_token = _SAMPLED.set(random.random() < self.sample_rate)
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message["headers"] = list(message.get("headers") or []) + [
+                    (REQUEST_ID_HEADER.lower().encode(), request_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            fields = {
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status["code"],
+                "duration_ms": round(duration * 1000, 1),
+            }
+            if status["code"] >= 500:
+                self.logger.error("request", extra=fields)
+            elif duration >= self.slow_seconds:
+                self.logger.warning("request lenta", extra=fields)
+            else:
+                self.logger.info("request", extra={**fields, "sampled": True})
+            _SAMPLED.reset(sampled_token)
+            _REQUEST_ID.reset(id_token)
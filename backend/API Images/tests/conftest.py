@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# image_proxy lê a configuração do ambiente ao ser importado
+os.environ.setdefault("GITHUB_TOKEN", "test-token-0123456789")
+os.environ["IMAGE_STORAGE"] = "github"
+os.environ["IMAGE_CACHE_DIR"] = tempfile.mkdtemp(prefix="image-proxy-test-")
+os.environ["LOG_FORMAT"] = "text"
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,61 @@
+import asyncio
+from urllib.parse import unquote
+
+import httpx
+
+import image_proxy
+from image_storage import git_blob_sha
+
+IMAGE_PATH = "images/100-0001 CANDY.jpeg"
+IMAGE_BYTES = b"\xff\xd8\xff\xe0" + bytes(range(256)) * 64
+
+
+class FakeGitHub:
+    """GitHub simulado: índice com uma imagem e download raw com latência."""
+
+    def __init__(self, raw_delay: float):
+        self.raw_delay = raw_delay
+        self.raw_downloads = 0
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        url = str(request.url)
+        if "/git/ref/" in url:
+            return httpx.Response(200, json={"object": {"sha": "c1"}}, headers={"ETag": '"c1"'})
+        if "/git/commits/" in url:
+            return httpx.Response(200, json={"tree": {"sha": "root"}, "committer": {"date": "2025-11-26T10:00:00Z"}})
+        if "/git/trees/root" in url:
+            return httpx.Response(200, json={"tree": [{"type": "tree", "path": "images", "sha": "images-tree"}]})
+        if "/git/trees/" in url:
+            return httpx.Response(200, json={"tree": [{
+                "type": "blob",
+                "path": IMAGE_PATH[len("images/"):],
+                "sha": git_blob_sha(IMAGE_BYTES),
+                "size": len(IMAGE_BYTES),
+            }]})
+        assert unquote(request.url.path).endswith(IMAGE_PATH)
+        self.raw_downloads += 1
+        await asyncio.sleep(self.raw_delay)
+        return httpx.Response(200, content=IMAGE_BYTES, headers={"Content-Type": "image/jpeg"})
+
+
+def test_concurrent_cold_requests_share_one_download():
+    """Requisições simultâneas do mesmo path sem cache: um único download da origem."""
+    github = FakeGitHub(raw_delay=0.3)
+
+    async def scenario():
+        image_proxy.HTTP_CLIENT = httpx.AsyncClient(transport=httpx.MockTransport(github))
+        await image_proxy.refresh_index()
+        transport = httpx.ASGITransport(app=image_proxy.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://proxy") as client:
+            responses = await asyncio.gather(
+                *(client.get("/image/reference/1000001") for _ in range(10))
+            )
+        await image_proxy.HTTP_CLIENT.aclose()
+        return responses
+
+    responses = asyncio.run(scenario())
+
+    assert [r.status_code for r in responses] == [200] * 10
+    assert all(r.content == IMAGE_BYTES for r in responses)
+    assert github.raw_downloads == 1
+    assert not image_proxy.IMAGE_STREAMS
@@ -0,0 +1,232 @@
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import httpx
+
+# prioridades (menor = atendida primeiro)
+INTERACTIVE = 0
+PREFETCH = 1
+
+_PRIORITY: ContextVar[int] = ContextVar("upstream_priority", default=INTERACTIVE)
+
+# status que valem nova tentativa (rate limit e falhas temporárias da origem)
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+@contextmanager
+def upstream_priority(level: int) -> Iterator[None]:
+    """Requisições à origem feitas dentro do bloco usam a prioridade `level` (ex.: PREFETCH)."""
+    token = _PRIORITY.set(level)
+    try:
+        yield
+    finally:
+        _PRIORITY.reset(token)
+
+
+def current_priority() -> int:
+    return _PRIORITY.get()
+
+
+class PrioritySemaphore:
+    """Semáforo em que as vagas liberadas vão primeiro para a menor prioridade (FIFO dentro dela)."""
+
+    def __init__(self, value: int):
+        self._value = value
+        self._waiters: List[Tuple[int, int, "asyncio.Future"]] = []
+        self._counter = itertools.count()
+
+    async def acquire(self, priority: int = INTERACTIVE) -> None:
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # a vaga chegou junto com o cancelamento: devolver
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                future.cancel()
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._value += 1
+
+    @asynccontextmanager
+    async def slot(self, priority: int = INTERACTIVE):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+
+@dataclass
+class HostBudget:
+    """Orçamento de rate limit conhecido de um host (headers X-RateLimit-* e Retry-After)."""
+
+    limit: Optional[int] = None
+    remaining: Optional[int] = None
+    # epoch em que o limite renova (X-RateLimit-Reset)
+    reset_at: float = 0.0
+    # epoch até quando não enviar nada (Retry-After / limite esgotado)
+    blocked_until: float = 0.0
+    throttled: int = 0
+
+
+def _header_number(headers: httpx.Headers, name: str) -> Optional[float]:
+    value = headers.get(name)
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def is_rate_limited(resp: httpx.Response) -> bool:
+    """429, ou 403 do GitHub com o limite esgotado (X-RateLimit-Remaining: 0)."""
+    if resp.status_code == 429:
+        return True
+    return resp.status_code == 403 and resp.headers.get("X-RateLimit-Remaining") == "0"
+
+
+class RateLimitScheduler:
+    """
+    Controla quando uma requisição à origem pode sair:
+    → acompanha X-RateLimit-Remaining/Reset de cada resposta (por host)
+    → com o orçamento baixo (<= reserve), prefetch espera o reset; interativas
+      seguem até zerar e só então esperam (no máximo max_wait segundos)
+    → 429 / 403 de rate limit bloqueiam o host pelo Retry-After (ou até o reset)
+    → novas tentativas com backoff exponencial com jitter, respeitando Retry-After
+    """
+
+    def __init__(self, reserve: int, max_wait: float, prefetch_max_wait: float,
+                 max_retries: int, backoff_base: float, backoff_max: float):
+        self.reserve = reserve
+        self.max_wait = max_wait
+        self.prefetch_max_wait = prefetch_max_wait
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._budgets: Dict[str, HostBudget] = {}
+
+    def budget(self, host: str) -> HostBudget:
+        budget = self._budgets.get(host)
+        if budget is None:
+            budget = self._budgets[host] = HostBudget()
+        return budget
+
+    def _max_wait_for(self, priority: int) -> float:
+        return self.prefetch_max_wait if priority >= PREFETCH else self.max_wait
+
+    def delay_for(self, host: str, priority: int) -> float:
+        """Segundos que uma requisição com essa prioridade ainda precisa esperar (0 = pode sair)."""
+        budget = self.budget(host)
+        now = time.time()
+        wait = max(0.0, budget.blocked_until - now)
+        if budget.remaining is not None and budget.reset_at > now:
+            floor = self.reserve if priority >= PREFETCH else 0
+            if budget.remaining <= floor:
+                wait = max(wait, budget.reset_at - now)
+        return wait
+
+    async def wait_turn(self, host: str, priority: int) -> Optional[float]:
+        """
+        Espera o orçamento permitir a requisição e a contabiliza.
+        Retorna None quando pode sair, ou os segundos restantes se a espera
+        passaria do máximo da prioridade (a origem está limitada).
+        """
+        while True:
+            wait = self.delay_for(host, priority)
+            if wait <= 0:
+                break
+            if wait > self._max_wait_for(priority):
+                self.budget(host).throttled += 1
+                return wait
+            # pequeno jitter para não acordar todo mundo no mesmo instante
+            await asyncio.sleep(wait + random.uniform(0, 0.25))
+
+        budget = self.budget(host)
+        if budget.remaining is not None and budget.remaining > 0:
+            budget.remaining -= 1
+        return None
+
+    def observe(self, host: str, resp: httpx.Response) -> None:
+        """Atualiza o orçamento do host com os headers da resposta."""
+        budget = self.budget(host)
+        headers = resp.headers
+        remaining = _header_number(headers, "X-RateLimit-Remaining")
+        if remaining is not None:
+            budget.remaining = int(remaining)
+            limit = _header_number(headers, "X-RateLimit-Limit")
+            budget.limit = int(limit) if limit is not None else budget.limit
+            reset = _header_number(headers, "X-RateLimit-Reset")
+            budget.reset_at = reset if reset is not None else budget.reset_at
+
+        if is_rate_limited(resp):
+            retry_after = _header_number(headers, "Retry-After")
+            if retry_after is not None:
+                until = time.time() + retry_after
+            elif budget.reset_at > time.time():
+                until = budget.reset_at
+            else:
+                until = time.time() + self.backoff_base
+            budget.blocked_until = max(budget.blocked_until, until)
+
+    def retry_delay(self, resp: httpx.Response, attempt: int, priority: int) -> Optional[float]:
+        """
+        Espera antes de repetir a requisição (None = não repetir).
+        Retry-After quando a origem informa; senão backoff exponencial com jitter.
+        """
+        if resp.status_code not in RETRY_STATUSES and not is_rate_limited(resp):
+            return None
+        if attempt >= self.max_retries:
+            return None
+
+        retry_after = _header_number(resp.headers, "Retry-After")
+        if retry_after is not None:
+            delay = retry_after + random.uniform(0, self.backoff_base)
+        else:
+            delay = random.uniform(0.5, 1.0) * min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        if delay > self._max_wait_for(priority):
+            return None
+        return delay
+
+    def stats(self) -> Dict[str, Dict]:
+        now = time.time()
+        return {
+            host: {
+                "limit": budget.limit,
+                "remaining": budget.remaining,
+                "reset_in": round(max(0.0, budget.reset_at - now), 1) if budget.reset_at else None,
+                "blocked_for": round(max(0.0, budget.blocked_until - now), 1),
+                "throttled": budget.throttled,
+            }
+            for host, budget in self._budgets.items()
+        }
+
+
+def throttled_response(method: str, url: str, wait: float) -> httpx.Response:
+    """Resposta 429 local (sem ir à origem) quando o orçamento do host está esgotado."""
+    return httpx.Response(
+        429,
+        headers={"Retry-After": str(int(wait) + 1)},
+        request=httpx.Request(method, url),
+    )
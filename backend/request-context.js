@@ -0,0 +1,31 @@
+const { AsyncLocalStorage } = require('async_hooks');
+const { randomUUID } = require('crypto');
+
+// Contexto da requisição atual (ID repassado à API Python de imagens)
+const requestContext = new AsyncLocalStorage();
+
+/**
+ * Middleware Express: usa o X-Request-ID recebido ou gera um novo e deixa o ID
+ * disponível para todo o processamento da requisição (inclusive os jobs de impressão)
+ */
+function requestIdMiddleware(req, res, next) {
+  const requestId = req.get('X-Request-ID') || randomUUID();
+  res.set('X-Request-ID', requestId);
+  requestContext.run({ requestId }, next);
+}
+
+/**
+ * Headers para chamadas à API Python de imagens com o X-Request-ID da requisição atual
+ * (ou um novo, fora de uma requisição), para correlacionar os logs das duas pontas
+ * @param {Object} headers - Headers adicionais
+ * @returns {Object} - Headers com X-Request-ID
+ */
+function imageProxyHeaders(headers = {}) {
+  const store = requestContext.getStore();
+  return { ...headers, 'X-Request-ID': store ? store.requestId : randomUUID() };
+}
+
+module.exports = {
+  requestIdMiddleware,
+  imageProxyHeaders
+};
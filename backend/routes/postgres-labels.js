@@ -1,4 +1,5 @@
 const axios = require('axios');
+const { imageProxyHeaders } = require('../request-context');
 
 // Cache da porta detectada da API Python
 let detectedImageProxyPort = null;
@@ -50,7 +51,7 @@ async function detectImageProxyPort() {
   for (const port of portsToTry) {
     try {
       const testUrl = `http://127.0.0.1:${port}/status`;
-      const response = await axios.get(testUrl, { timeout: 2000 }); // Timeout aumentado para 2s
+      const response = await axios.get(testUrl, { timeout: 2000, headers: imageProxyHeaders() }); // Timeout aumentado para 2s
       if (response.status === 200) {
         console.log(`[IMAGE-PROXY] 🔍 Porta detectada automaticamente: ${port}`);
         detectedImageProxyPort = port;
@@ -42,6 +42,9 @@ console.log('[INIT] axios carregado');
 const { Label } = require('node-zpl');
 console.log('[INIT] node-zpl carregado');
 
+// X-Request-ID por requisição, repassado à API Python de imagens
+const { requestIdMiddleware, imageProxyHeaders } = require('./request-context');
+
 // Image Proxy Starter (opcional - inicia API Python automaticamente)
 let imageProxyStarter;
 try {
@@ -557,9 +560,12 @@ app.use(cors({
   origin: true, // Permite qualquer origem (ajuste para produção)
   credentials: true,
   methods: ['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'],
-  allowedHeaders: ['Content-Type', 'Authorization']
+  allowedHeaders: ['Content-Type', 'Authorization', 'X-Request-ID']
 }));
 
+// ID da requisição (recebido ou gerado), enviado em toda chamada à API Python feita durante ela
+app.use(requestIdMiddleware);
+
 // Middleware para parsing JSON
 const maxUploadSize = process.env.MAX_UPLOAD_SIZE || '50mb';
 app.use(express.json({ limit: maxUploadSize }));
@@ -1801,7 +1807,8 @@ async function convertImageToZPL(imageUrl, width = 160, height = 160) {
           timeout,
           maxRedirects: 5,
           headers: {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+            ...(isPythonAPI ? imageProxyHeaders() : {})
           }
         });
         imageBuffer = Buffer.from(response.data);
@@ -7905,7 +7912,7 @@ function startServer() {
       
       while (attempts < maxAttempts && !apiReady) {
         try {
-          const response = await axios.get(`${imageProxyUrl}/status`, { timeout: 1000 });
+          const response = await axios.get(`${imageProxyUrl}/status`, { timeout: 1000, headers: imageProxyHeaders() });
           if (response.status === 200) {
             console.log(`[STARTUP] ✅ API Python Image Proxy está pronta em ${imageProxyUrl}!`);
             apiReady = true;
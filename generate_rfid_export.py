@@ -7,9 +7,17 @@ Gera CSV com EPC ID e Asset ID para importação no 123RFID
 import os
 import sys
 import csv
+import itertools
 import re
+from array import array
+from collections import namedtuple
+from contextlib import ExitStack
+from dataclasses import dataclass, replace
+from operator import itemgetter
 from datetime import datetime
+from typing import Optional, Tuple
 from dotenv import load_dotenv
+import numpy as np
 
 # Carregar variáveis de ambiente
 load_dotenv()
@@ -17,7 +25,6 @@ load_dotenv()
 try:
     import psycopg2
     from psycopg2 import pool
-    from psycopg2.extras import RealDictCursor
 except ImportError:
     print("❌ Erro: psycopg2 não está instalado.")
     print("   Execute: pip install psycopg2-binary")
@@ -112,6 +119,144 @@ def generate_zebra_epc_id(barcode, po_number, sequence, target_length=24):
     return epc_id
 
 
+# Linhas da view por lote de geração de EPCs
+EPC_BATCH_ROWS = 500
+
+# Potências de 10 para contar os dígitos do sequencial (str(sequence) sem str)
+_SEQ_DIGIT_LIMITS = 10 ** np.arange(1, 19, dtype=np.int64)
+_HEX_DIGITS = np.frombuffer(b'0123456789ABCDEF', dtype=np.uint8)
+
+
+def _po_digits(po_number):
+    """PO sem letras (apenas números), como em generate_zebra_epc_id"""
+    return ''.join(filter(str.isdigit, str(po_number or '0000')))
+
+
+def _epc_prefix(barcode, po_digits):
+    """Barcode com 12 caracteres + PO só com dígitos (a parte fixa do EPC de uma linha)"""
+    return str(barcode or '000000000000')[:12].zfill(12) + po_digits
+
+
+def _epc_matrix(prefixes, starts, counts, target_length=24):
+    """
+    EPCs de várias linhas em uma matriz de bytes (unidade x posição):
+    linha i gera counts[i] EPCs prefixes[i] + sequencial (starts[i], starts[i] + 1, ...).
+    Retorna (matriz, fallback, sequenciais, linha de cada unidade); unidades em fallback
+    (maiores que target_length ou prefixo não ASCII) ficam para a função unitária.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    total = int(counts.sum())
+    row_of = np.repeat(np.arange(len(prefixes)), counts)
+    
+    # Sequencial de cada unidade e quantos dígitos ele tem
+    offsets = np.cumsum(counts) - counts
+    sequences = np.repeat(np.asarray(starts, dtype=np.int64), counts) + np.arange(total) - np.repeat(offsets, counts)
+    seq_lengths = np.searchsorted(_SEQ_DIGIT_LIMITS, sequences, side='right') + 1
+    
+    # Matriz já preenchida com '0' (o ljust)
+    prefix_lengths = np.array([len(prefix) for prefix in prefixes], dtype=np.int64)
+    ascii_rows = np.array([prefix.isascii() for prefix in prefixes], dtype=bool)
+    padded = b''.join(
+        prefix[:target_length].ljust(target_length, '0').encode('ascii') if is_ascii else b'0' * target_length
+        for prefix, is_ascii in zip(prefixes, ascii_rows)
+    )
+    epc_bytes = np.frombuffer(padded, dtype=np.uint8).reshape(len(prefixes), target_length)[row_of]
+    
+    unit_prefix_lengths = prefix_lengths[row_of]
+    fallback = (unit_prefix_lengths + seq_lengths > target_length) | ~ascii_rows[row_of]
+    
+    units = np.arange(total)
+    for position in range(int(seq_lengths.max(initial=0))):
+        selected = (position < seq_lengths) & ~fallback
+        power = 10 ** np.maximum(seq_lengths - 1 - position, 0)
+        digits = sequences // power % 10
+        epc_bytes[units[selected], unit_prefix_lengths[selected] + position] = digits[selected] + ord('0')
+    
+    return epc_bytes, fallback, sequences, row_of
+
+
+def _epc_strings(epc_bytes):
+    """Matriz de bytes (ASCII) -> lista de str, uma por linha"""
+    return epc_bytes.view(f'S{epc_bytes.shape[1]}').ravel().astype(f'U{epc_bytes.shape[1]}').tolist()
+
+
+def generate_zebra_epc_ids(barcodes, po_numbers, qtys, po_sequences=None, target_length=24, with_hex=False):
+    """
+    Versão em lote de generate_zebra_epc_id (mesmo resultado, unidade por unidade)
+    Cada linha (barcode, PO, qty) gera qty EPCs com sequenciais contínuos por PO,
+    como em prepare_rfid_data. po_sequences (PO -> último sequencial usado) é
+    atualizado, para continuar a contagem no lote seguinte.
+    Retorna (epc_ids, epc_hex, linhas): listas por unidade; epc_hex é None sem with_hex
+    e linhas[i] é o índice da linha de origem da unidade i.
+    """
+    if po_sequences is None:
+        po_sequences = {}
+    
+    # Prefixo (barcode + PO só com dígitos) calculado uma vez por linha, não por unidade
+    po_digits = {}
+    prefixes = []
+    starts = []
+    counts = []
+    for barcode, po, qty in zip(barcodes, po_numbers, qtys):
+        qty = max(int(qty), 0)
+        if po not in po_digits:
+            po_digits[po] = _po_digits(po)
+        prefixes.append(_epc_prefix(barcode, po_digits[po]))
+        start = po_sequences.get(po, 0)
+        po_sequences[po] = start + qty
+        starts.append(start + 1)
+        counts.append(qty)
+    
+    if not sum(counts):
+        return [], [] if with_hex else None, []
+    
+    epc_bytes, fallback, sequences, row_of = _epc_matrix(prefixes, starts, counts, target_length)
+    epc_ids = _epc_strings(epc_bytes)
+    # Maior que target_length (ou não ASCII): fica com a função unitária, que não corta
+    for unit in np.flatnonzero(fallback).tolist():
+        row = int(row_of[unit])
+        epc_ids[unit] = generate_zebra_epc_id(barcodes[row], po_numbers[row], int(sequences[unit]), target_length)
+    
+    epc_hex = None
+    if with_hex:
+        epc_hex = _epc_ids_to_hex(epc_bytes, fallback, epc_ids)
+    return epc_ids, epc_hex, row_of.tolist()
+
+
+def _epc_ids_to_hex(epc_bytes, fallback, epc_ids):
+    """epc_id_to_hex em lote para EPCs de 24 dígitos (os demais pela função unitária)"""
+    digits = epc_bytes.astype(np.int64) - ord('0')
+    valid = ~fallback & np.all((digits >= 0) & (digits <= 9), axis=1)
+    if epc_bytes.shape[1] != 24:
+        valid[:] = False
+    
+    # valor < 10^24 < 2^80: dividido em duas partes de 40 bits (alto, baixo)
+    powers = 10 ** np.arange(11, -1, -1, dtype=np.int64)
+    high_digits = digits[:, :12] @ powers
+    low_digits = digits[:, 12:] @ powers
+    # high_digits * 10^12 + low_digits, sem passar de 64 bits nas contas
+    mask20 = (1 << 20) - 1
+    mask40 = (1 << 40) - 1
+    a1 = high_digits >> 20
+    a0 = high_digits & mask20
+    t1 = a1 * 10 ** 12
+    low = ((t1 & mask20) << 20) + a0 * 10 ** 12 + low_digits
+    high = (t1 >> 20) + (low >> 40)
+    low &= mask40
+    
+    nibbles = np.empty((len(epc_ids), 20), dtype=np.uint8)
+    for i in range(10):
+        shift = 4 * (9 - i)
+        nibbles[:, i] = _HEX_DIGITS[(high >> shift) & 15]
+        nibbles[:, 10 + i] = _HEX_DIGITS[(low >> shift) & 15]
+    # hex() não tem zeros à esquerda (e zero vira '0')
+    epc_hex = [value.lstrip('0') or '0' for value in nibbles.view('S20').ravel().astype('U20').tolist()]
+    
+    for unit in np.flatnonzero(~valid).tolist():
+        epc_hex[unit] = epc_id_to_hex(epc_ids[unit])
+    return epc_hex
+
+
 def epc_id_to_hex(epc_id):
     """Converte EPC ID numérico para hexadecimal (caso necessário)"""
     try:
@@ -148,72 +293,148 @@ def create_print_log_table(conn):
         conn.rollback()
 
 
-def fetch_printed_labels(conn):
-    """Busca apenas etiquetas que foram impressas"""
-    # Criar tabela se não existir
-    create_print_log_table(conn)
-    
-    query = """
-        SELECT DISTINCT
-          pl.epc_id,
-          pl.barcode,
-          pl.vpn,
-          pl.po,
-          pl.sequence,
-          pl.printed_at,
-          v."VPN" AS vpn_from_view,
-          v.barcode AS barcode_from_view
-        FROM senda.print_log pl
-        LEFT JOIN senda.vw_labels_variants_barcode v 
-          ON pl.barcode = v.barcode 
-          AND pl.po = v.ordem_pedido
-        WHERE pl.epc_id IS NOT NULL
-          AND pl.epc_id != ''
-        ORDER BY pl.printed_at DESC, pl.po, pl.sequence
+# Linhas lidas do servidor por vez nos cursores nomeados (memória constante)
+EXPORT_ITERSIZE = int(os.getenv('RFID_EXPORT_ITERSIZE', '2000'))
+
+_cursor_ids = itertools.count(1)
+
+
+def _record_type(name, fields):
+    """Tupla nomeada com .get(), para o resto do código continuar lendo as linhas como dict"""
+    base = namedtuple(name, fields)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self._fields else default
+
+    return type(name, (base,), {'__slots__': (), 'get': get})
+
+
+PrintedLabelRow = _record_type('PrintedLabelRow', [
+    'epc_id', 'barcode', 'vpn', 'po', 'sequence', 'printed_at', 'vpn_from_view', 'barcode_from_view',
+])
+
+PoRow = _record_type('PoRow', [
+    'ordem_pedido', 'referencia', 'style_name', 'description_label', 'sku',
+    'vpn', 'barcode', 'qty', 'color', 'size',
+])
+
+PRINTED_LABELS_QUERY = """
+    SELECT DISTINCT
+      pl.epc_id,
+      pl.barcode,
+      pl.vpn,
+      pl.po,
+      pl.sequence,
+      pl.printed_at,
+      v."VPN" AS vpn_from_view,
+      v.barcode AS barcode_from_view
+    FROM senda.print_log pl
+    LEFT JOIN senda.vw_labels_variants_barcode v 
+      ON pl.barcode = v.barcode 
+      AND pl.po = v.ordem_pedido
+    WHERE pl.epc_id IS NOT NULL
+      AND pl.epc_id != ''
+    ORDER BY pl.printed_at DESC, pl.po, pl.sequence
+"""
+
+PO_DATA_QUERY = """
+    SELECT
+      ordem_pedido,
+      referencia,
+      "STYLE NAME" AS style_name,
+      description_label,
+      sku,
+      "VPN" AS vpn,
+      barcode,
+      qty,
+      "COLOR" AS color,
+      "SIZE" AS size
+    FROM senda.vw_labels_variants_barcode
+    WHERE ordem_pedido IS NOT NULL
+      AND barcode IS NOT NULL
+      AND barcode != ''
+      AND "VPN" IS NOT NULL
+      AND "VPN" != ''
+    ORDER BY ordem_pedido, "STYLE NAME", "SIZE"
+"""
+
+
+def stream_query(conn, query, record_type, params=None, itersize=None):
     """
+    Executa a query em um cursor nomeado (server-side) e gera as linhas como record_type.
+    O servidor manda `itersize` linhas por vez: a memória não cresce com o resultado
+    e as primeiras linhas chegam antes de a query terminar de ser lida.
+    Cursor nomeado só existe dentro de uma transação (aberta pelo psycopg2 no execute).
+    """
+    name = f"rfid_export_{os.getpid()}_{next(_cursor_ids)}"
+    with conn.cursor(name=name) as cur:
+        cur.itersize = itersize or EXPORT_ITERSIZE
+        cur.execute(query, params)
+        for row in cur:
+            yield record_type._make(row)
+
+
+def iter_printed_labels(conn, itersize=None):
+    """Etiquetas impressas, uma a uma (PrintedLabelRow), sem carregar o print_log inteiro"""
+    # Criar tabela se não existir (faz commit antes de abrir o cursor nomeado)
+    create_print_log_table(conn)
     
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(query)
-            rows = cur.fetchall()
-            print(f"✅ {len(rows)} etiqueta(s) impressa(s) encontrada(s)")
-            return rows
+        yield from stream_query(conn, PRINTED_LABELS_QUERY, PrintedLabelRow, itersize=itersize)
     except Exception as e:
         print(f"❌ Erro ao buscar etiquetas impressas: {e}")
         raise
 
 
+def iter_po_data(conn, itersize=None):
+    """Linhas da view de PO, uma a uma (PoRow), sem carregar a view inteira"""
+    try:
+        yield from stream_query(conn, PO_DATA_QUERY, PoRow, itersize=itersize)
+    except Exception as e:
+        print(f"❌ Erro ao buscar dados da view: {e}")
+        raise
+
+
+def fetch_printed_labels(conn):
+    """Busca apenas etiquetas que foram impressas"""
+    rows = list(iter_printed_labels(conn))
+    print(f"✅ {len(rows)} etiqueta(s) impressa(s) encontrada(s)")
+    return rows
+
+
 def fetch_po_data(conn):
     """Busca todos os dados da view de PO (versão original)"""
+    rows = list(iter_po_data(conn))
+    print(f"✅ {len(rows)} registro(s) encontrado(s) na view")
+    return rows
+
+
+def fetch_po_references(conn, pos=None):
+    """Referências distintas da view de PO (todas ou só dos POs informados)"""
     query = """
-        SELECT
-          ordem_pedido,
-          referencia,
-          "STYLE NAME" AS style_name,
-          description_label,
-          sku,
-          "VPN" AS vpn,
-          barcode,
-          qty,
-          "COLOR" AS color,
-          "SIZE" AS size
+        SELECT DISTINCT referencia
         FROM senda.vw_labels_variants_barcode
-        WHERE ordem_pedido IS NOT NULL
-          AND barcode IS NOT NULL
-          AND barcode != ''
-          AND "VPN" IS NOT NULL
-          AND "VPN" != ''
-        ORDER BY ordem_pedido, "STYLE NAME", "SIZE"
+        WHERE referencia IS NOT NULL
+          AND referencia != ''
+          AND ordem_pedido IS NOT NULL
     """
-    
+    params = []
+    if pos:
+        # aceita "PO123", "po 123" ou "123" (mesma limpeza de clean_po_string)
+        query += """
+          AND regexp_replace(trim(ordem_pedido::text), '^[Pp][Oo]\\s*', '') = ANY(%s)
+        """
+        params.append([clean_po_string(po) for po in pos])
+    query += " ORDER BY referencia"
+
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(query)
-            rows = cur.fetchall()
-            print(f"✅ {len(rows)} registro(s) encontrado(s) na view")
-            return rows
+        with conn.cursor() as cur:
+            cur.execute(query, params)
+            references = [row[0] for row in cur.fetchall()]
+            print(f"✅ {len(references)} referência(s) encontrada(s) na view")
+            return references
     except Exception as e:
-        print(f"❌ Erro ao buscar dados da view: {e}")
+        print(f"❌ Erro ao buscar referências da view: {e}")
         raise
 
 
@@ -225,288 +446,464 @@ def clean_po_string(po):
     return po_text.strip()
 
 
-def prepare_rfid_data_from_printed(rows):
-    """Prepara dados RFID a partir de etiquetas impressas"""
-    rfid_records = []
-    invalid_count = 0
+class RfidRecordStore:
+    """
+    Registros RFID (uma unidade por etiqueta) guardados em colunas, não em um dict por unidade:
+    → asset_id, VPN e PO codificados por dicionário (cada string guardada uma vez)
+    → unidades seguidas com os mesmos atributos formam um trecho (run)
+    → linhas da view: o trecho guarda prefixo + 1º sequencial + quantidade,
+      e os EPCs só são gerados (em lote) na leitura
+    → etiquetas impressas: EPCs em um bytearray de largura fixa (24 bytes por unidade)
+    po_sequences (PO -> último sequencial usado) pode ser compartilhado entre stores
+    para continuar a numeração (lotes de um mesmo stream).
+    """
     
-    for row in rows:
+    EPC_LENGTH = 24
+    
+    def __init__(self, po_sequences=None):
+        self.po_sequences = {} if po_sequences is None else po_sequences
+        self.invalid_count = 0
+        self._strings = []
+        self._string_codes = {}
+        self._po_digits = {}
+        # Trechos. _run_first: 1º sequencial (> 0, EPCs gerados a partir de _run_prefix),
+        # 0 (EPCs no bytearray a partir da unidade _run_offset) ou -1 (EPC literal em _run_prefix)
+        self._run_prefix = array('I')
+        self._run_first = array('q')
+        self._run_offset = array('q')
+        self._run_count = array('q')
+        self._run_asset = array('I')
+        self._run_vpn = array('I')
+        self._run_po = array('I')
+        self._epcs = bytearray()
+        self._units = 0
+    
+    def __len__(self):
+        return self._units
+    
+    def __iter__(self):
+        return self.records()
+    
+    @property
+    def nbytes(self):
+        """Memória aproximada ocupada pelos registros (colunas, EPCs e dicionários de strings)"""
+        columns = (self._run_prefix, self._run_first, self._run_offset, self._run_count,
+                   self._run_asset, self._run_vpn, self._run_po)
+        # _string_codes só aponta para as strings de _strings; _po_digits tem chaves (POs) e valores próprios
+        dictionaries = (sys.getsizeof(self._strings) + sys.getsizeof(self._string_codes)
+                        + sys.getsizeof(self._po_digits)
+                        + sum(sys.getsizeof(po) + sys.getsizeof(digits) for po, digits in self._po_digits.items()))
+        return (sum(column.buffer_info()[1] * column.itemsize for column in columns)
+                + len(self._epcs) + sum(sys.getsizeof(value) for value in self._strings) + dictionaries)
+    
+    def _code(self, value):
+        code = self._string_codes.get(value)
+        if code is None:
+            code = self._string_codes[value] = len(self._strings)
+            self._strings.append(value)
+        return code
+    
+    def _append_run(self, prefix, first, offset, count, asset_id, vpn, po_clean):
+        asset, vpn, po = self._code(asset_id), self._code(vpn), self._code(po_clean)
+        last = len(self._run_count) - 1
+        # EPCs do bytearray seguidos e com os mesmos atributos: só aumenta o trecho anterior
+        if (first == 0 and last >= 0 and self._run_first[last] == 0
+                and self._run_asset[last] == asset and self._run_vpn[last] == vpn and self._run_po[last] == po):
+            self._run_count[last] += count
+        else:
+            self._run_prefix.append(prefix)
+            self._run_first.append(first)
+            self._run_offset.append(offset)
+            self._run_count.append(count)
+            self._run_asset.append(asset)
+            self._run_vpn.append(vpn)
+            self._run_po.append(po)
+        self._units += count
+    
+    def add_view_row(self, row):
+        """Linha da view de PO: qty unidades com sequenciais contínuos por PO"""
+        po = str(row.get('ordem_pedido', '')).strip()
+        barcode = str(row.get('barcode', '')).strip()
+        vpn = str(row.get('vpn', '') or row.get('VPN', '')).strip()
+        qty = int(row.get('qty', 1))
+        
+        if not po or not barcode:
+            self.invalid_count += 1
+            return
+        
+        start = self.po_sequences.get(po, 0)
+        if qty <= 0:
+            return
+        self.po_sequences[po] = start + qty
+        
+        if po not in self._po_digits:
+            self._po_digits[po] = _po_digits(po)
+        prefix = _epc_prefix(barcode, self._po_digits[po])
+        
+        # EPC = prefixo + sequencial + zeros: válido (24 dígitos) enquanto o sequencial couber
+        room = self.EPC_LENGTH - len(prefix)
+        valid = max(0, min(qty, 10 ** room - 1 - start)) if prefix.isdigit() and room > 0 else 0
+        for sequence in range(start + valid + 1, start + qty + 1):
+            epc_id = generate_zebra_epc_id(barcode, po, sequence, target_length=24)
+            print(f"   ⚠️ EPC ID inválido: {epc_id} (tamanho: {len(epc_id)})")
+            self.invalid_count += 1
+        
+        if valid:
+            # Asset ID agora usa o VPN (sku_variant) se disponível, senão usa barcode
+            asset_id = vpn if vpn else barcode
+            self._append_run(self._code(prefix), start + 1, 0, valid, asset_id, vpn, '')
+    
+    def add_printed_row(self, row):
+        """Etiqueta impressa (print_log): uma unidade com o EPC já gravado"""
         epc_id = str(row.get('epc_id', '')).strip()
         vpn = str(row.get('vpn', '') or row.get('vpn_from_view', '')).strip()
         barcode = str(row.get('barcode', '') or row.get('barcode_from_view', '')).strip()
         po_raw = row.get('po') or row.get('PO') or ''
         po_clean = clean_po_string(po_raw)
-
+        
         if not epc_id:
-            invalid_count += 1
-            continue
+            self.invalid_count += 1
+            return
         
         # Validar formato do EPC ID (deve ser exatamente 24 caracteres numéricos)
         if len(epc_id) != 24 or not epc_id.isdigit():
             print(f"   ⚠️ EPC ID inválido: {epc_id} (tamanho: {len(epc_id)})")
-            invalid_count += 1
-            continue
+            self.invalid_count += 1
+            return
         
         # Asset ID usa o VPN se disponível, senão usa barcode
         asset_id = vpn if vpn else barcode
         
-        rfid_records.append({
-            'epc_id': epc_id,
-            'asset_id': asset_id,
-            'vpn': vpn,
-            'printed_at': row.get('printed_at'),
-            'po_clean': po_clean
-        })
+        if epc_id.isascii():
+            self._append_run(0, 0, len(self._epcs) // self.EPC_LENGTH, 1, asset_id, vpn, po_clean)
+            self._epcs += epc_id.encode('ascii')
+        else:
+            self._append_run(self._code(epc_id), -1, 0, 1, asset_id, vpn, po_clean)
     
-    if invalid_count > 0:
-        print(f"   ⚠️ {invalid_count} registro(s) inválido(s) ignorado(s)")
+    def value_batches(self, with_hex=False, size=None):
+        """
+        Registros em lotes de até `size` unidades, como tuplas na ordem de RECORD_COLUMNS
+        (os trechos são expandidos aqui, um lote por vez)
+        """
+        size = size or EXPORT_BATCH_SIZE
+        segments = []
+        pending = 0
+        for run, count in enumerate(self._run_count):
+            done = 0
+            while done < count:
+                take = min(count - done, size - pending)
+                segments.append((run, done, take))
+                pending += take
+                done += take
+                if pending == size:
+                    yield self._expand(segments, with_hex)
+                    segments = []
+                    pending = 0
+        if segments:
+            yield self._expand(segments, with_hex)
     
-    return rfid_records
+    def records(self, with_hex=False):
+        """Registros como dicts (epc_id, asset_id, vpn, po_clean e, com with_hex, epc_hex)"""
+        for batch in self.value_batches(with_hex):
+            for epc_id, epc_hex, asset_id, vpn, po_clean, _ in batch:
+                record = {
+                    'epc_id': epc_id,
+                    'asset_id': asset_id,
+                    'vpn': vpn,
+                    'po_clean': po_clean
+                }
+                if with_hex:
+                    record['epc_hex'] = epc_hex
+                yield record
+    
+    def _expand(self, segments, with_hex):
+        """Trechos (trecho, unidades já lidas, quantidade) -> tuplas de valores"""
+        epc_ids = []
+        epc_hex = []
+        kinds = itertools.groupby(segments, key=lambda segment: min(self._run_first[segment[0]], 1))
+        for kind, group in kinds:
+            group = list(group)
+            fallback = None
+            if kind == 1:
+                prefixes = [self._strings[self._run_prefix[run]] for run, _, _ in group]
+                starts = [self._run_first[run] + skip for run, skip, _ in group]
+                matrix, fallback, sequences, row_of = _epc_matrix(
+                    prefixes, starts, [take for _, _, take in group], self.EPC_LENGTH)
+                ids = _epc_strings(matrix)
+                for unit in np.flatnonzero(fallback).tolist():
+                    ids[unit] = (prefixes[row_of[unit]] + str(int(sequences[unit]))).ljust(self.EPC_LENGTH, '0')
+            elif kind == 0:
+                width = self.EPC_LENGTH
+                data = b''.join(
+                    self._epcs[(self._run_offset[run] + skip) * width:(self._run_offset[run] + skip + take) * width]
+                    for run, skip, take in group
+                )
+                matrix = np.frombuffer(data, dtype=np.uint8).reshape(-1, width)
+                fallback = np.zeros(len(matrix), dtype=bool)
+                ids = _epc_strings(matrix)
+            else:
+                ids = [self._strings[self._run_prefix[run]] for run, _, _ in group]
+            
+            epc_ids += ids
+            if with_hex:
+                if fallback is None:
+                    epc_hex += [epc_id_to_hex(epc_id) for epc_id in ids]
+                else:
+                    epc_hex += _epc_ids_to_hex(matrix, fallback, ids)
+        
+        strings = self._strings
+        assets = []
+        vpns = []
+        pos = []
+        for run, _, take in segments:
+            assets.extend(itertools.repeat(strings[self._run_asset[run]], take))
+            vpns.extend(itertools.repeat(strings[self._run_vpn[run]], take))
+            pos.extend(itertools.repeat(strings[self._run_po[run]], take))
+        hex_column = epc_hex if with_hex else itertools.repeat('')
+        return list(zip(epc_ids, hex_column, assets, vpns, pos, itertools.repeat('')))
 
 
-def prepare_rfid_data(rows):
-    """Prepara dados RFID de todas as linhas (versão original para view completa)"""
-    rfid_records = []
+def _iter_store_records(rows, add_row, with_hex):
+    """Registros, um a um, de RfidRecordStores de EPC_BATCH_ROWS linhas (memória constante)"""
     po_sequences = {}
     invalid_count = 0
+    rows = iter(rows)
     
-    for row in rows:
-        po = str(row.get('ordem_pedido', '')).strip()
-        barcode = str(row.get('barcode', '')).strip()
-        vpn = str(row.get('vpn', '') or row.get('VPN', '')).strip()
-        qty = int(row.get('qty', 1))
-        
-        if not po or not barcode:
-            invalid_count += 1
-            continue
-        
-        if po not in po_sequences:
-            po_sequences[po] = 0
-        
-        for i in range(qty):
-            po_sequences[po] += 1
-            sequence = po_sequences[po]
-            epc_id = generate_zebra_epc_id(barcode, po, sequence, target_length=24)
-            # Asset ID agora usa o VPN (sku_variant) se disponível, senão usa barcode
-            asset_id = vpn if vpn else barcode
-            
-            # Validar formato do EPC ID (deve ser exatamente 24 caracteres numéricos)
-            if len(epc_id) != 24 or not epc_id.isdigit():
-                print(f"   ⚠️ EPC ID inválido: {epc_id} (tamanho: {len(epc_id)})")
-                invalid_count += 1
-                continue
-            
-            rfid_records.append({
-                'epc_id': epc_id,
-                'asset_id': asset_id,
-                'vpn': vpn
-            })
+    while True:
+        chunk = list(itertools.islice(rows, EPC_BATCH_ROWS))
+        if not chunk:
+            break
+        store = RfidRecordStore(po_sequences)
+        for row in chunk:
+            add_row(store, row)
+        invalid_count += store.invalid_count
+        yield from store.records(with_hex)
     
     if invalid_count > 0:
         print(f"   ⚠️ {invalid_count} registro(s) inválido(s) ignorado(s)")
+
+
+def iter_rfid_records_from_printed(rows, with_hex=False):
+    """Registros RFID de etiquetas impressas, um a um (gerador)"""
+    return _iter_store_records(rows, RfidRecordStore.add_printed_row, with_hex)
+
+
+def iter_rfid_records(rows, with_hex=False):
+    """
+    Registros RFID da view (um por unidade de qty), um a um (gerador)
+    Os EPCs são gerados em lote a cada EPC_BATCH_ROWS linhas;
+    com with_hex o registro já leva o EPC em hexadecimal ('epc_hex').
+    """
+    return _iter_store_records(rows, RfidRecordStore.add_view_row, with_hex)
+
+
+def _prepare_store(rows, add_row):
+    store = RfidRecordStore()
+    for row in rows:
+        add_row(store, row)
     
-    return rfid_records
+    if store.invalid_count > 0:
+        print(f"   ⚠️ {store.invalid_count} registro(s) inválido(s) ignorado(s)")
+    
+    return store
 
 
-def generate_rfid_csv_atl_simple(rows, output_file='AssetTagList.csv', from_printed=False):
-    """Versão ATL - EPC ID + Asset ID (VPN)"""
-    if from_printed:
-        rfid_records = prepare_rfid_data_from_printed(rows)
-    else:
-        rfid_records = prepare_rfid_data(rows)
+def prepare_rfid_data_from_printed(rows):
+    """Prepara dados RFID a partir de etiquetas impressas (RfidRecordStore)"""
+    return _prepare_store(rows, RfidRecordStore.add_printed_row)
+
+
+def prepare_rfid_data(rows):
+    """Prepara dados RFID de todas as linhas (versão original para view completa) (RfidRecordStore)"""
+    return _prepare_store(rows, RfidRecordStore.add_view_row)
+
+
+# Campos do registro que um formato pode usar como coluna ('' = coluna vazia)
+RECORD_COLUMNS = ('epc_id', 'epc_hex', 'asset_id', 'vpn', 'po_clean', '')
+
+
+@dataclass(frozen=True)
+class CsvSink:
+    """
+    Formato de arquivo de saída da exportação
+    output_file pode ter {timestamp}; encoding 'utf-8-sig' grava com BOM
+    """
+    name: str
+    output_file: str
+    columns: Tuple[str, ...]
+    header: Optional[Tuple[str, ...]] = None
+    encoding: str = 'utf-8'
+    quoting: int = csv.QUOTE_MINIMAL
+    lineterminator: str = '\n'
+    description: str = ''
+
+
+EXPORT_FORMATS = {sink.name: sink for sink in (
+    CsvSink('principal', 'rfid_export_123rfid_{timestamp}.csv', ('epc_id', 'asset_id'), ('EPC ID', 'Asset ID'),
+            description='Formato: sem aspas, igual ao arquivo exportado do 123RFID'),
+    CsvSink('atl_simple', 'AssetTagList.csv', ('epc_id', 'asset_id', 'po_clean'), ('RFID', 'Asset ID', 'PO'),
+            description='Formato: EPC ID, Asset ID (VPN), PO'),
+    CsvSink('atl_epc_only', 'AssetTagList_epc_only.csv', ('epc_id',),
+            description='Formato: apenas EPC ID, sem cabeçalho'),
+    CsvSink('taglist', 'Taglist.csv', ('epc_id', 'asset_id'), ('EPC ID', 'Asset ID'),
+            description='Nome: Taglist.csv (formato oficial do 123RFID)'),
+    CsvSink('taglist_hex', 'Taglist_hex.csv', ('epc_hex', 'asset_id'), ('EPC ID', 'Asset ID'),
+            description='EPC IDs em formato hexadecimal'),
+    CsvSink('epc_only', 'rfid_export_123rfid_epc_only_{timestamp}.csv', ('epc_id',), ('EPC ID',)),
+    CsvSink('asset_equals_epc', 'rfid_export_123rfid_asset_equals_epc_{timestamp}.csv',
+            ('epc_id', 'epc_id'), ('EPC ID', 'Asset ID')),
+    # Variações de teste (BOM / aspas / vírgula no final)
+    CsvSink('v2', 'rfid_export_123rfid_v2_{timestamp}.csv', ('epc_id',),
+            encoding='utf-8-sig', quoting=csv.QUOTE_ALL, lineterminator='\r\n'),
+    CsvSink('v3', 'rfid_export_123rfid_v3_{timestamp}.csv', ('epc_id',), ('EPC ID',),
+            quoting=csv.QUOTE_ALL, lineterminator='\r\n'),
+    CsvSink('v4', 'rfid_export_123rfid_v4_{timestamp}.csv', ('epc_id', ''), ('EPC ID', ''),
+            encoding='utf-8-sig', quoting=csv.QUOTE_ALL, lineterminator='\r\n'),
+)}
+
+# Registros por lote de escrita nos arquivos (writerows por lote)
+EXPORT_BATCH_SIZE = 1000
+
+# Arquivos gerados pelo main(), nesta ordem
+MAIN_EXPORT_FORMATS = ('principal', 'atl_simple', 'atl_epc_only', 'taglist', 'taglist_hex',
+                       'epc_only', 'asset_equals_epc')
+
+
+def _column_getter(columns):
+    """Função que tira da tupla de valores do registro as colunas do formato, na ordem"""
+    positions = [RECORD_COLUMNS.index(column) for column in columns]
+    if len(positions) == 1:
+        position = positions[0]
+        return lambda values: (values[position],)
+    return itemgetter(*positions)
+
+
+def _record_value_batches(records, need_hex):
+    """Dicts de registro -> lotes de tuplas na ordem de RECORD_COLUMNS"""
+    batch = []
+    for record in records:
+        epc_id = str(record['epc_id'])
+        batch.append((
+            epc_id,
+            (record.get('epc_hex') or epc_id_to_hex(epc_id)) if need_hex else '',
+            str(record['asset_id'] or ''),
+            record.get('vpn') or '',
+            str(record.get('po_clean') or ''),
+            '',
+        ))
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def export_rfid_files(records, sinks, timestamp=None):
+    """
+    Exporta os registros para todos os formatos em uma única passada:
+    cada registro (e o seu EPC em hex, se algum formato usar) é montado uma vez
+    e escrito em todos os arquivos abertos. `records` é um RfidRecordStore
+    ou qualquer iterável de dicts de registro (pode ser um gerador).
+    Retorna {nome do formato: caminho}, com None em todos se não houve registro.
+    """
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    timestamp = timestamp or datetime.now().strftime('%Y%m%d_%H%M%S')
+    need_hex = any('epc_hex' in sink.columns for sink in sinks)
+    paths = {}
+    outputs = []
+    total = 0
+    vpn_count = 0
     
-    if not rfid_records:
+    with ExitStack() as stack:
+        for sink in sinks:
+            path = os.path.join(base_dir, sink.output_file.format(timestamp=timestamp))
+            f = stack.enter_context(open(path, 'w', newline='', encoding=sink.encoding))
+            writer = csv.writer(f, delimiter=',', quoting=sink.quoting, lineterminator=sink.lineterminator)
+            if sink.header:
+                writer.writerow(sink.header)
+            paths[sink.name] = path
+            outputs.append((writer.writerows, _column_getter(sink.columns)))
+        
+        # cada lote de registros vai para todos os arquivos de uma vez
+        if isinstance(records, RfidRecordStore):
+            batches = records.value_batches(with_hex=need_hex)
+        else:
+            batches = _record_value_batches(records, need_hex)
+        for batch in batches:
+            for writerows, getter in outputs:
+                writerows(map(getter, batch))
+            total += len(batch)
+            vpn_count += sum(1 for values in batch if values[3])
+    
+    if not total:
+        for path in paths.values():
+            os.remove(path)
         print("   ⚠️ Nenhum registro")
-        return None
+        return dict.fromkeys(paths)
     
-    output_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), output_file)
-    with open(output_path, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f, delimiter=',', quoting=csv.QUOTE_MINIMAL, lineterminator='\n')
-        writer.writerow(['RFID', 'Asset ID', 'PO'])
-        for record in rfid_records:
-            # EPC ID + Asset ID (VPN)
-            writer.writerow([str(record['epc_id']), str(record['asset_id'] or ''), str(record.get('po_clean', ''))])
-    
-    print(f"   ✅ {output_path} ({len(rfid_records)} registros)")
-    print(f"   📝 Formato: EPC ID, Asset ID (VPN), sem cabeçalho")
-    if from_printed:
-        print(f"   📋 Fonte: Etiquetas impressas (print_log)")
-    vpn_count = sum(1 for r in rfid_records if r.get('vpn'))
-    print(f"   📊 {vpn_count}/{len(rfid_records)} registros com VPN")
-    return output_path
+    for sink in sinks:
+        print(f"   ✅ {paths[sink.name]} ({total} registros)")
+        if sink.description:
+            print(f"      📝 {sink.description}")
+    print(f"   📊 {vpn_count}/{total} registros com VPN")
+    return paths
+
+
+def _export_format(rows, name, output_file, from_printed=False):
+    """Um formato só (compatibilidade com as funções generate_rfid_csv_*)"""
+    records = prepare_rfid_data_from_printed(rows) if from_printed else prepare_rfid_data(rows)
+    sink = replace(EXPORT_FORMATS[name], output_file=output_file.replace('{', '{{').replace('}', '}}'))
+    return export_rfid_files(records, [sink])[name]
+
+
+def generate_rfid_csv_atl_simple(rows, output_file='AssetTagList.csv', from_printed=False):
+    """Versão ATL - EPC ID + Asset ID (VPN)"""
+    return _export_format(rows, 'atl_simple', output_file, from_printed=from_printed)
 
 
 def generate_rfid_csv_atl_epc_only(rows, output_file='AssetTagList_epc_only.csv'):
     """Versão ATL - apenas EPC ID (formato original que funcionou)"""
-    rfid_records = prepare_rfid_data(rows)
-    if not rfid_records:
-        print("   ⚠️ Nenhum registro")
-        return None
-    
-    output_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), output_file)
-    with open(output_path, 'w', newline='', encoding='utf-8') as f:
-        # Apenas EPC ID, sem cabeçalho
-        writer = csv.writer(f, delimiter=',', quoting=csv.QUOTE_MINIMAL, lineterminator='\n')
-        for record in rfid_records:
-            writer.writerow([str(record['epc_id'])])
-    
-    print(f"   ✅ {output_path} ({len(rfid_records)} registros)")
-    print(f"   📝 Formato: apenas EPC ID, sem cabeçalho")
-    return output_path
+    return _export_format(rows, 'atl_epc_only', output_file)
 
 
 def generate_rfid_csv_taglist(rows, output_file='Taglist.csv'):
     """Versão Taglist.csv - formato oficial do 123RFID"""
-    rfid_records = prepare_rfid_data(rows)
-    if not rfid_records:
-        print("   ⚠️ Nenhum registro")
-        return None
-    
-    output_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), output_file)
-    with open(output_path, 'w', newline='', encoding='utf-8') as f:
-        # Formato exato: EPC ID,Asset ID (sem espaços após vírgula)
-        writer = csv.writer(f, delimiter=',', quoting=csv.QUOTE_MINIMAL, lineterminator='\n')
-        writer.writerow(['EPC ID', 'Asset ID'])
-        for record in rfid_records:
-            # Asset ID = barcode (12 dígitos)
-            writer.writerow([str(record['epc_id']), str(record['asset_id'])])
-    
-    print(f"   ✅ {output_path} ({len(rfid_records)} registros)")
-    print(f"   📝 Nome: Taglist.csv (formato oficial do 123RFID)")
-    return output_path
+    return _export_format(rows, 'taglist', output_file)
 
 
 def generate_rfid_csv_taglist_hex(rows, output_file='Taglist_hex.csv'):
     """Versão Taglist com EPC ID em hexadecimal"""
-    rfid_records = prepare_rfid_data(rows)
-    if not rfid_records:
-        print("   ⚠️ Nenhum registro")
-        return None
-    
-    output_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), output_file)
-    with open(output_path, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f, delimiter=',', quoting=csv.QUOTE_MINIMAL, lineterminator='\n')
-        writer.writerow(['EPC ID', 'Asset ID'])
-        for record in rfid_records:
-            # Converter EPC ID para hexadecimal
-            epc_hex = epc_id_to_hex(record['epc_id'])
-            writer.writerow([epc_hex, str(record['asset_id'])])
-    
-    print(f"   ✅ {output_path} ({len(rfid_records)} registros)")
-    print(f"   📝 EPC IDs em formato hexadecimal")
-    return output_path
+    return _export_format(rows, 'taglist_hex', output_file)
 
 
 def generate_rfid_csv_asset_equals_epc(rows, output_file):
     """Versão: Asset ID igual ao EPC ID"""
-    rfid_records = prepare_rfid_data(rows)
-    if not rfid_records:
-        print("   ⚠️ Nenhum registro")
-        return None
-    
-    output_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), output_file)
-    with open(output_path, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f, delimiter=',', quoting=csv.QUOTE_MINIMAL, lineterminator='\n')
-        writer.writerow(['EPC ID', 'Asset ID'])
-        for record in rfid_records:
-            # Asset ID igual ao EPC ID
-            writer.writerow([str(record['epc_id']), str(record['epc_id'])])
-    
-    print(f"   ✅ {output_path} ({len(rfid_records)} registros)")
-    return output_path
+    return _export_format(rows, 'asset_equals_epc', output_file)
 
 
 def generate_rfid_csv_v1(rows, output_file):
     """Versão 1: Apenas EPC ID, sem aspas (formato igual ao exportado)"""
-    rfid_records = prepare_rfid_data(rows)
-    if not rfid_records:
-        print("   ⚠️ Nenhum registro")
-        return None
-    
-    output_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), output_file)
-    with open(output_path, 'w', newline='', encoding='utf-8') as f:
-        # QUOTE_MINIMAL - sem aspas, igual ao arquivo exportado
-        writer = csv.writer(f, delimiter=',', quoting=csv.QUOTE_MINIMAL, lineterminator='\n')
-        writer.writerow(['EPC ID'])
-        for record in rfid_records:
-            writer.writerow([str(record['epc_id'])])
-    
-    print(f"   ✅ {output_path} ({len(rfid_records)} registros)")
-    return output_path
+    return _export_format(rows, 'epc_only', output_file)
 
 
 def generate_rfid_csv_v2(rows, output_file):
     """Versão 2: Apenas EPC ID sem cabeçalho, UTF-8 BOM, valores como string"""
-    rfid_records = prepare_rfid_data(rows)
-    if not rfid_records:
-        print("   ⚠️ Nenhum registro")
-        return None
-    
-    output_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), output_file)
-    with open(output_path, 'w', newline='', encoding='utf-8-sig') as f:
-        writer = csv.writer(f, delimiter=',', quoting=csv.QUOTE_ALL)
-        for record in rfid_records:
-            writer.writerow([str(record['epc_id'])])
-    
-    print(f"   ✅ {output_path} ({len(rfid_records)} registros)")
-    return output_path
+    return _export_format(rows, 'v2', output_file)
 
 
 def generate_rfid_csv_v3(rows, output_file):
     """Versão 3: EPC ID com cabeçalho, UTF-8 sem BOM, valores como string"""
-    rfid_records = prepare_rfid_data(rows)
-    if not rfid_records:
-        print("   ⚠️ Nenhum registro")
-        return None
-    
-    output_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), output_file)
-    with open(output_path, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f, delimiter=',', quoting=csv.QUOTE_ALL)
-        writer.writerow(['EPC ID'])
-        for record in rfid_records:
-            writer.writerow([str(record['epc_id'])])
-    
-    print(f"   ✅ {output_path} ({len(rfid_records)} registros)")
-    return output_path
+    return _export_format(rows, 'v3', output_file)
 
 
 def generate_rfid_csv_v4(rows, output_file):
     """Versão 4: Formato exato do arquivo exportado (com vírgula no final), valores como string"""
-    rfid_records = prepare_rfid_data(rows)
-    if not rfid_records:
-        print("   ⚠️ Nenhum registro")
-        return None
-    
-    output_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), output_file)
-    with open(output_path, 'w', newline='', encoding='utf-8-sig') as f:
-        writer = csv.writer(f, delimiter=',', quoting=csv.QUOTE_ALL)
-        writer.writerow(['EPC ID', ''])  # Vírgula no final como no arquivo exportado
-        for record in rfid_records:
-            writer.writerow([str(record['epc_id']), ''])  # Vírgula no final
-    
-    print(f"   ✅ {output_path} ({len(rfid_records)} registros)")
-    return output_path
+    return _export_format(rows, 'v4', output_file)
 
 
 def generate_rfid_csv_v5(rows, output_file):
     """Versão 5: EPC ID + Asset ID, sem aspas (formato igual ao exportado)"""
-    rfid_records = prepare_rfid_data(rows)
-    if not rfid_records:
-        print("   ⚠️ Nenhum registro")
-        return None
-    
-    output_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), output_file)
-    # Usar QUOTE_MINIMAL (padrão) - sem aspas, igual ao arquivo exportado
-    with open(output_path, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f, delimiter=',', quoting=csv.QUOTE_MINIMAL, lineterminator='\n')
-        writer.writerow(['EPC ID', 'Asset ID'])
-        for record in rfid_records:
-            # Garantir que ambos sejam strings (sem aspas, igual ao exportado)
-            writer.writerow([str(record['epc_id']), str(record['asset_id'])])
-    
-    print(f"   ✅ {output_path} ({len(rfid_records)} registros)")
-    print(f"   📝 Formato: sem aspas, igual ao arquivo exportado do 123RFID")
-    return output_path
+    return _export_format(rows, 'principal', output_file)
 
 
 def generate_rfid_csv(rows, output_file='rfid_export_123rfid.csv'):
@@ -653,63 +1050,32 @@ def main():
         
         if choice == "1":
             print("\n📊 Buscando apenas etiquetas impressas...")
-            rows = fetch_printed_labels(conn)
-            from_printed = True
+            records = prepare_rfid_data_from_printed(iter_printed_labels(conn))
         else:
             print("\n📊 Buscando dados da view senda.vw_labels_variants_barcode...")
-            rows = fetch_po_data(conn)
-            from_printed = False
+            records = prepare_rfid_data(iter_po_data(conn))
+        print(f"   📦 {len(records)} etiqueta(s) em {records.nbytes / (1024 * 1024):.1f} MB")
         
-        if not rows:
-            print("⚠️ Nenhum dado encontrado")
-            return
-        
-        # Gerar CSV no formato correto (igual ao arquivo exportado)
+        # Todos os formatos em uma única passada pelos registros
         print()
-        print("📝 Gerando CSV no formato correto para 123RFID...")
+        print("📝 Gerando CSVs no formato correto para 123RFID...")
         print("   📋 Formato baseado no arquivo exportado do sistema")
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        
-        # Versão principal: EPC ID + Asset ID (formato correto)
-        print("\n✅ Gerando arquivo principal: EPC ID + Asset ID")
-        output_file = f'rfid_export_123rfid_{timestamp}.csv'
-        output_path = generate_rfid_csv_v5(rows, output_file)
+        paths = export_rfid_files(records, [EXPORT_FORMATS[name] for name in MAIN_EXPORT_FORMATS])
         
-        # Versão principal: EPC ID + Asset ID (VPN)
-        print("\n✅ Gerando arquivo AssetTagList.csv (EPC ID + VPN)")
-        atl_simple_path = generate_rfid_csv_atl_simple(rows, 'AssetTagList.csv', from_printed=from_printed)
-        
-        # Versão alternativa: apenas EPC ID (caso precise)
-        print("\n✅ Gerando arquivo AssetTagList_epc_only.csv (apenas EPC ID)")
-        atl_epc_only_path = generate_rfid_csv_atl_epc_only(rows, 'AssetTagList_epc_only.csv')
-        
-        # Versão com nome Taglist.csv (formato oficial)
-        print("\n✅ Gerando arquivo Taglist.csv (formato oficial)")
-        taglist_path = generate_rfid_csv_taglist(rows, 'Taglist.csv')
-        
-        # Versão Taglist com EPC em hexadecimal (caso precise)
-        print("\n✅ Gerando Taglist_hex.csv (EPC em hexadecimal)")
-        taglist_hex_path = generate_rfid_csv_taglist_hex(rows, 'Taglist_hex.csv')
-        
-        # Versão alternativa: apenas EPC ID
-        print("\n✅ Gerando versão alternativa: apenas EPC ID")
-        alt_output_file = f'rfid_export_123rfid_epc_only_{timestamp}.csv'
-        alt_output_path = generate_rfid_csv_v1(rows, alt_output_file)
-        
-        # Versão com Asset ID igual ao EPC ID (caso precise ser igual)
-        print("\n✅ Gerando versão com Asset ID = EPC ID")
-        alt2_output_file = f'rfid_export_123rfid_asset_equals_epc_{timestamp}.csv'
-        alt2_output_path = generate_rfid_csv_asset_equals_epc(rows, alt2_output_file)
+        output_path = paths['principal']
+        if not output_path:
+            print("⚠️ Nenhum dado encontrado")
+            return
         
         print()
         print("=" * 60)
         print("✅ Arquivos gerados com sucesso!")
-        print(f"   📁 AssetTagList.csv (formato simples, só EPC): {atl_simple_path}")
-        print(f"   📁 Taglist.csv (formato oficial): {taglist_path}")
-        print(f"   📁 Taglist_hex.csv (EPC em hex): {taglist_hex_path}")
+        print(f"   📁 AssetTagList.csv (formato simples, só EPC): {paths['atl_simple']}")
+        print(f"   📁 Taglist.csv (formato oficial): {paths['taglist']}")
+        print(f"   📁 Taglist_hex.csv (EPC em hex): {paths['taglist_hex']}")
         print(f"   📁 Principal (EPC + Asset): {output_path}")
-        print(f"   📁 Alternativo (só EPC): {alt_output_path}")
-        print(f"   📁 Alternativo 2 (Asset=EPC): {alt2_output_path}")
+        print(f"   📁 Alternativo (só EPC): {paths['epc_only']}")
+        print(f"   📁 Alternativo 2 (Asset=EPC): {paths['asset_equals_epc']}")
         print()
         print("💡 ORDEM DE TESTE RECOMENDADA:")
         print("   1. AssetTagList.csv (formato mais simples)")
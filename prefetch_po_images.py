@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Aquece o cache do Image Proxy com as imagens de POs que ainda vão imprimir,
+para a primeira impressão de um PO novo ser tão rápida quanto uma reimpressão.
+
+Uso:
+    python prefetch_po_images.py PO123 PO456       # referências dos POs na view
+    python prefetch_po_images.py --all             # todas as referências da view
+    python prefetch_po_images.py --refs 100.0001 100-0015
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_PROXY_URL = os.getenv('IMAGE_PROXY_URL') or f"http://127.0.0.1:{os.getenv('IMAGE_PROXY_PORT', '8002')}"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Aquece o cache de imagens do Image Proxy para POs")
+    parser.add_argument('pos', nargs='*', help="POs cujas referências serão aquecidas (ex.: PO123)")
+    parser.add_argument('--all', action='store_true', help="todas as referências da view")
+    parser.add_argument('--refs', nargs='+', default=[], help="referências avulsas (sem consultar o banco)")
+    parser.add_argument('--url', default=DEFAULT_PROXY_URL, help=f"URL do Image Proxy (padrão: {DEFAULT_PROXY_URL})")
+    parser.add_argument('--interval', type=float, default=2.0, help="segundos entre as consultas de progresso")
+    parser.add_argument('--no-wait', action='store_true', help="só dispara o job, sem acompanhar o progresso")
+    args = parser.parse_args()
+    if not (args.pos or args.all or args.refs):
+        parser.error("informe POs, --all ou --refs")
+    return args
+
+
+def load_references(args):
+    """Referências da view (POs ou --all) + as avulsas de --refs"""
+    references = list(args.refs)
+    if args.pos or args.all:
+        # importado aqui: --refs funciona sem psycopg2 / banco
+        from generate_rfid_export import create_db_connection, fetch_po_references
+
+        conn = create_db_connection()
+        try:
+            references.extend(fetch_po_references(conn, None if args.all else args.pos))
+        finally:
+            conn.close()
+    return references
+
+
+def print_progress(job):
+    counts = ", ".join(f"{key}={job[key]}" for key in ('fetched', 'cached', 'missing', 'invalid', 'failed'))
+    print(f"   {job['done']}/{job['total']} ({job['progress']:.0%}) {counts} - {job['elapsed']:.0f}s")
+
+
+def main():
+    args = parse_args()
+    references = load_references(args)
+    if not references:
+        print("⚠️ Nenhuma referência para aquecer")
+        return
+
+    base_url = args.url.rstrip('/')
+    print(f"🔥 Aquecendo {len(references)} referência(s) em {base_url}")
+    with httpx.Client(base_url=base_url, timeout=30) as client:
+        try:
+            resp = client.post('/images/prefetch', json={'references': references})
+            resp.raise_for_status()
+        except httpx.HTTPError as e:
+            print(f"❌ Erro ao iniciar o prefetch: {e}")
+            sys.exit(1)
+        job = resp.json()
+        print(f"✅ Job {job['id']} iniciado")
+        if args.no_wait:
+            return
+
+        try:
+            while job['state'] == 'running':
+                print_progress(job)
+                time.sleep(args.interval)
+                resp = client.get(f"/images/prefetch/{job['id']}")
+                resp.raise_for_status()
+                job = resp.json()
+        except KeyboardInterrupt:
+            client.delete(f"/images/prefetch/{job['id']}")
+            print("\n⚠️ Prefetch cancelado")
+            sys.exit(1)
+        except httpx.HTTPError as e:
+            print(f"❌ Erro ao consultar o progresso: {e}")
+            sys.exit(1)
+
+    print_progress(job)
+    for error in job['errors']:
+        print(f"   ⚠️ {error['reference']}: {error['result']} - {error['detail']}")
+    print(f"✅ Prefetch {job['state']}: {job['fetched']} baixada(s), {job['cached']} já em cache, "
+          f"{job['bytes_fetched'] / 1024 / 1024:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
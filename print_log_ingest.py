@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Registro em lote de etiquetas impressas em senda.print_log.
+
+As etiquetas vão por COPY para uma tabela temporária (staging) e entram na
+print_log com um único INSERT ... ON CONFLICT (epc_id) DO NOTHING: um PO inteiro
+é registrado de uma vez, e reimpressões (EPC já registrado) são só contadas.
+
+Uso:
+    python print_log_ingest.py etiquetas.csv [mais.csv ...]
+    (CSV com cabeçalho: epc_id, barcode, vpn, po, sequence)
+"""
+
+import argparse
+import csv
+import io
+import sys
+from dataclasses import dataclass
+
+from generate_rfid_export import create_db_connection, create_print_log_table
+
+# Colunas da print_log preenchidas na ingestão (o resto tem default)
+PRINT_LOG_FIELDS = ('epc_id', 'barcode', 'vpn', 'po', 'sequence')
+# Tamanhos das colunas (VARCHAR) em senda.print_log; valor maior derrubaria o COPY inteiro
+_MAX_LENGTHS = {'epc_id': 24, 'barcode': 50, 'vpn': 100, 'po': 50}
+# Faixa da coluna sequence (INTEGER)
+_SEQUENCE_RANGE = (-2 ** 31, 2 ** 31 - 1)
+
+_STAGING_TABLE = 'print_log_staging'
+
+
+@dataclass
+class PrintLogResult:
+    """Resultado de um registro em lote"""
+    received: int = 0
+    inserted: int = 0
+    duplicates: int = 0
+    invalid: int = 0
+
+
+def _label_values(label):
+    """Etiqueta (dict, registro com .get() ou tupla na ordem de PRINT_LOG_FIELDS) -> valores das colunas"""
+    if hasattr(label, 'get'):
+        values = [label.get(field) for field in PRINT_LOG_FIELDS]
+    else:
+        values = list(label)[:len(PRINT_LOG_FIELDS)]
+        values += [None] * (len(PRINT_LOG_FIELDS) - len(values))
+
+    *text, sequence = [_clean(value) for value in values]
+    return (*text, int(sequence) if sequence is not None else None)
+
+
+def _clean(value):
+    # Vazio vira NULL, como no registro unitário do backend (item.VPN || null)
+    if value is None:
+        return None
+    return str(value).strip() or None
+
+
+def _copy_value(value):
+    """Valor no formato texto do COPY (tab como separador, \\N = NULL)"""
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _copy_buffer(labels, result):
+    """Monta o conteúdo do COPY; etiquetas sem EPC, com valores maiores que as colunas
+    ou com sequence fora da faixa de INTEGER ficam de fora"""
+    buffer = io.StringIO()
+    for label in labels:
+        result.received += 1
+        try:
+            values = _label_values(label)
+        except ValueError:
+            print(f"   ⚠️ Etiqueta ignorada (sequence inválido): {label}")
+            result.invalid += 1
+            continue
+
+        if not values[0]:
+            result.invalid += 1
+            continue
+        too_long = [field for field, value in zip(PRINT_LOG_FIELDS, values)
+                    if field in _MAX_LENGTHS and value is not None and len(value) > _MAX_LENGTHS[field]]
+        if too_long:
+            print(f"   ⚠️ Etiqueta ignorada (EPC {values[0]}): {', '.join(too_long)} maior que a coluna")
+            result.invalid += 1
+            continue
+        sequence = values[-1]
+        if sequence is not None and not _SEQUENCE_RANGE[0] <= sequence <= _SEQUENCE_RANGE[1]:
+            print(f"   ⚠️ Etiqueta ignorada (EPC {values[0]}): sequence {sequence} fora da faixa de INTEGER")
+            result.invalid += 1
+            continue
+
+        buffer.write('\t'.join(_copy_value(value) for value in values))
+        buffer.write('\n')
+    buffer.seek(0)
+    return buffer
+
+
+def log_printed_labels(conn, labels, commit=True):
+    """
+    Registra um lote de etiquetas impressas em senda.print_log
+    labels: dicts (ou tuplas) com epc_id, barcode, vpn, po, sequence
+    EPCs já registrados (ou repetidos no lote) contam como duplicados.
+    A tabela precisa existir (create_print_log_table).
+    """
+    result = PrintLogResult()
+    buffer = _copy_buffer(labels, result)
+    valid = result.received - result.invalid
+    if not valid:
+        return result
+
+    columns = ', '.join(PRINT_LOG_FIELDS)
+    try:
+        with conn.cursor() as cur:
+            # Tabela temporária da sessão; esvaziada antes do lote e no commit
+            cur.execute(f"""
+                CREATE TEMP TABLE IF NOT EXISTS {_STAGING_TABLE} (
+                    epc_id VARCHAR(24),
+                    barcode VARCHAR(50),
+                    vpn VARCHAR(100),
+                    po VARCHAR(50),
+                    sequence INTEGER
+                ) ON COMMIT DELETE ROWS;
+                TRUNCATE {_STAGING_TABLE};
+            """)
+            cur.copy_expert(f"COPY {_STAGING_TABLE} ({columns}) FROM STDIN", buffer)
+            cur.execute(f"""
+                INSERT INTO senda.print_log ({columns})
+                SELECT {columns} FROM {_STAGING_TABLE}
+                ON CONFLICT (epc_id) DO NOTHING
+            """)
+            result.inserted = cur.rowcount
+        if commit:
+            conn.commit()
+    except Exception as e:
+        print(f"❌ Erro ao registrar etiquetas impressas: {e}")
+        conn.rollback()
+        raise
+
+    result.duplicates = valid - result.inserted
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Registra etiquetas impressas (CSV) em senda.print_log")
+    parser.add_argument('files', nargs='+', help="CSVs com cabeçalho: " + ', '.join(PRINT_LOG_FIELDS))
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    conn = create_db_connection()
+    try:
+        create_print_log_table(conn)
+        for path in args.files:
+            with open(path, newline='', encoding='utf-8-sig') as f:
+                result = log_printed_labels(conn, csv.DictReader(f))
+            print(f"✅ {path}: {result.inserted} registrada(s), {result.duplicates} já registrada(s), "
+                  f"{result.invalid} inválida(s) de {result.received}")
+    except Exception as e:
+        print(f"❌ Erro durante a execução: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# scripts da raiz (generate_rfid_export, print_log_ingest) importados como módulos
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
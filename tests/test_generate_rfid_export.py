@@ -0,0 +1,61 @@
+import random
+
+import pytest
+
+import generate_rfid_export as rfid
+
+BARCODES = ['', None, '123', '12345678901234', '-12', 'ABC123', '7891234567890', '0', 'çé12']
+PO_NUMBERS = ['PO123', 'po 9', '', None, 'PO12345678', 'X', 'PO²3', 'PO1', 'PO99999']
+QTYS = [0, 1, 2, 5, -1, 15, 120]
+# sequenciais já usados: vazios, virada de dígitos (99 -> 100) e longos (EPC maior que 24)
+START_SEQUENCES = [0, 8, 98, 99999, 10 ** 9 - 2]
+
+
+def expected_epcs(barcodes, po_numbers, qtys, po_sequences):
+    """Resultado unidade por unidade com generate_zebra_epc_id / epc_id_to_hex"""
+    epc_ids, epc_hex, rows = [], [], []
+    for row, (barcode, po, qty) in enumerate(zip(barcodes, po_numbers, qtys)):
+        for _ in range(qty):
+            po_sequences[po] = po_sequences.get(po, 0) + 1
+            epc_id = rfid.generate_zebra_epc_id(barcode, po, po_sequences[po], 24)
+            epc_ids.append(epc_id)
+            epc_hex.append(rfid.epc_id_to_hex(epc_id))
+            rows.append(row)
+    return epc_ids, epc_hex, rows
+
+
+@pytest.mark.parametrize('seed', range(300))
+def test_batch_epc_ids_match_scalar_function(seed):
+    rng = random.Random(seed)
+    size = rng.randint(0, 30)
+    barcodes = [rng.choice(BARCODES + [str(rng.randrange(10 ** 11, 10 ** 12))]) for _ in range(size)]
+    po_numbers = [rng.choice(PO_NUMBERS) for _ in range(size)]
+    qtys = [rng.choice(QTYS) for _ in range(size)]
+    po_sequences = {po: rng.choice(START_SEQUENCES) for po in set(po_numbers) if rng.random() < 0.5}
+    scalar_sequences = dict(po_sequences)
+
+    epc_ids, epc_hex, rows = rfid.generate_zebra_epc_ids(
+        barcodes, po_numbers, qtys, po_sequences=po_sequences, with_hex=True
+    )
+
+    assert (epc_ids, epc_hex, rows) == expected_epcs(barcodes, po_numbers, qtys, scalar_sequences)
+    # PO sem unidades pode ficar registrado com 0 (igual a não ter sido usado)
+    for po in set(po_sequences) | set(scalar_sequences):
+        assert po_sequences.get(po, 0) == scalar_sequences.get(po, 0)
+
+
+def test_batch_without_hex_and_empty_input():
+    epc_ids, epc_hex, rows = rfid.generate_zebra_epc_ids(['789123456789'], ['PO42'], [3])
+    assert epc_ids == [rfid.generate_zebra_epc_id('789123456789', 'PO42', seq) for seq in (1, 2, 3)]
+    assert epc_hex is None
+    assert rows == [0, 0, 0]
+
+    assert rfid.generate_zebra_epc_ids([], [], [], with_hex=True) == ([], [], [])
+
+
+def test_hex_of_largest_24_digit_epc():
+    epc_id = '9' * 24
+    epc_ids, epc_hex, _ = rfid.generate_zebra_epc_ids(['9' * 12], ['9' * 11], [1],
+                                                      po_sequences={'9' * 11: 8}, with_hex=True)
+    assert epc_ids == [epc_id]
+    assert epc_hex == [rfid.epc_id_to_hex(epc_id)]
@@ -0,0 +1,120 @@
+import pytest
+
+from print_log_ingest import PrintLogResult, _copy_buffer, log_printed_labels
+
+
+class FakeCursor:
+    """Cursor do psycopg2 simulado: guarda o COPY e devolve o rowcount configurado"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        self.conn.queries.append(query)
+        if query.lstrip().startswith('INSERT'):
+            if self.conn.fail_insert:
+                raise RuntimeError('insert falhou')
+            self.rowcount = self.conn.inserted
+
+    def copy_expert(self, query, buffer):
+        self.conn.copied = buffer.read()
+
+
+class FakeConnection:
+    def __init__(self, inserted=0, fail_insert=False):
+        self.inserted = inserted
+        self.fail_insert = fail_insert
+        self.queries = []
+        self.copied = None
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def copy_lines(labels):
+    result = PrintLogResult()
+    return _copy_buffer(labels, result).read().splitlines(), result
+
+
+def test_copy_escapes_tabs_backslashes_and_nulls():
+    lines, result = copy_lines([{
+        'epc_id': 'E1', 'barcode': 'a\tb', 'vpn': 'c\\d', 'po': '  ', 'sequence': None,
+    }])
+    assert lines == ['E1\ta\\tb\tc\\\\d\t\\N\t\\N']
+    assert result == PrintLogResult(received=1)
+
+
+def test_tuple_and_dict_labels_give_the_same_row():
+    lines, result = copy_lines([
+        ('E1', '789', 'VPN-1', 'PO1', '7'),
+        {'epc_id': 'E1', 'barcode': '789', 'vpn': 'VPN-1', 'po': 'PO1', 'sequence': 7},
+        ('E2', '789'),
+    ])
+    assert lines == ['E1\t789\tVPN-1\tPO1\t7', 'E1\t789\tVPN-1\tPO1\t7', 'E2\t789\t\\N\t\\N\t\\N']
+    assert result == PrintLogResult(received=3)
+
+
+@pytest.mark.parametrize('label', [
+    {'epc_id': '', 'barcode': '789'},
+    {'epc_id': None},
+    {'epc_id': 'E1', 'sequence': 'abc'},
+    {'epc_id': 'E' * 25},
+    {'epc_id': 'E1', 'barcode': '7' * 51},
+    {'epc_id': 'E1', 'vpn': 'V' * 101},
+    {'epc_id': 'E1', 'po': 'P' * 51},
+    {'epc_id': 'E1', 'sequence': 2 ** 31},
+    {'epc_id': 'E1', 'sequence': -2 ** 31 - 1},
+])
+def test_invalid_and_oversized_labels_are_skipped(label):
+    lines, result = copy_lines([label, {'epc_id': 'OK'}])
+    assert lines == ['OK\t\\N\t\\N\t\\N\t\\N']
+    assert result == PrintLogResult(received=2, invalid=1)
+
+
+def test_sequence_at_integer_limits_is_kept():
+    lines, _ = copy_lines([{'epc_id': 'E1', 'sequence': 2 ** 31 - 1}, {'epc_id': 'E2', 'sequence': -2 ** 31}])
+    assert [line.split('\t')[-1] for line in lines] == [str(2 ** 31 - 1), str(-2 ** 31)]
+
+
+def test_duplicates_are_valid_labels_not_inserted():
+    conn = FakeConnection(inserted=2)
+    labels = [{'epc_id': f'E{i}'} for i in range(4)] + [{'epc_id': ''}]
+
+    result = log_printed_labels(conn, labels)
+
+    assert result == PrintLogResult(received=5, inserted=2, duplicates=2, invalid=1)
+    assert conn.copied.count('\n') == 4
+    assert conn.commits == 1
+
+
+def test_without_valid_labels_nothing_is_sent():
+    conn = FakeConnection()
+    result = log_printed_labels(conn, [{'epc_id': ''}])
+    assert result == PrintLogResult(received=1, invalid=1)
+    assert conn.queries == [] and conn.commits == 0
+
+
+def test_commit_false_and_rollback_on_error():
+    conn = FakeConnection(inserted=1)
+    log_printed_labels(conn, [{'epc_id': 'E1'}], commit=False)
+    assert conn.commits == 0
+
+    failing = FakeConnection(fail_insert=True)
+    with pytest.raises(RuntimeError):
+        log_printed_labels(failing, [{'epc_id': 'E1'}])
+    assert failing.rollbacks == 1 and failing.commits == 0